@@ -1,20 +1,67 @@
+import asyncio
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 import uvicorn
-from src.routes import notes, tags, contacts, auth, users
+from src.routes import notes, tags, contacts, auth, users, internal
 from src import settings
-from fastapi_limiter import FastAPILimiter
+from src.services.auth import auth_service
+from src.services.avatars import avatar_uploader
+from src.services.cache import collection_versions, user_cache, user_versions
+from src.services.contacts_import import import_jobs
+from src.services.login_throttle import login_throttle
+from src.services.pagination import NEXT_CURSOR_HEADER
+from src.services.rate_limit import rate_limits
+from src.services.redis_pool import create_redis_pool
+from src.services.response_cache import response_cache
+from src.services.revocation import revocation_list
 import redis.asyncio as redis
 from fastapi.middleware.cors import CORSMiddleware
 
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # one connection pool for the rate limits, authentication and the caches
+    pool = create_redis_pool()
+    r = redis.Redis(connection_pool=pool)
+    app.state.redis_pool = pool
+    rate_limits.redis = r
+    auth_service.r = r
+    user_versions.redis = r
+    collection_versions.redis = r
+    login_throttle.redis = r
+    revocation_list.redis = r
+    import_jobs.redis = r
+    user_cache.broadcast = r
+    if settings.USER_CACHE_REDIS:
+        user_cache.redis = r
+    if settings.RESPONSE_CACHE_ENABLED:
+        response_cache.redis = r
+    revocation_listener = asyncio.create_task(revocation_list.listen())
+    user_cache_listener = asyncio.create_task(user_cache.listen())
+    rate_limit_sync = asyncio.create_task(rate_limits.run())
+    avatar_uploader.start()
+    yield
+    await avatar_uploader.close()
+    rate_limit_sync.cancel()
+    await rate_limits.sync()
+    rate_limits.redis = None
+    revocation_listener.cancel()
+    revocation_list.redis = None
+    import_jobs.redis = None
+    user_cache_listener.cancel()
+    user_cache.broadcast = None
+    auth_service.r = None
+    user_versions.redis = None
+    collection_versions.redis = None
+    login_throttle.redis = None
+    user_cache.redis = None
+    response_cache.redis = None
+    await r.aclose()
+    await pool.disconnect()
 
 
-@app.on_event("startup")
-async def startup():
-    r = await redis.Redis(host=settings.REDIS_HOST, port=settings.REDIS_PORT, db=0, encoding="utf-8",
-                          decode_responses=True)
-    await FastAPILimiter.init(r)
+app = FastAPI(lifespan=lifespan)
 
 
 origins = [
@@ -27,6 +74,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER, "ETag"],
 )
 
 
@@ -35,6 +83,7 @@ app.include_router(tags.router, prefix='/api')
 app.include_router(notes.router, prefix='/api')
 app.include_router(contacts.router, prefix='/api')
 app.include_router(users.router, prefix='/api')
+app.include_router(internal.router, prefix='/api')
 
 
 @app.get("/")
@@ -0,0 +1,30 @@
+"""add keyset pagination indexes
+
+Revision ID: 4b7c3afb5eaf
+Revises: 2182480b4205
+Create Date: 2026-10-18 18:00:59.341193
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '4b7c3afb5eaf'
+down_revision: Union[str, None] = '2182480b4205'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_notes_user_id_id', 'notes', ['user_id', 'id'])
+    op.create_index('ix_contacts_user_id_id', 'contacts', ['user_id', 'id'])
+    op.create_index('ix_tags_user_id_name_id', 'tags', ['user_id', 'name', 'id'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_tags_user_id_name_id', table_name='tags')
+    op.drop_index('ix_contacts_user_id_id', table_name='contacts')
+    op.drop_index('ix_notes_user_id_id', table_name='notes')
@@ -0,0 +1,27 @@
+"""add users avatar hash
+
+Revision ID: 98abfb54e88c
+Revises: 324e7b13f10a
+Create Date: 2026-10-18 18:36:05.090170
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '98abfb54e88c'
+down_revision: Union[str, None] = '324e7b13f10a'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('users', sa.Column('avatar_hash', sa.String(length=64), nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.drop_column('avatar_hash')
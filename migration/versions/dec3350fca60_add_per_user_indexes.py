@@ -0,0 +1,28 @@
+"""add per-user indexes
+
+Revision ID: dec3350fca60
+Revises: 4b7c3afb5eaf
+Create Date: 2026-10-18 18:04:15.310278
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'dec3350fca60'
+down_revision: Union[str, None] = '4b7c3afb5eaf'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_note_m2m_tag_note_id_tag_id', 'note_m2m_tag', ['note_id', 'tag_id'])
+    op.create_index('ix_note_m2m_tag_tag_id_note_id', 'note_m2m_tag', ['tag_id', 'note_id'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_note_m2m_tag_tag_id_note_id', table_name='note_m2m_tag')
+    op.drop_index('ix_note_m2m_tag_note_id_tag_id', table_name='note_m2m_tag')
@@ -0,0 +1,68 @@
+"""add contact search index
+
+Revision ID: dfc7402f3148
+Revises: dec3350fca60
+Create Date: 2026-10-18 18:12:41.416795
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'dfc7402f3148'
+down_revision: Union[str, None] = 'dec3350fca60'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        # CONCURRENTLY does not lock contacts against writes while the index is built,
+        # it can not run inside a transaction. A failed build leaves an INVALID index behind:
+        # drop it before running the migration again, IF NOT EXISTS would keep it
+        with op.get_context().autocommit_block():
+            op.execute(
+                "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_contacts_search_trgm ON contacts USING gin "
+                "((coalesce(first_name, '') || ' ' || coalesce(last_name, '') || ' ' || coalesce(email, '') || ' ' "
+                "|| coalesce(phone_number, '')) gin_trgm_ops)"
+            )
+    elif dialect == 'sqlite':
+        op.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS contacts_fts USING fts5("
+            "first_name, last_name, email, phone_number, content='contacts', content_rowid='id', tokenize='trigram')"
+        )
+        op.execute(
+            "CREATE TRIGGER IF NOT EXISTS contacts_fts_insert AFTER INSERT ON contacts BEGIN "
+            "INSERT INTO contacts_fts(rowid, first_name, last_name, email, phone_number) "
+            "VALUES (new.id, new.first_name, new.last_name, new.email, new.phone_number); END"
+        )
+        op.execute(
+            "CREATE TRIGGER IF NOT EXISTS contacts_fts_delete AFTER DELETE ON contacts BEGIN "
+            "INSERT INTO contacts_fts(contacts_fts, rowid, first_name, last_name, email, phone_number) "
+            "VALUES ('delete', old.id, old.first_name, old.last_name, old.email, old.phone_number); END"
+        )
+        op.execute(
+            "CREATE TRIGGER IF NOT EXISTS contacts_fts_update AFTER UPDATE ON contacts BEGIN "
+            "INSERT INTO contacts_fts(contacts_fts, rowid, first_name, last_name, email, phone_number) "
+            "VALUES ('delete', old.id, old.first_name, old.last_name, old.email, old.phone_number); "
+            "INSERT INTO contacts_fts(rowid, first_name, last_name, email, phone_number) "
+            "VALUES (new.id, new.first_name, new.last_name, new.email, new.phone_number); END"
+        )
+        # index the contacts that already exist
+        op.execute("INSERT INTO contacts_fts(contacts_fts) VALUES ('rebuild')")
+
+
+def downgrade() -> None:
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        with op.get_context().autocommit_block():
+            op.execute('DROP INDEX CONCURRENTLY IF EXISTS ix_contacts_search_trgm')
+    elif dialect == 'sqlite':
+        for trigger in ('contacts_fts_insert', 'contacts_fts_delete', 'contacts_fts_update'):
+            op.execute(f'DROP TRIGGER IF EXISTS {trigger}')
+        op.execute('DROP TABLE IF EXISTS contacts_fts')
@@ -1,17 +1,136 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from itertools import cycle
+from typing import Iterator, Optional
+
+from fastapi import Depends
+from sqlalchemy import Select
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
+from sqlalchemy.orm import Session
 from src import settings
+from src.database.pool import InstrumentedQueuePool
 
 SQLALCHEMY_DATABASE_URL = settings.DATABASE_URL
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+}
+
+
+def get_async_url(url: str) -> str:
+    """
+    The get_async_url function turns a synchronous database URL (the one alembic uses)
+    into the equivalent URL for an async driver: asyncpg for Postgres and aiosqlite for SQLite.
+
+    :param url: str: The database URL from the settings
+    :return: The same URL with the async driver name
+    :doc-author: AR
+    """
+    url = make_url(url)
+    drivername = ASYNC_DRIVERS.get(url.get_backend_name(), url.drivername)
+    return url.set(drivername=drivername).render_as_string(hide_password=False)
+
+
+def create_pooled_engine(url: str):
+    """
+    The create_pooled_engine function creates an async engine with the pool configured from the settings.
+
+    :param url: str: The async database URL
+    :return: An AsyncEngine
+    :doc-author: AR
+    """
+    return create_async_engine(
+        url,
+        poolclass=InstrumentedQueuePool,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+        pool_pre_ping=settings.DB_POOL_PRE_PING,
+    )
+
+
+class RoutingSession(Session):
+    """
+    Session that sends reads to a read replica and everything else to the primary.
+
+    Replicas are handed out round-robin, one per session, so a request sees a single replica.
+    As soon as the session writes (flush, INSERT/UPDATE/DELETE or SELECT ... FOR UPDATE) it sticks
+    to the primary, so reads that follow a write in the same request see that write.
+    A session that reads rows in order to change them must be pinned to the primary before the first
+    read (pin_primary), a row loaded from a lagging replica would be written back over newer data.
+    """
+
+    def __init__(self, *args, replicas: Optional[Iterator[Engine]] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.replicas = replicas
+        self.replica = None
+        self.use_primary = replicas is None
+
+    def get_bind(self, mapper=None, *, clause=None, **kwargs):
+        if not self.use_primary:
+            is_read = isinstance(clause, Select) and clause._for_update_arg is None
+            if self._flushing or not is_read:
+                self.use_primary = True
+            else:
+                if self.replica is None:
+                    self.replica = next(self.replicas)
+                return self.replica
+        return super().get_bind(mapper, clause=clause, **kwargs)
+
+
+def pin_primary(db: AsyncSession) -> AsyncSession:
+    """
+    The pin_primary function makes every following statement of the session, reads included, go to the primary.
+
+    :param db: AsyncSession: The session
+    :return: The same session
+    :doc-author: AR
+    """
+    session = getattr(db, "sync_session", None)
+    if isinstance(session, RoutingSession):
+        session.use_primary = True
+    return db
+
+
+def reads_from_primary(db: AsyncSession) -> bool:
+    """
+    The reads_from_primary function tells whether the reads of the session go to the primary,
+    only then can their result be tagged with the current version of the data (ETags, response cache).
+
+    :param db: AsyncSession: The session
+    :return: True when the session has no replica to read from or is pinned to the primary
+    :doc-author: AR
+    """
+    session = getattr(db, "sync_session", None)
+    return not isinstance(session, RoutingSession) or session.use_primary
+
+
+SQLALCHEMY_ASYNC_DATABASE_URL = settings.ASYNC_DATABASE_URL or get_async_url(SQLALCHEMY_DATABASE_URL)
+engine = create_pooled_engine(SQLALCHEMY_ASYNC_DATABASE_URL)
+replica_engines = [create_pooled_engine(get_async_url(url)) for url in settings.DATABASE_REPLICA_URLS]
+
+SessionLocal = async_sessionmaker(
+    autoflush=False,
+    expire_on_commit=False,
+    bind=engine,
+    sync_session_class=RoutingSession,
+    replicas=cycle([replica.sync_engine for replica in replica_engines]) if replica_engines else None,
+)
 
 
 # Dependency
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with SessionLocal() as db:
         yield db
-    finally:
-        db.close()
+
+
+# Dependency of the endpoints that change data: everything they read comes from the primary
+async def get_primary_db(db: AsyncSession = Depends(get_db)):
+    return pin_primary(db)
+
+
+# Dependency for responses that keep using the database after the endpoint returned (streaming),
+# the session from get_db is already closed by then
+def get_session_factory():
+    return SessionLocal
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, func, Table, UniqueConstraint
+from sqlalchemy import Column, Integer, String, Boolean, func, Table, UniqueConstraint, Index, DDL, event
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql.schema import ForeignKey
 from sqlalchemy.sql.sqltypes import DateTime
@@ -12,11 +12,16 @@ note_m2m_tag = Table(
     Column("id", Integer, primary_key=True),
     Column("note_id", Integer, ForeignKey("notes.id", ondelete="CASCADE")),
     Column("tag_id", Integer, ForeignKey("tags.id", ondelete="CASCADE")),
+    Index("ix_note_m2m_tag_note_id_tag_id", "note_id", "tag_id"),
+    Index("ix_note_m2m_tag_tag_id_note_id", "tag_id", "note_id"),
 )
 
 
 class Note(Base):
     __tablename__ = "notes"
+    __table_args__ = (
+        Index('ix_notes_user_id_id', 'user_id', 'id'),
+    )
     id = Column(Integer, primary_key=True)
     title = Column(String(50), nullable=False)
     created_at = Column('created_at', DateTime, default=func.now())
@@ -31,6 +36,7 @@ class Tag(Base):
     __tablename__ = "tags"
     __table_args__ = (
         UniqueConstraint('name', 'user_id', name='unique_tag_user'),
+        Index('ix_tags_user_id_name_id', 'user_id', 'name', 'id'),
     )
     id = Column(Integer, primary_key=True)
     name = Column(String(25), nullable=False)
@@ -46,12 +52,48 @@ class User(Base):
     password = Column(String(255), nullable=False)
     created_at = Column('crated_at', DateTime, default=func.now())
     avatar = Column(String(255), nullable=True)
-    refresh_token = Column(String(255), nullable=True)
+    # sha256 of the uploaded avatar, the same picture is not uploaded again
+    avatar_hash = Column(String(64), nullable=True)
     confirmed = Column(Boolean, default=False)
 
 
+class RefreshToken(Base):
+    # one row per login session, used when Redis is not available (src.services.refresh_tokens)
+    __tablename__ = "refresh_tokens"
+    __table_args__ = (
+        Index('ix_refresh_tokens_user_id', 'user_id'),
+    )
+    id = Column(Integer, primary_key=True)
+    session_id = Column(String(32), nullable=False, unique=True)
+    jti = Column(String(32), nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+    user_id = Column('user_id', ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+
+
+class OutboxEmail(Base):
+    # confirmation emails written by the web process and sent by the mail worker (worker.py)
+    __tablename__ = "email_outbox"
+    __table_args__ = (
+        Index('ix_email_outbox_status_next_attempt_at', 'status', 'next_attempt_at'),
+    )
+    id = Column(Integer, primary_key=True)
+    email = Column(String(250), nullable=False)
+    username = Column(String(50), nullable=False)
+    host = Column(String(255), nullable=False)
+    # pending -> sending -> sent, or dead after the last failed attempt
+    status = Column(String(16), nullable=False, default="pending")
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=False)
+    last_error = Column(String, nullable=True)
+    created_at = Column('created_at', DateTime, default=func.now())
+    sent_at = Column(DateTime, nullable=True)
+
+
 class Contact(Base):
     __tablename__ = 'contacts'
+    __table_args__ = (
+        Index('ix_contacts_user_id_id', 'user_id', 'id'),
+    )
     id = Column(Integer, primary_key=True)
     first_name = Column(String)
     last_name = Column(String)
@@ -61,4 +103,39 @@ class Contact(Base):
     created_at = Column('created_at', DateTime, default=func.now())
     additional_data = Column(String, nullable=True)
     user_id = Column('user_id', ForeignKey('users.id', ondelete='CASCADE'), default=None)
-    user = relationship('User', backref="contacts")
\ No newline at end of file
+    user = relationship('User', backref="contacts")
+
+
+# Contact search (src.repository.contacts.search_contacts).
+# Postgres: trigram GIN index on the searched columns, so ILIKE '%q%' does not scan the table.
+# SQLite: FTS5 trigram table kept in sync with contacts by triggers.
+CONTACT_SEARCH_COLUMNS = ("first_name", "last_name", "email", "phone_number")
+
+CONTACT_SEARCH_POSTGRES_DDL = (
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_contacts_search_trgm ON contacts USING gin "
+    "((coalesce(first_name, '') || ' ' || coalesce(last_name, '') || ' ' || coalesce(email, '') || ' ' "
+    "|| coalesce(phone_number, '')) gin_trgm_ops)",
+)
+
+CONTACT_SEARCH_SQLITE_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS contacts_fts USING fts5("
+    "first_name, last_name, email, phone_number, content='contacts', content_rowid='id', tokenize='trigram')",
+    "CREATE TRIGGER IF NOT EXISTS contacts_fts_insert AFTER INSERT ON contacts BEGIN "
+    "INSERT INTO contacts_fts(rowid, first_name, last_name, email, phone_number) "
+    "VALUES (new.id, new.first_name, new.last_name, new.email, new.phone_number); END",
+    "CREATE TRIGGER IF NOT EXISTS contacts_fts_delete AFTER DELETE ON contacts BEGIN "
+    "INSERT INTO contacts_fts(contacts_fts, rowid, first_name, last_name, email, phone_number) "
+    "VALUES ('delete', old.id, old.first_name, old.last_name, old.email, old.phone_number); END",
+    "CREATE TRIGGER IF NOT EXISTS contacts_fts_update AFTER UPDATE ON contacts BEGIN "
+    "INSERT INTO contacts_fts(contacts_fts, rowid, first_name, last_name, email, phone_number) "
+    "VALUES ('delete', old.id, old.first_name, old.last_name, old.email, old.phone_number); "
+    "INSERT INTO contacts_fts(rowid, first_name, last_name, email, phone_number) "
+    "VALUES (new.id, new.first_name, new.last_name, new.email, new.phone_number); END",
+)
+
+for statement in CONTACT_SEARCH_POSTGRES_DDL:
+    event.listen(Contact.__table__, "after_create", DDL(statement).execute_if(dialect="postgresql"))
+for statement in CONTACT_SEARCH_SQLITE_DDL:
+    event.listen(Contact.__table__, "after_create", DDL(statement).execute_if(dialect="sqlite"))
+event.listen(Contact.__table__, "before_drop", DDL("DROP TABLE IF EXISTS contacts_fts").execute_if(dialect="sqlite"))
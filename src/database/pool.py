@@ -0,0 +1,66 @@
+import time
+
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from src.services.latency import LatencyStats
+
+
+class PoolStats(LatencyStats):
+    """
+    Counters collected by InstrumentedQueuePool: how long every checkout waited to get a connection
+    from the pool and the number of checkouts that timed out.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.timeouts = 0
+
+
+class InstrumentedQueuePool(AsyncAdaptedQueuePool):
+    """
+    AsyncAdaptedQueuePool that measures how long every checkout waits for a connection.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except Exception:
+            self.stats.timeouts += 1
+            raise
+        self.stats.observe(time.perf_counter() - start)
+        return connection
+
+    def recreate(self):
+        # engine.dispose() and invalidation swap the pool, the counters must survive it
+        pool = super().recreate()
+        pool.stats = self.stats
+        return pool
+
+
+def get_pool_status(pool) -> dict:
+    """
+    The get_pool_status function collects the live state and the counters of a connection pool.
+
+    :param pool: The pool of an engine (engine.pool)
+    :return: A dict with the pool configuration, usage and checkout wait statistics
+    :doc-author: AR
+    """
+    status = {"pool_class": type(pool).__name__}
+    if hasattr(pool, "checkedout"):
+        status.update({
+            "size": pool.size(),
+            "checked_in": pool.checkedin(),
+            "checked_out": pool.checkedout(),
+            "overflow": pool.overflow(),
+            "timeout": pool.timeout(),
+        })
+    stats = getattr(pool, "stats", None)
+    if stats is not None:
+        status["timeouts"] = stats.timeouts
+        status.update(stats.as_dict("wait_time", count="checkouts"))
+    return status
@@ -1,27 +1,108 @@
-from typing import List
-from sqlalchemy import and_
-from sqlalchemy.orm import Session
+from typing import AsyncIterator, List, Optional
+from sqlalchemy import and_, column, func, insert, literal_column, or_, select, table
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from src.database.models import Contact, User
+from src.database.db import pin_primary
+from src.database.models import Contact, User, CONTACT_SEARCH_COLUMNS
 from src.schemas import ContactCreate, ContactUpdate
+from src.services.cache import collection_versions
 
 
-async def get_contacts(skip: int, limit: int, user: User, db: Session) -> List[Contact]:
+async def get_contacts(skip: int, limit: int, user: User, db: AsyncSession,
+                       after: Optional[int] = None) -> List[Contact]:
 
     """
-    The get_contacts function returns a list of contacts for the user.
+    The get_contacts function returns a list of contacts for the user, oldest first.
+    When after is given the page starts right after the contact with that id and skip is ignored.
 
     :param skip: int: Skip a number of rows in the database
     :param limit: int: Limit the number of contacts returned
     :param user: User: Filter the contacts by user
-    :param db: Session: Pass the database session to the function
+    :param db: AsyncSession: Pass the database session to the function
+    :param after: Optional[int]: The id of the last contact of the previous page
     :return: A list of contacts for the given user
     :doc-author: AR
     """
-    return db.query(Contact).filter(Contact.user_id == user.id).offset(skip).limit(limit).all()
+    stmt = select(Contact).where(Contact.user_id == user.id)
+    if after is not None:
+        stmt = stmt.where(Contact.id > after)
+    else:
+        stmt = stmt.offset(skip)
+    stmt = stmt.order_by(Contact.id).limit(limit)
+    result = await db.execute(stmt)
+    return result.scalars().all()
 
 
-async def get_contact(contact_id: int, user: User, db: Session) -> Contact:
+async def stream_contacts(user: User, db: AsyncSession, batch_size: int = 500) -> AsyncIterator[Contact]:
+    """
+    The stream_contacts function yields all contacts of the user, oldest first.
+        Rows are fetched from a server-side cursor batch_size at a time, so memory use does not
+        depend on the number of contacts.
+
+    :param user: User: Owner of the contacts
+    :param db: AsyncSession: Access the database
+    :param batch_size: int: Number of rows fetched per round trip
+    :return: An async iterator of contacts
+    :doc-author: AR
+    """
+    stmt = select(Contact).where(Contact.user_id == user.id).order_by(Contact.id)
+    result = await db.stream_scalars(stmt.execution_options(yield_per=batch_size))
+    async for contact in result:
+        yield contact
+
+
+# trigram indexes only help for queries of at least three characters
+SEARCH_MIN_TRIGRAM_LENGTH = 3
+
+# FTS5 table created next to contacts on SQLite, see src.database.models
+contacts_fts = table("contacts_fts", column("rowid"))
+
+
+def _search_pattern(q: str) -> str:
+    escaped = q.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+async def search_contacts(q: str, limit: int, user: User, db: AsyncSession) -> List[Contact]:
+    """
+    The search_contacts function finds the contacts of the user whose first name, last name,
+    email or phone number contains q (case-insensitive), best matches first.
+        Postgres uses the pg_trgm index on the searched columns and ranks by word similarity,
+        SQLite uses the contacts_fts table and ranks by bm25. Queries shorter than three characters
+        cannot use a trigram index and fall back to LIKE over the user's contacts.
+
+    :param q: str: The text to search for
+    :param limit: int: Maximum number of contacts returned
+    :param user: User: Owner of the contacts
+    :param db: AsyncSession: Access the database
+    :return: A list of contacts
+    :doc-author: AR
+    """
+    # literals instead of bound parameters, Postgres only matches the index expression against constants
+    columns = [func.coalesce(getattr(Contact, name), literal_column("''")) for name in CONTACT_SEARCH_COLUMNS]
+    stmt = select(Contact).where(Contact.user_id == user.id)
+    dialect = db.bind.dialect.name
+    if dialect == "postgresql":
+        # same expression as ix_contacts_search_trgm, otherwise the index is not used
+        document = columns[0]
+        for column in columns[1:]:
+            document = document.op("||")(literal_column("' '")).op("||")(column)
+        stmt = stmt.where(document.ilike(_search_pattern(q), escape="\\"))
+        stmt = stmt.order_by(func.word_similarity(q, document).desc(), Contact.id)
+    elif dialect == "sqlite" and len(q) >= SEARCH_MIN_TRIGRAM_LENGTH:
+        fts = literal_column(contacts_fts.name)
+        stmt = stmt.join(contacts_fts, contacts_fts.c.rowid == Contact.id)
+        stmt = stmt.where(fts.match('"' + q.replace('"', '""') + '"'))
+        stmt = stmt.order_by(func.bm25(fts), Contact.id)
+    else:
+        pattern = _search_pattern(q)
+        stmt = stmt.where(or_(*[column.ilike(pattern, escape="\\") for column in columns]))
+        stmt = stmt.order_by(Contact.id)
+    result = await db.execute(stmt.limit(limit))
+    return result.scalars().all()
+
+
+async def get_contact(contact_id: int, user: User, db: AsyncSession) -> Contact:
     """
     The get_contact function takes in a contact_id and user, and returns the contact with that id.
         Args:
@@ -30,14 +111,16 @@ async def get_contact(contact_id: int, user: User, db: Session) -> Contact:
 
     :param contact_id: int: Specify the contact id that is being searched for
     :param user: User: Get the user id of the current logged in user
-    :param db: Session: Pass the database session to the function
+    :param db: AsyncSession: Pass the database session to the function
     :return: A contact object for a given user, if it exists
     :doc-author: AR
     """
-    return db.query(Contact).filter(and_(Contact.id == contact_id, Contact.user_id == user.id)).first()
+    stmt = select(Contact).where(and_(Contact.id == contact_id, Contact.user_id == user.id))
+    result = await db.execute(stmt)
+    return result.scalars().first()
 
 
-async def create_contact(body: ContactCreate, user: User, db: Session) -> Contact:
+async def create_contact(body: ContactCreate, user: User, db: AsyncSession) -> Contact:
     """
     The create_contact function creates a new contact in the database.
         Args:
@@ -46,19 +129,42 @@ async def create_contact(body: ContactCreate, user: User, db: Session) -> Contac
 
     :param body: ContactCreate: Get the data from the request body
     :param user: User: Get the user id from the token
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
     :return: The contact object
     :doc-author: AR
     """
     contact = Contact(first_name=body.first_name, last_name=body.last_name, email=body.email,
-                      phone_number=body.phone_number, birthday=body.birthday, additional_data=body.additional_data, user=user)
+                      phone_number=body.phone_number, birthday=body.birthday, additional_data=body.additional_data, user_id=user.id)
     db.add(contact)
-    db.commit()
-    db.refresh(contact)
+    await db.commit()
+    await db.refresh(contact)
+    await collection_versions.bump("contacts", user.id)
     return contact
 
 
-async def remove_contact(contact_id: int,  user: User, db: Session) -> Contact | None:
+async def create_contacts(bodies: List[ContactCreate], user: User, db: AsyncSession) -> List[int]:
+    """
+    The create_contacts function inserts many contacts in one transaction.
+        The rows are sent as multi-row INSERT ... RETURNING statements instead of one round trip per contact.
+
+    :param bodies: List[ContactCreate]: The contacts to create
+    :param user: User: Owner of the new contacts
+    :param db: AsyncSession: Access the database
+    :return: Ids of the new contacts, in the order of bodies
+    :doc-author: AR
+    """
+    if not bodies:
+        return []
+    # RETURNING itself does not promise any order, SQLAlchemy returns the ids in the order of the parameters
+    stmt = insert(Contact).returning(Contact.id, sort_by_parameter_order=True)
+    result = await db.execute(stmt, [{**body.model_dump(), "user_id": user.id} for body in bodies])
+    ids = result.scalars().all()
+    await db.commit()
+    await collection_versions.bump("contacts", user.id)
+    return ids
+
+
+async def remove_contact(contact_id: int,  user: User, db: AsyncSession) -> Contact | None:
     """
     The remove_contact function removes a contact from the database.
     Args:
@@ -68,18 +174,20 @@ async def remove_contact(contact_id: int,  user: User, db: Session) -> Contact |
 
     :param contact_id: int: Identify the contact to be deleted
     :param user: User: Identify the user who is making the request
-    :param db: Session: Pass in the database session
+    :param db: AsyncSession: Pass in the database session
     :return: The contact object that was removed from the database
     :doc-author: Trelent
     """
-    contact = db.query(Contact).filter(and_(Contact.id == contact_id, Contact.user_id == user.id)).first()
-    if Contact:
-        db.delete(contact)
-        db.commit()
+    pin_primary(db)
+    contact = await get_contact(contact_id, user, db)
+    if contact:
+        await db.delete(contact)
+        await db.commit()
+        await collection_versions.bump("contacts", user.id)
     return contact
 
 
-async def update_contact(contact_id: int, body: ContactUpdate, user: User, db: Session) -> Contact | None:
+async def update_contact(contact_id: int, body: ContactUpdate, user: User, db: AsyncSession) -> Contact | None:
     """
     The update_contact function updates a contact in the database.
         Args:
@@ -90,11 +198,12 @@ async def update_contact(contact_id: int, body: ContactUpdate, user: User, db: S
     :param contact_id: int: Specify the contact to be deleted
     :param body: ContactUpdate: Pass in the updated contact information
     :param user: User: Get the user_id from the token
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
     :return: A contact object
     :doc-author: Trelent
     """
-    contact = db.query(Contact).filter(and_(Contact.id == contact_id, Contact.user_id == user.id)).first()
+    pin_primary(db)
+    contact = await get_contact(contact_id, user, db)
     if contact:
         contact.first_name = body.first_name
         contact.last_name = body.last_name
@@ -102,7 +211,8 @@ async def update_contact(contact_id: int, body: ContactUpdate, user: User, db: S
         contact.phone_number = body.phone_number
         contact.birthday = body.birthday
         contact.additional_data = body.additional_data
-        db.commit()
+        await db.commit()
+        await collection_versions.bump("contacts", user.id)
     return contact
 
 
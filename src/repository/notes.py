@@ -1,26 +1,57 @@
-from typing import List, Union
+from typing import AsyncIterator, List, Optional, Union
 
-from sqlalchemy import and_
-from sqlalchemy.orm import Session
+from sqlalchemy import and_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
 
+from src.database.db import pin_primary
 from src.database.models import Note, Tag, User
 from src.schemas import NoteModel, NoteUpdate, NoteStatusUpdate
+from src.services.cache import collection_versions
 
 
-async def get_notes(skip: int, limit: int, user: User, db: Session) -> List[Note]:
+async def get_notes(skip: int, limit: int, user: User, db: AsyncSession,
+                    after: Optional[int] = None) -> List[Note]:
     """
-    The get_notes function returns a list of notes for the given user.
+    The get_notes function returns a list of notes for the given user, oldest first.
+    When after is given the page starts right after the note with that id and skip is ignored.
     :param skip: int: Skip the first n notes
     :param limit: int: Limit the number of notes that are returned
     :param user: User: Get the user_id from the database
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
+    :param after: Optional[int]: The id of the last note of the previous page
     :return: A list of notes for a particular user
     :doc-author: AR
     """
-    return db.query(Note).filter(Note.user_id == user.id).offset(skip).limit(limit).all()
+    stmt = select(Note).options(selectinload(Note.tags)).where(Note.user_id == user.id)
+    if after is not None:
+        stmt = stmt.where(Note.id > after)
+    else:
+        stmt = stmt.offset(skip)
+    stmt = stmt.order_by(Note.id).limit(limit)
+    result = await db.execute(stmt)
+    return result.scalars().all()
 
 
-async def get_note(note_id: int, user: User, db: Session) -> Note:
+async def stream_notes(user: User, db: AsyncSession, batch_size: int = 500) -> AsyncIterator[Note]:
+    """
+    The stream_notes function yields all notes of the user with their tags, oldest first.
+        Rows are fetched from a server-side cursor batch_size at a time and the tags of every batch
+        are loaded with one query, so memory use does not depend on the number of notes.
+
+    :param user: User: Owner of the notes
+    :param db: AsyncSession: Access the database
+    :param batch_size: int: Number of rows fetched per round trip
+    :return: An async iterator of notes
+    :doc-author: AR
+    """
+    stmt = select(Note).options(selectinload(Note.tags)).where(Note.user_id == user.id).order_by(Note.id)
+    result = await db.stream_scalars(stmt.execution_options(yield_per=batch_size))
+    async for note in result:
+        yield note
+
+
+async def get_note(note_id: int, user: User, db: AsyncSession) -> Note:
     """
     The get_note function takes in a note_id and user, and returns the Note object with that id.
         Args:
@@ -29,52 +60,71 @@ async def get_note(note_id: int, user: User, db: Session) -> Note:
 
     :param note_id: int: Get the note with the given id
     :param user: User: Get the user who is making the request
-    :param db: Session: Pass the database session to the function
+    :param db: AsyncSession: Pass the database session to the function
     :return: A note object from the database
     :doc-author: AR
     """
-    return db.query(Note).filter(and_(Note.id == note_id, Note.user_id == user.id)).first()
+    stmt = select(Note).options(selectinload(Note.tags)).where(and_(Note.id == note_id, Note.user_id == user.id))
+    result = await db.execute(stmt)
+    return result.scalars().first()
+
+
+async def get_user_tags(tag_ids: List[int], user: User, db: AsyncSession) -> List[Tag]:
+    """
+    The get_user_tags function returns the tags with the given ids that belong to the user.
+
+    :param tag_ids: List[int]: Ids of the tags to attach to a note
+    :param user: User: Only tags of this user are returned
+    :param db: AsyncSession: Access the database
+    :return: A list of tags
+    :doc-author: AR
+    """
+    stmt = select(Tag).where(and_(Tag.id.in_(tag_ids), Tag.user_id == user.id))
+    result = await db.execute(stmt)
+    return result.scalars().all()
 
 
-async def create_note(body: NoteModel, user: User, db: Session) -> Note:
+async def create_note(body: NoteModel, user: User, db: AsyncSession) -> Note:
     """
     The create_note function creates a new note in the database.
     :param body: NoteModel: Get the title, description and tags from the request body
     :param user: User: Get the user from the database
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
     :return: A note object
     :doc-author: AR
     """
-    tags = db.query(Tag).filter(and_(Tag.id.in_(body.tags), Tag.user_id == user.id)).all()
-    note = Note(title=body.title, description=body.description, tags=tags, user=user)
+    tags = await get_user_tags(body.tags, user, db)
+    note = Note(title=body.title, description=body.description, tags=tags, user_id=user.id)
     db.add(note)
-    db.commit()
-    db.refresh(note)
+    await db.commit()
+    await collection_versions.bump("notes", user.id)
     return note
 
 
-async def remove_note(note_id: int, user: User, db: Session) -> Union[Note, None]:
+async def remove_note(note_id: int, user: User, db: AsyncSession) -> Union[Note, None]:
     """
     The remove_note function removes a note from the database.
         Args:
             note_id (int): The id of the note to be removed.
             user (User): The user who owns the note to be removed.
-            db (Session): A connection to our database, used for querying and deleting notes.
+            db (AsyncSession): A connection to our database, used for querying and deleting notes.
 
     :param note_id: int: Identify the note to be removed
     :param user: User: Identify the user who is making the request
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
     :return: The note that was removed
     :doc-author: AR
     """
-    note = db.query(Note).filter(and_(Note.id == note_id, Note.user_id == user.id)).first()
+    pin_primary(db)
+    note = await get_note(note_id, user, db)
     if note:
-        db.delete(note)
-        db.commit()
+        await db.delete(note)
+        await db.commit()
+        await collection_versions.bump("notes", user.id)
     return note
 
 
-async def update_note(note_id: int, body: NoteUpdate, user: User, db: Session) -> Union[Note, None]:
+async def update_note(note_id: int, body: NoteUpdate, user: User, db: AsyncSession) -> Union[Note, None]:
 
     """
     The update_note function updates a note in the database.
@@ -82,22 +132,24 @@ async def update_note(note_id: int, body: NoteUpdate, user: User, db: Session) -
     :param note_id: int: Identify the note to be deleted
     :param body: NoteUpdate: Pass in the updated note information
     :param user: User: Check if the user is authorized to make changes to the note
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
     :return: The updated note if the user is authorized to update it, otherwise none
     :doc-author: AR
     """
-    note = db.query(Note).filter(and_(Note.id == note_id, Note.user_id == user.id)).first()
+    pin_primary(db)
+    note = await get_note(note_id, user, db)
     if note:
-        tags = db.query(Tag).filter(and_(Tag.id.in_(body.tags), Note.user_id == user.id)).all()
+        tags = await get_user_tags(body.tags, user, db)
         note.title = body.title
         note.description = body.description
         note.done = body.done
         note.tags = tags
-        db.commit()
+        await db.commit()
+        await collection_versions.bump("notes", user.id)
     return note
 
 
-async def update_status_note(note_id: int, body: NoteStatusUpdate, user: User, db: Session) -> Union[Note, None]:
+async def update_status_note(note_id: int, body: NoteStatusUpdate, user: User, db: AsyncSession) -> Union[Note, None]:
 
     """
     The update_status_note function updates a note in the database.
@@ -105,12 +157,14 @@ async def update_status_note(note_id: int, body: NoteStatusUpdate, user: User, d
     :param note_id: int: Identify the note to be deleted
     :param body: NoteStatusUpdate: Pass in the updated note information
     :param user: User: Check if the user is authorized to make changes to the note
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
     :return: The updated note if the user is authorized to update it, otherwise none
     :doc-author: AR
     """
-    note = db.query(Note).filter(and_(Note.id == note_id, Note.user_id == user.id)).first()
+    pin_primary(db)
+    note = await get_note(note_id, user, db)
     if note:
         note.done = body.done
-        db.commit()
+        await db.commit()
+        await collection_versions.bump("notes", user.id)
     return note
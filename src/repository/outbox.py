@@ -0,0 +1,144 @@
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+from sqlalchemy import func, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.database.models import OutboxEmail
+
+CLAIMABLE = ("pending", "sending")
+# last_error of an email whose last attempt never reported a result
+LEASE_EXPIRED = "lease expired during the last attempt"
+
+
+def new_confirmation_email(email: str, username: str, host: str) -> OutboxEmail:
+    """
+    The new_confirmation_email function creates the outbox row of the email that confirms the address of a user,
+        to be added to the session of the caller.
+
+    :param email: str: The address of the user
+    :param username: str: Pass the username to the email template
+    :param host: str: The base URL of the application, used in the confirmation link
+    :return: The OutboxEmail, due now
+    :doc-author: AR
+    """
+    return OutboxEmail(email=email, username=username, host=host, status="pending", attempts=0,
+                       next_attempt_at=datetime.utcnow())
+
+
+async def add_confirmation_email(email: str, username: str, host: str, db: AsyncSession) -> OutboxEmail:
+    """
+    The add_confirmation_email function queues the email that confirms the address of a user.
+        It is sent by the mail worker, not by the web process.
+
+    :param email: str: The address of the user
+    :param username: str: Pass the username to the email template
+    :param host: str: The base URL of the application, used in the confirmation link
+    :param db: AsyncSession: Access the database
+    :return: The queued email
+    :doc-author: AR
+    """
+    outbox_email = new_confirmation_email(email, username, host)
+    db.add(outbox_email)
+    await db.commit()
+    return outbox_email
+
+
+async def claim_emails(limit: int, lease: float, max_attempts: int, db: AsyncSession) -> List[OutboxEmail]:
+    """
+    The claim_emails function takes the next due emails for sending.
+        The emails are marked as sending for lease seconds; when the worker dies before it reports
+        the result they become due again, unless that was their last attempt: those are marked dead.
+        Rows claimed by another worker are skipped (Postgres), so several workers can drain the outbox
+        at the same time.
+
+    :param limit: int: The maximum number of emails
+    :param lease: float: Seconds before an unfinished email is handed out again
+    :param max_attempts: int: Number of attempts after which an email is not handed out anymore
+    :param db: AsyncSession: Access the database
+    :return: The claimed emails, the oldest first
+    :doc-author: AR
+    """
+    now = datetime.utcnow()
+    await db.execute(
+        update(OutboxEmail)
+        .where(OutboxEmail.status == "sending", OutboxEmail.next_attempt_at <= now,
+               OutboxEmail.attempts >= max_attempts)
+        .values(status="dead", last_error=LEASE_EXPIRED)
+    )
+    due = (
+        select(OutboxEmail.id)
+        .where(OutboxEmail.status.in_(CLAIMABLE), OutboxEmail.next_attempt_at <= now,
+               OutboxEmail.attempts < max_attempts)
+        .order_by(OutboxEmail.next_attempt_at)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    result = await db.scalars(
+        update(OutboxEmail)
+        .where(OutboxEmail.id.in_(due.scalar_subquery()))
+        .values(status="sending", attempts=OutboxEmail.attempts + 1, next_attempt_at=now + timedelta(seconds=lease))
+        .returning(OutboxEmail)
+    )
+    emails = sorted(result.all(), key=lambda outbox_email: outbox_email.id)
+    await db.commit()
+    return emails
+
+
+async def mark_sent(ids: List[int], db: AsyncSession) -> None:
+    """
+    The mark_sent function records that the emails were accepted by the mail server.
+
+    :param ids: List[int]: The ids of the emails
+    :param db: AsyncSession: Access the database
+    :return: Nothing
+    :doc-author: AR
+    """
+    if ids:
+        await db.execute(update(OutboxEmail).where(OutboxEmail.id.in_(ids))
+                         .values(status="sent", sent_at=datetime.utcnow(), last_error=None))
+        await db.commit()
+
+
+async def mark_failed(email_id: int, error: str, retry_at: datetime, db: AsyncSession) -> None:
+    """
+    The mark_failed function records a failed attempt, the email is tried again at retry_at.
+
+    :param email_id: int: The id of the email
+    :param error: str: Why the attempt failed
+    :param retry_at: datetime: When to try again (UTC)
+    :param db: AsyncSession: Access the database
+    :return: Nothing
+    :doc-author: AR
+    """
+    await db.execute(update(OutboxEmail).where(OutboxEmail.id == email_id)
+                     .values(status="pending", next_attempt_at=retry_at, last_error=error))
+    await db.commit()
+
+
+async def mark_dead(email_id: int, error: str, db: AsyncSession) -> None:
+    """
+    The mark_dead function gives up on an email after its last attempt failed.
+        Dead emails stay in the table for inspection and are not sent again.
+
+    :param email_id: int: The id of the email
+    :param error: str: Why the last attempt failed
+    :param db: AsyncSession: Access the database
+    :return: Nothing
+    :doc-author: AR
+    """
+    await db.execute(update(OutboxEmail).where(OutboxEmail.id == email_id)
+                     .values(status="dead", last_error=error))
+    await db.commit()
+
+
+async def count_emails(db: AsyncSession) -> Dict[str, int]:
+    """
+    The count_emails function counts the emails of the outbox by status.
+
+    :param db: AsyncSession: Access the database
+    :return: A dict status -> number of emails
+    :doc-author: AR
+    """
+    result = await db.execute(select(OutboxEmail.status, func.count()).group_by(OutboxEmail.status))
+    return {status: count for status, count in result.all()}
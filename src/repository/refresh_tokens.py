@@ -0,0 +1,83 @@
+from datetime import datetime
+
+from sqlalchemy import and_, delete, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.database.models import RefreshToken
+
+
+async def create_refresh_token(user_id: int, session_id: str, jti: str, expires_at: datetime,
+                               db: AsyncSession) -> None:
+    """
+    The create_refresh_token function starts a new login session of the user.
+        Expired sessions of the user are removed at the same time.
+
+    :param user_id: int: Owner of the session
+    :param session_id: str: The sid claim of the refresh token
+    :param jti: str: The jti claim of the refresh token
+    :param expires_at: datetime: When the refresh token expires (UTC)
+    :param db: AsyncSession: Access the database
+    :return: Nothing
+    :doc-author: AR
+    """
+    await db.execute(delete(RefreshToken).where(and_(RefreshToken.user_id == user_id,
+                                                     RefreshToken.expires_at <= datetime.utcnow())))
+    db.add(RefreshToken(user_id=user_id, session_id=session_id, jti=jti, expires_at=expires_at))
+    await db.commit()
+
+
+async def rotate_refresh_token(user_id: int, session_id: str, jti: str, new_jti: str, expires_at: datetime,
+                               db: AsyncSession) -> bool:
+    """
+    The rotate_refresh_token function replaces the current refresh token of a session with a new one.
+        The update only succeeds when jti is the current token of the session. Any other token was already
+        used (or the session ended), so the session is removed: a stolen token and its legitimate copy
+        both stop working.
+
+    :param user_id: int: Owner of the session
+    :param session_id: str: The sid claim of the refresh token
+    :param jti: str: The jti claim of the presented refresh token
+    :param new_jti: str: The jti claim of the new refresh token
+    :param expires_at: datetime: When the new refresh token expires (UTC)
+    :param db: AsyncSession: Access the database
+    :return: True when the token was rotated
+    :doc-author: AR
+    """
+    session_filter = and_(RefreshToken.session_id == session_id, RefreshToken.user_id == user_id)
+    result = await db.execute(
+        update(RefreshToken)
+        .where(session_filter, RefreshToken.jti == jti, RefreshToken.expires_at > datetime.utcnow())
+        .values(jti=new_jti, expires_at=expires_at)
+    )
+    if result.rowcount != 1:
+        await db.execute(delete(RefreshToken).where(session_filter))
+    await db.commit()
+    return result.rowcount == 1
+
+
+async def remove_refresh_token(user_id: int, session_id: str, db: AsyncSession) -> None:
+    """
+    The remove_refresh_token function ends a login session of the user.
+
+    :param user_id: int: Owner of the session
+    :param session_id: str: The sid claim of the refresh token
+    :param db: AsyncSession: Access the database
+    :return: Nothing
+    :doc-author: AR
+    """
+    await db.execute(delete(RefreshToken).where(and_(RefreshToken.session_id == session_id,
+                                                     RefreshToken.user_id == user_id)))
+    await db.commit()
+
+
+async def remove_user_refresh_tokens(user_id: int, db: AsyncSession) -> None:
+    """
+    The remove_user_refresh_tokens function ends all login sessions of the user.
+
+    :param user_id: int: Owner of the sessions
+    :param db: AsyncSession: Access the database
+    :return: Nothing
+    :doc-author: AR
+    """
+    await db.execute(delete(RefreshToken).where(RefreshToken.user_id == user_id))
+    await db.commit()
@@ -1,58 +1,73 @@
-from typing import List, Union
+from typing import List, Optional, Tuple, Union
 
-from sqlalchemy.orm import Session
-from sqlalchemy import and_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import and_, select, tuple_
 
+from src.database.db import pin_primary
 from src.database.models import Tag, User
 from src.schemas import TagModel
+from src.services.cache import collection_versions
 
 
-async def get_tags(skip: int, limit: int, user: User, db: Session) -> List[Tag]:
+async def get_tags(skip: int, limit: int, user: User, db: AsyncSession,
+                   after: Optional[Tuple[str, int]] = None) -> List[Tag]:
     """
-    The get_tags function returns a list of tags for the user.
+    The get_tags function returns a list of tags for the user, ordered by name.
+    When after is given the page starts right after that (name, id) pair and skip is ignored.
 
     :param skip: int: Skip a number of tags in the database
     :param limit: int: Limit the number of tags that are returned
     :param user: User: Get the user's id
-    :param db: Session: Pass the database session to the function
+    :param db: AsyncSession: Pass the database session to the function
+    :param after: Optional[Tuple[str, int]]: The (name, id) of the last tag of the previous page
     :return: A list of tags
     :doc-author: AR
     """
-    return db.query(Tag).filter(Tag.user_id == user.id).offset(skip).limit(limit).all()
+    stmt = select(Tag).where(Tag.user_id == user.id)
+    if after is not None:
+        stmt = stmt.where(tuple_(Tag.name, Tag.id) > after)
+    else:
+        stmt = stmt.offset(skip)
+    stmt = stmt.order_by(Tag.name, Tag.id).limit(limit)
+    result = await db.execute(stmt)
+    return result.scalars().all()
 
 
-async def get_tag(tag_id: int, user: User, db: Session) -> Tag:
+async def get_tag(tag_id: int, user: User, db: AsyncSession) -> Tag:
     """
     The get_tag function takes in a tag_id and user object, and returns the Tag object with that id.
         If no such tag exists, it raises an HTTPException.
 
     :param tag_id: int: Get the tag with that id
     :param user: User: Get the user id from the database
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
     :return: A tag object based on the id and user
     :doc-author: Trelent
     """
-    return db.query(Tag).filter(and_(Tag.id == tag_id, Tag.user_id == user.id)).first()
+    stmt = select(Tag).where(and_(Tag.id == tag_id, Tag.user_id == user.id))
+    result = await db.execute(stmt)
+    return result.scalars().first()
 
 
-async def create_tag(body: TagModel, user: User, db: Session) -> Tag:
+async def create_tag(body: TagModel, user: User, db: AsyncSession) -> Tag:
     """
     The create_tag function creates a new tag in the database.
 
     :param body: TagModel: Get the name of the tag from the request body
     :param user: User: Get the user_id from the logged in user
-    :param db: Session: Pass the database session to the function
+    :param db: AsyncSession: Pass the database session to the function
     :return: A tag object
     :doc-author: Trelent
     """
     tag = Tag(name=body.name, user_id=user.id)
     db.add(tag)
-    db.commit()
-    db.refresh(tag)
+    await db.commit()
+    await db.refresh(tag)
+    await collection_versions.bump("tags", user.id)
     return tag
 
 
-async def update_tag(tag_id: int, body: TagModel, user: User, db: Session) -> Union[Tag, None]:
+async def update_tag(tag_id: int, body: TagModel, user: User, db: AsyncSession) -> Union[Tag, None]:
     """
     The update_tag function updates a tag in the database.
         Args:
@@ -63,34 +78,41 @@ async def update_tag(tag_id: int, body: TagModel, user: User, db: Session) -> Un
     :param tag_id: int: Identify the tag to be deleted
     :param body: TagModel: Get the new tag name from the request body
     :param user: User: Ensure that the user is authorized to update the tag
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
     :return: The updated tag if it exists, otherwise none
     :doc-author: Trelent
     """
-    tag = db.query(Tag).filter(and_(Tag.id == tag_id, Tag.user_id == user.id)).first()
+    pin_primary(db)
+    tag = await get_tag(tag_id, user, db)
     if tag:
-        tag .name = body.name
-        db.commit()
+        tag.name = body.name
+        await db.commit()
+        # the notes embed their tags
+        await collection_versions.bump("tags", user.id)
+        await collection_versions.bump("notes", user.id)
     return tag
 
 
-async def remove_tag(tag_id: int, user: User, db: Session) -> Union[Tag, None]:
+async def remove_tag(tag_id: int, user: User, db: AsyncSession) -> Union[Tag, None]:
 
     """
     The remove_tag function removes a tag from the database.
         Args:
             tag_id (int): The id of the tag to be removed.
             user (User): The user who owns the tags being removed.  This is used for security purposes, so that users can only remove their own tags and not those of other users.
-            db (Session): A connection to our database, which we use to query and delete data from it.
+            db (AsyncSession): A connection to our database, which we use to query and delete data from it.
 
     :param tag_id: int: Specify the tag to be deleted
     :param user: User: Get the user's id
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
     :return: The tag that was removed
     :doc-author: Trelent
     """
-    tag = db.query(Tag).filter(and_(Tag.id == tag_id, Tag.user_id == user.id)).first()
+    pin_primary(db)
+    tag = await get_tag(tag_id, user, db)
     if tag:
-        db.delete(tag)
-        db.commit()
+        await db.delete(tag)
+        await db.commit()
+        await collection_versions.bump("tags", user.id)
+        await collection_versions.bump("notes", user.id)
     return tag
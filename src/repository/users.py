@@ -1,13 +1,17 @@
-from typing import Union
+from typing import Optional
 
 from libgravatar import Gravatar
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
+from src.database.db import pin_primary
 from src.database.models import User
+from src.repository.outbox import new_confirmation_email
 from src.schemas import UserModel
+from src.services.cache import user_cache, user_versions
 
 
-async def get_user_by_email(email: str, db: Session) -> User:
+async def get_user_by_email(email: str, db: AsyncSession) -> User:
 
     """
     The get_user_by_email function takes in an email and a database session,
@@ -15,20 +19,23 @@ async def get_user_by_email(email: str, db: Session) -> User:
     it will return None.
 
     :param email: str: Pass in the email address of the user we want to retrieve
-    :param db: Session: Pass in the database session
+    :param db: AsyncSession: Pass in the database session
     :return: The first user in the database with the given email address
     :doc-author: Trelent
     """
-    return db.query(User).filter(User.email == email).first()
+    result = await db.execute(select(User).where(User.email == email))
+    return result.scalars().first()
 
 
-async def create_user(body: UserModel, db: Session) -> User:
+async def create_user(body: UserModel, db: AsyncSession, confirmation_host: Optional[str] = None) -> User:
 
     """
     The create_user function creates a new user in the database.
+    With confirmation_host the confirmation email is queued in the outbox in the same transaction.
 
     :param body: UserModel: Pass in the usermodel object that is created from the request body
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
+    :param confirmation_host: Optional[str]: The base URL used in the confirmation link
     :return: A user object
     :doc-author: Trelent
     """
@@ -40,28 +47,14 @@ async def create_user(body: UserModel, db: Session) -> User:
         print(e)
     new_user = User(**body.dict(), avatar=avatar)
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    if confirmation_host is not None:
+        db.add(new_confirmation_email(new_user.email, new_user.username, confirmation_host))
+    await db.commit()
+    await db.refresh(new_user)
     return new_user
 
 
-async def update_token(user: User, token: Union[str, None], db: Session) -> None:
-
-    """
-    The update_token function updates the refresh token for a user in the database.
-
-    :param user: User: Identify the user to update
-    :param token: Union[str: Define the type of data that is expected to be passed into the function
-    :param None]: Indicate that the token parameter can be either a string or none
-    :param db: Session: Pass the database session to the function
-    :return: Nothing
-    :doc-author: Trelent
-    """
-    user.refresh_token = token
-    db.commit()
-
-
-async def confirmed_email(email: str, db: Session) -> None:
+async def confirmed_email(email: str, db: AsyncSession) -> None:
 
     """
     The confirmed_email function takes in an email and a database session,
@@ -69,27 +62,35 @@ async def confirmed_email(email: str, db: Session) -> None:
 
 
     :param email: str: Pass the email address of the user to be confirmed
-    :param db: Session: Pass the database session into the function
+    :param db: AsyncSession: Pass the database session into the function
     :return: Nothing, but it sets the user's confirmed status to true
     :doc-author: Trelent
     """
+    pin_primary(db)
     user = await get_user_by_email(email, db)
     user.confirmed = True
-    db.commit()
+    await db.commit()
+    await user_cache.invalidate(email)
+    await user_versions.bump(user.id)
 
 
-async def update_avatar(email, url: str, db: Session) -> User:
+async def update_avatar(email, url: str, db: AsyncSession, avatar_hash: Optional[str] = None) -> User:
 
     """
     The update_avatar function updates the avatar of a user in the database.
 
     :param email: Identify the user to update
     :param url: str: Pass the url of the avatar image to be updated
-    :param db: Session: Pass the database session to the function
+    :param db: AsyncSession: Pass the database session to the function
+    :param avatar_hash: Optional[str]: Content hash of the uploaded image
     :return: The updated user object
     :doc-author: Trelent
     """
+    pin_primary(db)
     user = await get_user_by_email(email, db)
     user.avatar = url
-    db.commit()
+    user.avatar_hash = avatar_hash
+    await db.commit()
+    await user_cache.invalidate(email)
+    await user_versions.bump(user.id)
     return user
@@ -1,97 +1,198 @@
-from fastapi import APIRouter, HTTPException, Depends, status, Security, BackgroundTasks, Request
+import math
+import uuid
+
+from fastapi import APIRouter, HTTPException, Depends, status, Security, Request
 from fastapi.security import OAuth2PasswordRequestForm, HTTPAuthorizationCredentials, HTTPBearer
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from src.database.db import get_db
+from src.database.db import get_primary_db
+from src.database.models import User
 from src.schemas import UserModel, UserResponse, TokenModel, RequestEmail
 from src.repository import users as repository_users
+from src.repository import outbox as repository_outbox
 from src.services.auth import auth_service
-from src.services.mail import send_email
+from src.services.cache import token_cache
+from src.services.login_throttle import login_throttle
+from src.services.refresh_tokens import RefreshTokenStoreUnavailable, get_refresh_token_store
+from src.services.revocation import RevocationUnavailable, revocation_list
 
 router = APIRouter(prefix='/auth', tags=["auth"])
 security = HTTPBearer()
 
 
+def sessions_unavailable(err: Exception) -> HTTPException:
+    # login sessions or revoked tokens could not be read or written (Redis down and no usable fallback),
+    # the client may retry
+    print(err)
+    return HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                         detail="Login sessions are temporarily unavailable", headers={"Retry-After": "1"})
+
+
 @router.post("/signup", response_model=UserResponse, status_code=status.HTTP_201_CREATED)
-async def signup(body: UserModel, background_tasks: BackgroundTasks, request: Request, db: Session = Depends(get_db)):
+async def signup(body: UserModel, request: Request, db: AsyncSession = Depends(get_primary_db)):
 
     """
     The signup function creates a new user in the database.
         It takes in a UserModel object, which is validated by pydantic.
         If the email already exists, it will return an HTTP 409 error code (conflict).
-        Otherwise, it will create a new user and send them an email to verify their account.
+        Otherwise, it will create a new user and queue an email to verify their account
+        in the same transaction, the mail worker (worker.py) sends it.
 
     :param body: UserModel: Get the user information from the request body
-    :param background_tasks: BackgroundTasks: Add a task to the background tasks queue
     :param request: Request: Get the base_url of the server
-    :param db: Session: Pass the database session to the repository function
+    :param db: AsyncSession: Pass the database session to the repository function
     :return: A dictionary with the user and a detail message
     :doc-author: Trelent
     """
     exist_user = await repository_users.get_user_by_email(body.email, db)
     if exist_user:
         raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Account already exists")
-    body.password = auth_service.get_password_hash(body.password)
-    new_user = await repository_users.create_user(body, db)
-    background_tasks.add_task(send_email, new_user.email, new_user.username, request.base_url)
+    body.password = await auth_service.get_password_hash_async(body.password)
+    new_user = await repository_users.create_user(body, db, confirmation_host=str(request.base_url))
     return {"user": new_user, "detail": "User successfully created"}
 
 
 @router.post("/login", response_model=TokenModel)
-async def login(body: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+async def login(request: Request, body: OAuth2PasswordRequestForm = Depends(),
+                db: AsyncSession = Depends(get_primary_db)):
 
     """
     The login function is used to authenticate a user.
         It takes in the username and password of the user, and returns an access token if successful.
         The access token can be used to make authenticated requests.
+        After repeated failures for the account or from the client address the client has to wait
+        (HTTP 429 with Retry-After) before the password is checked again.
+        When Redis fails the session is stored in the database; HTTP 503 when it can be stored nowhere.
 
+    :param request: Request: Get the address of the client
     :param body: OAuth2PasswordRequestForm: Validate the request body
-    :param db: Session: Get the database session
+    :param db: AsyncSession: Get the database session
     :return: A dict with the access_token, refresh_token and token type
     :doc-author: Trelent
     """
+    ip = request.client.host if request.client else "unknown"
+    # the attempt is counted before the password is checked, concurrent attempts cannot all get through
+    retry_after = await login_throttle.acquire(body.username, ip)
+    if retry_after:
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail="Too many failed login attempts",
+                            headers={"Retry-After": str(math.ceil(retry_after))})
     user = await repository_users.get_user_by_email(body.username, db)
     if user is None:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid email")
     if not user.confirmed:
+        await login_throttle.release(body.username, ip)
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Email not confirmed")
-    if not auth_service.verify_password(body.password, user.password):
+    if not await auth_service.verify_password_async(body.password, user.password):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid password")
+    await login_throttle.success(body.username, ip)
     # Generate JWT
-    access_token = await auth_service.create_access_token(data={"sub": user.email})
-    refresh_token = await auth_service.create_refresh_token(data={"sub": user.email})
-    await repository_users.update_token(user, refresh_token, db)
+    # every login is a new session, the sessions of other devices stay valid
+    session_id, jti = uuid.uuid4().hex, uuid.uuid4().hex
+    access_token = await auth_service.create_access_token(data={**await auth_service.access_token_data(user),
+                                                                "sid": session_id})
+    refresh_token = await auth_service.create_refresh_token(data={"sub": user.email, "sid": session_id, "jti": jti})
+    store = get_refresh_token_store(auth_service.r, db)
+    try:
+        await store.create(user.id, session_id, jti, auth_service.REFRESH_TOKEN_EXPIRE_SECONDS)
+    except RefreshTokenStoreUnavailable as err:
+        raise sessions_unavailable(err)
     return {"access_token": access_token, "refresh_token": refresh_token, "token_type": "bearer"}
 
 
 @router.get('/refresh_token', response_model=TokenModel)
-async def refresh_token(credentials: HTTPAuthorizationCredentials = Security(security), db: Session = Depends(get_db)):
+async def refresh_token(credentials: HTTPAuthorizationCredentials = Security(security),
+                        db: AsyncSession = Depends(get_primary_db)):
 
     """
     The refresh_token function is used to refresh the access token.
         The function takes in a refresh token and returns an access_token,
         a new refresh_token, and the type of token (bearer).
+        While Redis fails, a session that is not in the database can not be checked: HTTP 503 with Retry-After,
+        the client keeps its refresh token and tries again.
 
     :param credentials: HTTPAuthorizationCredentials: Get the token from the header
-    :param db: Session: Access the database
+    :param db: AsyncSession: Access the database
     :return: A dictionary with the new access_token, refresh_token and token type
     :doc-author: Trelent
     """
-    token = credentials.credentials
-    email = await auth_service.decode_refresh_token(token)
-    user = await repository_users.get_user_by_email(email, db)
-    if user.refresh_token != token:
-        await repository_users.update_token(user, None, db)
+    payload = await auth_service.decode_refresh_token(credentials.credentials)
+    user = await repository_users.get_user_by_email(payload["sub"], db)
+    if user is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid refresh token")
+    # refresh tokens are single use: the presented one is replaced, presenting it again ends the session
+    jti = uuid.uuid4().hex
+    store = get_refresh_token_store(auth_service.r, db)
+    try:
+        rotated = await store.rotate(user.id, payload["sid"], payload["jti"], jti,
+                                     auth_service.REFRESH_TOKEN_EXPIRE_SECONDS)
+    except RefreshTokenStoreUnavailable as err:
+        raise sessions_unavailable(err)
+    if not rotated:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid refresh token")
 
-    access_token = await auth_service.create_access_token(data={"sub": email})
-    refresh_token = await auth_service.create_refresh_token(data={"sub": email})
-    await repository_users.update_token(user, refresh_token, db)
+    access_token = await auth_service.create_access_token(data={**await auth_service.access_token_data(user),
+                                                                "sid": payload["sid"]})
+    refresh_token = await auth_service.create_refresh_token(data={"sub": user.email, "sid": payload["sid"],
+                                                                  "jti": jti})
     return {"access_token": access_token, "refresh_token": refresh_token, "token_type": "bearer"}
 
 
+@router.post('/logout', status_code=status.HTTP_204_NO_CONTENT)
+async def logout(token: str = Depends(auth_service.oauth2_scheme),
+                 current_user: User = Depends(auth_service.get_current_user),
+                 db: AsyncSession = Depends(get_primary_db)):
+
+    """
+    The logout function ends the login session of the access token: the access token is revoked
+    until it expires and the refresh token of the same session can no longer be used.
+    HTTP 503 when the token could not be revoked or the session could not be removed in Redis.
+
+    :param token: str: The access token from the authorization header
+    :param current_user: User: Get the current user
+    :param db: AsyncSession: Access the database
+    :return: Nothing
+    :doc-author: AR
+    """
+    payload = await auth_service.get_access_payload(token)
+    revocation_error = None
+    if "jti" in payload:
+        try:
+            await revocation_list.revoke(payload["jti"], payload["exp"])
+        except RevocationUnavailable as err:
+            # revoked in this process only, the session is still ended before answering 503
+            revocation_error = err
+    token_cache.discard(token)
+    if "sid" in payload:
+        try:
+            await get_refresh_token_store(auth_service.r, db).revoke(current_user.id, payload["sid"])
+        except RefreshTokenStoreUnavailable as err:
+            raise sessions_unavailable(err)
+    if revocation_error is not None:
+        raise sessions_unavailable(revocation_error)
+
+
+@router.post('/logout_all', status_code=status.HTTP_204_NO_CONTENT)
+async def logout_all(current_user: User = Depends(auth_service.get_current_user),
+                     db: AsyncSession = Depends(get_primary_db)):
+
+    """
+    The logout_all function ends every login session of the user: none of the refresh tokens issued
+    to the user can be used anymore. Access tokens stay valid until they expire.
+    HTTP 503 when the sessions could not be removed from Redis.
+
+    :param current_user: User: Get the current user
+    :param db: AsyncSession: Access the database
+    :return: Nothing
+    :doc-author: AR
+    """
+    try:
+        await get_refresh_token_store(auth_service.r, db).revoke_all(current_user.id)
+    except RefreshTokenStoreUnavailable as err:
+        raise sessions_unavailable(err)
+
+
 @router.get('/confirmed_email/{token}')
-async def confirmed_email(token: str, db: Session = Depends(get_db)):
+async def confirmed_email(token: str, db: AsyncSession = Depends(get_primary_db)):
 
     """
     The confirmed_email function is used to confirm a user's email address.
@@ -102,7 +203,7 @@ async def confirmed_email(token: str, db: Session = Depends(get_db)):
         If it has been confirmed already, we return a message saying &quot;Your email is already confirmed&quot;.
 
     :param token: str: Get the token from the url
-    :param db: Session: Get a database session
+    :param db: AsyncSession: Get a database session
     :return: A message if the email is already confirmed or confirms the email
     :doc-author: Trelent
     """
@@ -117,19 +218,17 @@ async def confirmed_email(token: str, db: Session = Depends(get_db)):
 
 
 @router.post('/request_email')
-async def request_email(body: RequestEmail, background_tasks: BackgroundTasks, request: Request,
-                        db: Session = Depends(get_db)):
+async def request_email(body: RequestEmail, request: Request, db: AsyncSession = Depends(get_primary_db)):
 
     """
     The request_email function is used to send an email to the user with a link that will allow them
     to confirm their account. The function takes in a RequestEmail object, which contains the user's
     email address. It then checks if there is already a confirmed account associated with that email
-    address, and returns an error message if so. If not, it sends an email containing a confirmation link.
+    address, and returns an error message if so. If not, it queues an email containing a confirmation link.
 
     :param body: RequestEmail: Get the email from the request body
-    :param background_tasks: BackgroundTasks: Add a task to the background tasks queue
     :param request: Request: Get the base_url of the application
-    :param db: Session: Get the database session
+    :param db: AsyncSession: Get the database session
     :return: A message to the user, but it does not actually send an email
     :doc-author: Trelent
     """
@@ -138,5 +237,5 @@ async def request_email(body: RequestEmail, background_tasks: BackgroundTasks, r
     if user.confirmed:
         return {"message": "Your email is already confirmed"}
     if user:
-        background_tasks.add_task(send_email, user.email, user.username, request.base_url)
+        await repository_outbox.add_confirmation_email(user.email, user.username, str(request.base_url), db)
     return {"message": "Check your email for confirmation."}
\ No newline at end of file
@@ -1,38 +1,118 @@
-from typing import List
+import os
+import shutil
+import tempfile
+from typing import Any, Dict, List, Optional
 
-from fastapi import APIRouter, HTTPException, Depends, status
-from sqlalchemy.orm import Session
+from fastapi import (APIRouter, BackgroundTasks, HTTPException, Depends, File, Query, Request, Response, UploadFile,
+                     status)
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
+from sqlalchemy.ext.asyncio import AsyncSession
 from src.database.models import User
-from src.database.db import get_db
-from src.schemas import ContactCreate, ContactResponse, ContactUpdate
+from src.database.db import get_db, get_primary_db, get_session_factory
+from src import settings
+from src.schemas import ContactCreate, ContactResponse, ContactUpdate, ContactBulkResponse, ContactImportResponse
 from src.repository import contacts as repository_contacts
 from src.services.auth import auth_service
-from fastapi_limiter.depends import RateLimiter
+from src.services.contacts_import import detect_format, import_jobs, run_import
+from src.services.export import EXPORT_FORMATS, serialize_rows
+from src.services.etags import current_etag, get_conditional_db, not_modified
+from src.services.pagination import decode_cursor, set_next_cursor
+from src.services.rate_limit import RateLimit
+from src.services.response_cache import get_cacheable_db, response_cache
 
 router = APIRouter(prefix='/contacts', tags=["contacts"])
 
 
 @router.get("/", response_model=List[ContactResponse], description='No more than 10 requests per minute',
-            dependencies=[Depends(RateLimiter(times=1000, seconds=60))])
-async def read_contacts(skip: int = 0, limit: int = 100, db: Session = Depends(get_db),
+            dependencies=[Depends(RateLimit(times=1000, seconds=60))])
+async def read_contacts(request: Request, response: Response, skip: int = 0, limit: int = 100,
+                        cursor: Optional[str] = None,
+                        db: AsyncSession = Depends(get_cacheable_db),
                         current_user: User = Depends(auth_service.get_current_user)):
 
     """
     The read_contacts function returns a list of contacts.
+        Pages can be requested with skip/limit or with the cursor returned in the X-Next-Cursor header
+        of the previous page; the cursor does not get slower on deep pages.
+        The response carries the ETag of the contacts of the user, a request with that tag in If-None-Match
+        is answered with 304 Not Modified without querying the database.
+        Conditional requests, and every request while the response cache is enabled, read from the primary;
+        other requests may read from a replica and get a tag that is never answered with 304.
+        With RESPONSE_CACHE_ENABLED the serialized pages are cached in Redis until the contacts change.
 
+    :param request: Request: Get the If-None-Match header
+    :param response: Response: Set the X-Next-Cursor and ETag headers
     :param skip: int: Skip a number of records
     :param limit: int: Limit the number of contacts returned
-    :param db: Session: Pass the database session to the repository
+    :param cursor: Optional[str]: Cursor of the page to return, skip is ignored when it is set
+    :param db: AsyncSession: Pass the database session to the repository
     :param current_user: User: Get the current user
     :return: A list of contacts
     :doc-author: Trelent
     """
-    contacts = await repository_contacts.get_contacts(skip, limit, current_user, db)
-    return contacts
+    etag = await current_etag(request, "contacts", current_user.id, db)
+    unchanged = not_modified(request, response, etag)
+    if unchanged is not None:
+        return unchanged
+    key = await response_cache.key("contacts", current_user.id, request, db)
+    cached = await response_cache.get(key)
+    if cached is not None:
+        return cached
+    after = decode_cursor(cursor, (int,))[0] if cursor else None
+    contacts = await repository_contacts.get_contacts(skip, limit, current_user, db, after)
+    set_next_cursor(response, contacts, limit, ("id",))
+    return await response_cache.set(key, response, contacts, ContactResponse)
+
+
+@router.get("/search", response_model=List[ContactResponse])
+async def search_contacts(q: str = Query(min_length=1, max_length=100), limit: int = Query(20, ge=1, le=100),
+                          db: AsyncSession = Depends(get_db),
+                          current_user: User = Depends(auth_service.get_current_user)):
+
+    """
+    The search_contacts function returns the contacts whose first name, last name, email or phone number
+    contains q, best matches first.
+
+    :param q: str: The text to search for
+    :param limit: int: Maximum number of contacts returned
+    :param db: AsyncSession: Pass the database session to the repository
+    :param current_user: User: Get the current user
+    :return: A list of contacts
+    :doc-author: AR
+    """
+    return await repository_contacts.search_contacts(q, limit, current_user, db)
+
+
+@router.get("/export", response_class=StreamingResponse)
+async def export_contacts(fmt: str = Query("ndjson", alias="format", pattern="^(ndjson|csv)$"),
+                          session_factory=Depends(get_session_factory),
+                          current_user: User = Depends(auth_service.get_current_user)):
+
+    """
+    The export_contacts function streams all contacts of the user as NDJSON or CSV.
+        Rows are read from a server-side cursor and written to the response one by one,
+        so the memory used does not grow with the number of contacts.
+
+    :param fmt: str: ndjson (default) or csv, passed as the format query parameter
+    :param session_factory: Open a session that lives as long as the response is streamed
+    :param current_user: User: Get the current user
+    :return: A streaming response with the contacts
+    :doc-author: AR
+    """
+    async def rows():
+        async with session_factory() as db:
+            async for contact in repository_contacts.stream_contacts(current_user, db):
+                yield contact
+
+    return StreamingResponse(serialize_rows(rows(), ContactResponse, fmt), media_type=EXPORT_FORMATS[fmt],
+                             headers={"Content-Disposition": f'attachment; filename="contacts.{fmt}"'})
 
 
 @router.get("/{contact_id}", response_model=ContactResponse)
-async def read_contact(contact_id: int, db: Session = Depends(get_db),
+async def read_contact(contact_id: int, request: Request, response: Response,
+                       db: AsyncSession = Depends(get_conditional_db),
                     current_user: User = Depends(auth_service.get_current_user)):
 
     """
@@ -41,27 +121,30 @@ async def read_contact(contact_id: int, db: Session = Depends(get_db),
         If no such contact exists, an HTTP 404 error is returned.
 
     :param contact_id: int: Specify the contact id that is passed in the url
-    :param db: Session: Pass the database session to the function
+    :param request: Request: Get the If-None-Match header
+    :param response: Response: Set the ETag header
+    :param db: AsyncSession: Pass the database session to the function
     :param current_user: User: Get the current user from the auth_service
     :return: The contact that was found in the database
     :doc-author: Trelent
     """
+    etag = await current_etag(request, "contacts", current_user.id, db)
     contact = await repository_contacts.get_contact(contact_id,current_user, db)
     if contact is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Contact not found")
-    return contact
+    return not_modified(request, response, etag) or contact
 
 
 @router.post("/", response_model=ContactResponse, status_code=status.HTTP_201_CREATED,
-             description='No more than 10 requests per minute', dependencies=[Depends(RateLimiter(times=1000, seconds=60))])
-async def create_contacts(body: ContactCreate, db: Session = Depends(get_db),
+             description='No more than 10 requests per minute', dependencies=[Depends(RateLimit(times=1000, seconds=60))])
+async def create_contacts(body: ContactCreate, db: AsyncSession = Depends(get_primary_db),
                            current_user: User = Depends(auth_service.get_current_user)):
 
     """
     The create_contacts function creates a new contact in the database.
 
     :param body: ContactCreate: Get the data from the request body
-    :param db: Session: Pass the database session to the repository layer
+    :param db: AsyncSession: Pass the database session to the repository layer
     :param current_user: User: Get the user id of the logged in user
     :return: A contact object that is created in the database
     :doc-author: Trelent
@@ -69,8 +152,91 @@ async def create_contacts(body: ContactCreate, db: Session = Depends(get_db),
     return await repository_contacts.create_contact(body, current_user, db)
 
 
+@router.post("/bulk", response_model=ContactBulkResponse, status_code=status.HTTP_201_CREATED,
+             description='No more than 10 requests per minute', dependencies=[Depends(RateLimit(times=1000, seconds=60))])
+async def create_contacts_bulk(body: List[Dict[str, Any]], db: AsyncSession = Depends(get_primary_db),
+                               current_user: User = Depends(auth_service.get_current_user)):
+
+    """
+    The create_contacts_bulk function creates many contacts with a single request.
+        Every item is validated as a ContactCreate. Valid items are inserted in one transaction,
+        invalid ones are skipped and reported with their index in the request body.
+
+    :param body: List[Dict[str, Any]]: The contacts to create, at most CONTACTS_BULK_MAX_SIZE of them
+    :param db: AsyncSession: Pass the database session to the repository layer
+    :param current_user: User: Get the user id of the logged in user
+    :return: Ids of the created contacts and the validation errors of the skipped items
+    :doc-author: AR
+    """
+    if len(body) > settings.CONTACTS_BULK_MAX_SIZE:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                            detail=f"No more than {settings.CONTACTS_BULK_MAX_SIZE} contacts per request")
+    contacts, errors = [], []
+    for index, item in enumerate(body):
+        try:
+            contacts.append(ContactCreate.model_validate(item))
+        except ValidationError as err:
+            errors.append({"index": index, "errors": err.errors(include_url=False, include_context=False)})
+    ids = await repository_contacts.create_contacts(contacts, current_user, db)
+    return {"ids": ids, "errors": errors}
+
+
+@router.post("/import", response_model=ContactImportResponse, status_code=status.HTTP_202_ACCEPTED)
+async def import_contacts(background_tasks: BackgroundTasks, file: UploadFile = File(),
+                          session_factory=Depends(get_session_factory),
+                          current_user: User = Depends(auth_service.get_current_user)):
+
+    """
+    The import_contacts function starts the import of contacts from a CSV or vCard file.
+        The upload is copied to a temporary file and imported in the background, chunk by chunk,
+        so neither the request nor the import keeps the whole file in memory.
+        The progress can be followed with GET /api/contacts/import/{job_id}, from any worker.
+
+    :param background_tasks: BackgroundTasks: Run the import after the response is sent
+    :param file: UploadFile: A .csv file with a header row or a .vcf file
+    :param session_factory: Open the session used by the import
+    :param current_user: User: Get the current user
+    :return: The import job
+    :doc-author: AR
+    """
+    fmt = detect_format(file.filename)
+    if fmt is None:
+        raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE,
+                            detail="Only .csv and .vcf files can be imported")
+    tmp = tempfile.NamedTemporaryFile(suffix=f".{fmt}", delete=False)
+    try:
+        with tmp:
+            await file.seek(0)
+            await run_in_threadpool(shutil.copyfileobj, file.file, tmp)
+        job = await import_jobs.create(current_user, file.filename)
+    except BaseException:
+        # run_import removes the file, it never runs when the job could not be created
+        os.remove(tmp.name)
+        raise
+    background_tasks.add_task(run_import, job, tmp.name, fmt, current_user, session_factory,
+                              settings.CONTACTS_IMPORT_CHUNK_SIZE)
+    return job
+
+
+@router.get("/import/{job_id}", response_model=ContactImportResponse)
+async def read_import(job_id: str, current_user: User = Depends(auth_service.get_current_user)):
+
+    """
+    The read_import function returns the status and the progress counters of an import job.
+
+    :param job_id: str: Id returned by POST /api/contacts/import
+    :param current_user: User: Get the current user
+    :return: The import job
+    :doc-author: AR
+    """
+    job = await import_jobs.get(job_id, current_user)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Import not found")
+    return job
+
+
 @router.put("/{contact_id}", response_model=ContactResponse)
-async def update_contact(body: ContactUpdate, contact_id: int, db: Session = Depends(get_db),
+async def update_contact(body: ContactUpdate, contact_id: int, db: AsyncSession = Depends(get_primary_db),
                          curent_user: User = Depends(auth_service.get_current_user)):
 
     """
@@ -83,7 +249,7 @@ async def update_contact(body: ContactUpdate, contact_id: int, db: Session = Dep
 
     :param body: ContactUpdate: Get the data from the request body
     :param contact_id: int: Get the contact id from the url
-    :param db: Session: Pass the database session to the repository_contacts
+    :param db: AsyncSession: Pass the database session to the repository_contacts
     :param curent_user: User: Get the current user
     :return: The updated contact, which is then returned to the client
     :doc-author: Trelent
@@ -95,7 +261,7 @@ async def update_contact(body: ContactUpdate, contact_id: int, db: Session = Dep
 
 
 @router.delete("/{contact_id}", response_model=ContactResponse)
-async def remove_contact(contact_id: int, db: Session = Depends(get_db),
+async def remove_contact(contact_id: int, db: AsyncSession = Depends(get_primary_db),
                          curent_user: User = Depends(auth_service.get_current_user)):
 
     """
@@ -104,7 +270,7 @@ async def remove_contact(contact_id: int, db: Session = Depends(get_db),
         and returns a dictionary containing information about that contact.
 
     :param contact_id: int: Specify the id of the contact to be removed
-    :param db: Session: Get the database session
+    :param db: AsyncSession: Get the database session
     :param curent_user: User: Get the current user from the database
     :return: The removed contact
     :doc-author: Trelent
@@ -0,0 +1,129 @@
+import hmac
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Request, Security, status
+from fastapi.security import APIKeyHeader
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src import settings
+
+from src.database.db import engine, get_db, replica_engines
+from src.database.pool import get_pool_status
+from src.repository import outbox as repository_outbox
+from src.services.auth import auth_service
+from src.services.avatars import avatar_uploader
+from src.services.contacts_import import import_executor
+from src.services.redis_pool import get_redis_pool_status
+from src.services.response_cache import response_cache
+
+internal_token = APIKeyHeader(name="X-Internal-Token", auto_error=False)
+
+
+async def verify_internal_token(token: Optional[str] = Security(internal_token)):
+
+    """
+    The verify_internal_token function lets only the monitoring of the operators in:
+        the request must carry INTERNAL_API_TOKEN in the X-Internal-Token header.
+        Without a configured token the internal endpoints do not exist.
+
+    :param token: Optional[str]: The X-Internal-Token header
+    :return: Nothing, raises HTTPException when the request is not allowed
+    :doc-author: AR
+    """
+    if not settings.INTERNAL_API_TOKEN:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    if token is None or not hmac.compare_digest(token.encode(), settings.INTERNAL_API_TOKEN.encode()):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid internal token")
+
+
+router = APIRouter(prefix='/internal', tags=["internal"], include_in_schema=False,
+                   dependencies=[Depends(verify_internal_token)])
+
+
+@router.get("/pool")
+async def read_pool_status():
+
+    """
+    The read_pool_status function returns live statistics of the database connection pool:
+    checked-out connections, overflow and the checkout wait time histogram.
+    It is used to size DB_POOL_SIZE / DB_MAX_OVERFLOW and is not part of the public API.
+
+    :return: A dict with the pool status
+    :doc-author: AR
+    """
+    return {
+        "primary": get_pool_status(engine.pool),
+        "replicas": [get_pool_status(replica.pool) for replica in replica_engines],
+    }
+
+
+@router.get("/executors")
+async def read_executors_status():
+
+    """
+    The read_executors_status function returns the queue time statistics of the thread pools
+    that run blocking work, used to size PASSWORD_HASH_WORKERS, AVATAR_WORKERS and CONTACTS_IMPORT_WORKERS.
+
+    :return: A dict with the status of every pool
+    :doc-author: AR
+    """
+    return {
+        "password_hash": auth_service.password_executor.status(),
+        "avatar": avatar_uploader.executor.status(),
+        "contacts_import": import_executor.status(),
+    }
+
+
+@router.get("/redis")
+async def read_redis_status(request: Request):
+
+    """
+    The read_redis_status function returns the usage of the shared Redis connection pool
+    and how long commands waited for a connection, used to size REDIS_POOL_SIZE.
+
+    :param request: Request: Get the pool from the application state
+    :return: A dict with the pool status, empty before the application started
+    :doc-author: AR
+    """
+    pool = getattr(request.app.state, "redis_pool", None)
+    return get_redis_pool_status(pool) if pool is not None else {}
+
+
+@router.get("/outbox")
+async def read_outbox_status(db: AsyncSession = Depends(get_db)):
+
+    """
+    The read_outbox_status function counts the emails of the outbox by status, used to watch
+    the backlog of the mail worker (pending) and the emails it gave up on (dead).
+
+    :param db: AsyncSession: Get the database session
+    :return: A dict status -> number of emails
+    :doc-author: AR
+    """
+    return await repository_outbox.count_emails(db)
+
+
+@router.get("/avatars")
+async def read_avatars_status():
+
+    """
+    The read_avatars_status function returns the counters of the avatar uploads and how long they took,
+    used to size AVATAR_UPLOAD_CONNECTIONS and AVATAR_UPLOAD_TIMEOUT.
+
+    :return: A dict with the uploader status
+    :doc-author: AR
+    """
+    return avatar_uploader.status()
+
+
+@router.get("/response-cache")
+async def read_response_cache_status():
+
+    """
+    The read_response_cache_status function returns the hits and misses of the cache of the list pages,
+    used to check its hit rate and to size RESPONSE_CACHE_TTL.
+
+    :return: A dict with the cache status
+    :doc-author: AR
+    """
+    return response_cache.status()
@@ -1,66 +1,122 @@
-from typing import List
+from typing import List, Optional
 
-from fastapi import APIRouter, HTTPException, Depends, status
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, HTTPException, Depends, Query, Request, Response, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from src.database.db import get_db
+from src.database.db import get_primary_db, get_session_factory
 from src.database.models import User
 from src.schemas import NoteModel, NoteUpdate, NoteStatusUpdate, NoteResponse
 from src.repository import notes as repository_notes
 from src.services.auth import auth_service
-from fastapi_limiter.depends import RateLimiter
+from src.services.export import EXPORT_FORMATS, serialize_rows
+from src.services.etags import current_etag, get_conditional_db, not_modified
+from src.services.pagination import decode_cursor, set_next_cursor
+from src.services.rate_limit import RateLimit
+from src.services.response_cache import get_cacheable_db, response_cache
 
 
 router = APIRouter(prefix='/notes', tags=["notes"])
 
 
 @router.get("/", response_model=List[NoteResponse], description='No more than 10 requests per minute',
-            dependencies=[Depends(RateLimiter(times=10, seconds=60))])
-async def read_notes(skip: int = 0, limit: int = 100, db: Session = Depends(get_db),
+            dependencies=[Depends(RateLimit(times=10, seconds=60))])
+async def read_notes(request: Request, response: Response, skip: int = 0, limit: int = 100,
+                     cursor: Optional[str] = None,
+                     db: AsyncSession = Depends(get_cacheable_db),
                      current_user: User = Depends(auth_service.get_current_user)):
 
     """
     The read_notes function returns a list of notes.
-
+        Pages can be requested with skip/limit or with the cursor returned in the X-Next-Cursor header
+        of the previous page; the cursor does not get slower on deep pages.
+        The response carries the ETag of the notes of the user, a request with that tag in If-None-Match
+        is answered with 304 Not Modified without querying the database.
+        Conditional requests, and every request while the response cache is enabled, read from the primary;
+        other requests may read from a replica and get a tag that is never answered with 304.
+        With RESPONSE_CACHE_ENABLED the serialized pages are cached in Redis until the notes change.
+
+    :param request: Request: Get the If-None-Match header
+    :param response: Response: Set the X-Next-Cursor and ETag headers
     :param skip: int: Skip the first n notes
     :param limit: int: Limit the number of notes returned
-    :param db: Session: Pass the database session to the repository layer
+    :param cursor: Optional[str]: Cursor of the page to return, skip is ignored when it is set
+    :param db: AsyncSession: Pass the database session to the repository layer
     :param current_user: User: Get the current user
     :return: A list of notes
     :doc-author: Trelent
     """
-    notes = await repository_notes.get_notes(skip, limit, current_user, db)
-    return notes
+    etag = await current_etag(request, "notes", current_user.id, db)
+    unchanged = not_modified(request, response, etag)
+    if unchanged is not None:
+        return unchanged
+    key = await response_cache.key("notes", current_user.id, request, db)
+    cached = await response_cache.get(key)
+    if cached is not None:
+        return cached
+    after = decode_cursor(cursor, (int,))[0] if cursor else None
+    notes = await repository_notes.get_notes(skip, limit, current_user, db, after)
+    set_next_cursor(response, notes, limit, ("id",))
+    return await response_cache.set(key, response, notes, NoteResponse)
+
+
+@router.get("/export", response_class=StreamingResponse)
+async def export_notes(fmt: str = Query("ndjson", alias="format", pattern="^(ndjson|csv)$"),
+                       session_factory=Depends(get_session_factory),
+                       current_user: User = Depends(auth_service.get_current_user)):
+
+    """
+    The export_notes function streams all notes of the user with their tags as NDJSON or CSV.
+        Rows are read from a server-side cursor and written to the response one by one,
+        so the memory used does not grow with the number of notes.
+
+    :param fmt: str: ndjson (default) or csv, passed as the format query parameter
+    :param session_factory: Open a session that lives as long as the response is streamed
+    :param current_user: User: Get the current user
+    :return: A streaming response with the notes
+    :doc-author: AR
+    """
+    async def rows():
+        async with session_factory() as db:
+            async for note in repository_notes.stream_notes(current_user, db):
+                yield note
+
+    return StreamingResponse(serialize_rows(rows(), NoteResponse, fmt), media_type=EXPORT_FORMATS[fmt],
+                             headers={"Content-Disposition": f'attachment; filename="notes.{fmt}"'})
 
 
 @router.get("/{note_id}", response_model=NoteResponse)
-async def read_note(note_id: int, db: Session = Depends(get_db),
+async def read_note(note_id: int, request: Request, response: Response,
+                    db: AsyncSession = Depends(get_conditional_db),
                     current_user: User = Depends(auth_service.get_current_user)):
 
     """
     The read_note function is used to read a note by its ID.
 
     :param note_id: int: Specify the type of the parameter and to give it a name
-    :param db: Session: Get the database session
+    :param request: Request: Get the If-None-Match header
+    :param response: Response: Set the ETag header
+    :param db: AsyncSession: Get the database session
     :param current_user: User: Get the current user
     :return: A note object
     :doc-author: Trelent
     """
+    etag = await current_etag(request, "notes", current_user.id, db)
     note = await repository_notes.get_note(note_id, current_user, db)
     if note is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Note not found")
-    return note
+    return not_modified(request, response, etag) or note
 
 
 @router.post("/", response_model=NoteResponse, status_code=status.HTTP_201_CREATED)
-async def create_note(body: NoteModel, db: Session = Depends(get_db),
+async def create_note(body: NoteModel, db: AsyncSession = Depends(get_primary_db),
                       current_user: User = Depends(auth_service.get_current_user)):
 
     """
     The create_note function creates a new note in the database.
 
     :param body: NoteModel: Get the body of the request
-    :param db: Session: Pass the database session to the repository layer
+    :param db: AsyncSession: Pass the database session to the repository layer
     :param current_user: User: Get the user who is currently logged in
     :return: A note object
     :doc-author: Trelent
@@ -69,7 +125,7 @@ async def create_note(body: NoteModel, db: Session = Depends(get_db),
 
 
 @router.put("/{note_id}", response_model=NoteResponse)
-async def update_note(body: NoteUpdate, note_id: int, db: Session = Depends(get_db),
+async def update_note(body: NoteUpdate, note_id: int, db: AsyncSession = Depends(get_primary_db),
                       current_user: User = Depends(auth_service.get_current_user)):
 
     """
@@ -82,7 +138,7 @@ async def update_note(body: NoteUpdate, note_id: int, db: Session = Depends(get_
 
     :param body: NoteUpdate: Get the data that is being passed in from the request body
     :param note_id: int: Identify the note to be deleted
-    :param db: Session: Pass the database session to the function
+    :param db: AsyncSession: Pass the database session to the function
     :param current_user: User: Get the user who is currently logged in
     :return: A note object
     :doc-author: AR
@@ -94,19 +150,19 @@ async def update_note(body: NoteUpdate, note_id: int, db: Session = Depends(get_
 
 
 @router.patch("/{note_id}", response_model=NoteResponse)
-async def update_status_note(body: NoteStatusUpdate, note_id: int, db: Session = Depends(get_db),
+async def update_status_note(body: NoteStatusUpdate, note_id: int, db: AsyncSession = Depends(get_primary_db),
                              current_user: User = Depends(auth_service.get_current_user)):
 
     """
     The update_status_note function updates the status of a note.
         The function takes in a NoteStatusUpdate object, which contains the new status for the note.
         It also takes in an integer representing the id of the note to be updated and two optional parameters:
-            - db: A database session that is used to query data from our database (defaults to Depends(get_db))
+            - db: A database session that is used to query data from our database (defaults to Depends(get_primary_db))
             - current_user: The user who is making this request (defaults to Depends(auth_service.get_current_user))
 
     :param body: NoteStatusUpdate: Get the status of the note from the request body
     :param note_id: int: Get the note id from the url
-    :param db: Session: Pass the database session to the function
+    :param db: AsyncSession: Pass the database session to the function
     :param current_user: User: Get the user who is logged in
     :return: A note object
     :doc-author: Trelent
@@ -118,14 +174,14 @@ async def update_status_note(body: NoteStatusUpdate, note_id: int, db: Session =
 
 
 @router.delete("/{note_id}", response_model=NoteResponse)
-async def remove_note(note_id: int, db: Session = Depends(get_db),
+async def remove_note(note_id: int, db: AsyncSession = Depends(get_primary_db),
                       current_user: User = Depends(auth_service.get_current_user)):
 
     """
     The remove_note function removes a note from the database.
 
     :param note_id: int: Specify the note to be removed
-    :param db: Session: Pass the database session to the repository
+    :param db: AsyncSession: Pass the database session to the repository
     :param current_user: User: Get the user that is currently logged in
     :return: A note object
     :doc-author: Trelent
@@ -1,37 +1,63 @@
-from typing import List
+from typing import List, Optional
 
-from fastapi import APIRouter, HTTPException, Depends, status
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, HTTPException, Depends, Request, Response, status
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from src.database.db import get_db
+from src.database.db import get_primary_db
 from src.database.models import User
 from src.schemas import TagModel, TagResponse
 from src.repository import tags as repository_tags
 from src.services.auth import auth_service
+from src.services.etags import current_etag, get_conditional_db, not_modified
+from src.services.pagination import decode_cursor, set_next_cursor
+from src.services.response_cache import get_cacheable_db, response_cache
 
 router = APIRouter(prefix='/tags', tags=["tags"])
 
 
 @router.get("/", response_model=List[TagResponse])
-async def read_tags(skip: int = 0, limit: int = 100, db: Session = Depends(get_db),
+async def read_tags(request: Request, response: Response, skip: int = 0, limit: int = 100,
+                    cursor: Optional[str] = None,
+                    db: AsyncSession = Depends(get_cacheable_db),
                     current_user: User = Depends(auth_service.get_current_user)):
 
     """
-    The read_tags function returns a list of tags.
-
+    The read_tags function returns a list of tags ordered by name.
+        Pages can be requested with skip/limit or with the cursor returned in the X-Next-Cursor header
+        of the previous page; the cursor does not get slower on deep pages.
+        The response carries the ETag of the tags of the user, a request with that tag in If-None-Match
+        is answered with 304 Not Modified without querying the database.
+        Conditional requests, and every request while the response cache is enabled, read from the primary;
+        other requests may read from a replica and get a tag that is never answered with 304.
+        With RESPONSE_CACHE_ENABLED the serialized pages are cached in Redis until the tags change.
+
+    :param request: Request: Get the If-None-Match header
+    :param response: Response: Set the X-Next-Cursor and ETag headers
     :param skip: int: Skip the first n tags
     :param limit: int: Limit the number of tags returned
-    :param db: Session: Pass the database session to the function
+    :param cursor: Optional[str]: Cursor of the page to return, skip is ignored when it is set
+    :param db: AsyncSession: Pass the database session to the function
     :param current_user: User: Get the current user from the auth_service
     :return: A list of tags
     :doc-author: Trelent
     """
-    tags = await repository_tags.get_tags(skip, limit, current_user, db)
-    return tags
+    etag = await current_etag(request, "tags", current_user.id, db)
+    unchanged = not_modified(request, response, etag)
+    if unchanged is not None:
+        return unchanged
+    key = await response_cache.key("tags", current_user.id, request, db)
+    cached = await response_cache.get(key)
+    if cached is not None:
+        return cached
+    after = decode_cursor(cursor, (str, int)) if cursor else None
+    tags = await repository_tags.get_tags(skip, limit, current_user, db, after)
+    set_next_cursor(response, tags, limit, ("name", "id"))
+    return await response_cache.set(key, response, tags, TagResponse)
 
 
 @router.get("/{tag_id}", response_model=TagResponse)
-async def read_tag(tag_id: int, db: Session = Depends(get_db),
+async def read_tag(tag_id: int, request: Request, response: Response,
+                   db: AsyncSession = Depends(get_conditional_db),
                    current_user: User = Depends(auth_service.get_current_user)):
 
     """
@@ -41,26 +67,29 @@ async def read_tag(tag_id: int, db: Session = Depends(get_db),
         other functions that read_tag calls.
 
     :param tag_id: int: Specify the id of the tag to be read
-    :param db: Session: Pass the database session to the function
+    :param request: Request: Get the If-None-Match header
+    :param response: Response: Set the ETag header
+    :param db: AsyncSession: Pass the database session to the function
     :param current_user: User: Ensure that the user is authenticated
     :return: A tag object
     :doc-author: Trelent
     """
+    etag = await current_etag(request, "tags", current_user.id, db)
     tag = await repository_tags.get_tag(tag_id, current_user, db)
     if tag is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Tag not found")
-    return tag
+    return not_modified(request, response, etag) or tag
 
 
 @router.post("/", response_model=TagResponse, status_code=status.HTTP_201_CREATED)
-async def create_tag(body: TagModel, db: Session = Depends(get_db),
+async def create_tag(body: TagModel, db: AsyncSession = Depends(get_primary_db),
                      current_user: User = Depends(auth_service.get_current_user)):
 
     """
     The create_tag function creates a new tag in the database.
 
     :param body: TagModel: Pass the request body to the function
-    :param db: Session: Pass the database session to the repository layer
+    :param db: AsyncSession: Pass the database session to the repository layer
     :param current_user: User: Get the user who created the tag
     :return: A tag object
     :doc-author: Trelent
@@ -69,7 +98,7 @@ async def create_tag(body: TagModel, db: Session = Depends(get_db),
 
 
 @router.put("/{tag_id}", response_model=TagResponse)
-async def update_tag(body: TagModel, tag_id: int, db: Session = Depends(get_db),
+async def update_tag(body: TagModel, tag_id: int, db: AsyncSession = Depends(get_primary_db),
                      current_user: User = Depends(auth_service.get_current_user)):
 
     """
@@ -81,7 +110,7 @@ async def update_tag(body: TagModel, tag_id: int, db: Session = Depends(get_db),
 
     :param body: TagModel: Pass in the new tag information
     :param tag_id: int: Specify the id of the tag to be deleted
-    :param db: Session: Get the database session
+    :param db: AsyncSession: Get the database session
     :param current_user: User: Get the current user
     :return: An updated tag
     :doc-author: Trelent
@@ -93,7 +122,7 @@ async def update_tag(body: TagModel, tag_id: int, db: Session = Depends(get_db),
 
 
 @router.delete("/{tag_id}", response_model=TagResponse)
-async def remove_tag(tag_id: int, db: Session = Depends(get_db),
+async def remove_tag(tag_id: int, db: AsyncSession = Depends(get_primary_db),
                      current_user: User = Depends(auth_service.get_current_user)):
 
     """
@@ -102,7 +131,7 @@ async def remove_tag(tag_id: int, db: Session = Depends(get_db),
         and returns a dictionary containing information about that tag.
 
     :param tag_id: int: Get the tag id from the url
-    :param db: Session: Pass the database session to the function
+    :param db: AsyncSession: Pass the database session to the function
     :param current_user: User: Get the user who is logged in
     :return: The tag that was removed
     :doc-author: Trelent
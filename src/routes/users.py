@@ -1,22 +1,22 @@
-from fastapi import APIRouter, Depends, status, UploadFile, File
-from sqlalchemy.orm import Session
-import cloudinary
-import cloudinary.uploader
-from src import settings
-from src.database.db import get_db
+from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File
+from sqlalchemy.ext.asyncio import AsyncSession
+from src.database.db import get_primary_db
 from src.database.models import User
 from src.repository import users as repository_users
 from src.services.auth import auth_service
+from src.services.avatars import (AvatarDimensionsTooLarge, AvatarTooLarge, AvatarUploadError, InvalidAvatar,
+                                  avatar_uploader)
 from src.schemas import UserDb
 
 router = APIRouter(prefix="/users", tags=["users"])
 
 
 @router.get("/me/", response_model=UserDb)
-async def read_users_me(current_user: User = Depends(auth_service.get_current_user)):
+async def read_users_me(current_user: User = Depends(auth_service.get_current_user_from_token)):
 
     """
     The read_users_me function returns the current user's information.
+        With self-contained tokens it is served from the token claims, without a database query.
 
     :param current_user: User: Get the current user
     :return: The current user
@@ -27,28 +27,38 @@ async def read_users_me(current_user: User = Depends(auth_service.get_current_us
 
 @router.patch('/avatar', response_model=UserDb)
 async def update_avatar_user(file: UploadFile = File(), current_user: User = Depends(auth_service.get_current_user),
-                             db: Session = Depends(get_db)):
+                             db: AsyncSession = Depends(get_primary_db)):
 
     """
     The update_avatar_user function is used to update the avatar of a user.
         The function takes in an UploadFile object, which is a file that has been uploaded by the client.
         It also takes in the current_user and db objects as dependencies.
+        The image is resized locally and uploaded without blocking the event loop, the same picture
+        as the current avatar (read from the primary, not from the user cache) is not uploaded again. Files larger than AVATAR_MAX_SIZE are rejected
+        with HTTP 413, images of more than AVATAR_MAX_PIXELS pixels with HTTP 422, files that are not images
+        with HTTP 415, a failed upload is reported with HTTP 502.
 
     :param file: UploadFile: Get the file from the request
     :param current_user: User: Get the current user from the database
-    :param db: Session: Pass the database session to the function
+    :param db: AsyncSession: Pass the database session to the function
     :return: The updated user
     :doc-author: Trelent
     """
-    cloudinary.config(
-        cloud_name=settings.CLOUD_NAME,
-        api_key=settings.API_KEY,
-        api_secret=settings.API_SECRET,
-        secure=True
-    )
-
-    r = cloudinary.uploader.upload(file.file, public_id=f'NotesApp/{current_user.username}', overwrite=True)
-    src_url = cloudinary.CloudinaryImage(f'NotesApp/{current_user.username}')\
-                        .build_url(width=250, height=250, crop='fill', version=r.get('version'))
-    user = await repository_users.update_avatar(current_user.email, src_url, db)
+    # the cached user may predate a change made by another worker
+    user = await repository_users.get_user_by_email(current_user.email, db)
+    try:
+        stored = await avatar_uploader.store(file.file, f'NotesApp/{user.username}', user.avatar_hash)
+    except AvatarTooLarge as err:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(err))
+    except AvatarDimensionsTooLarge as err:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(err))
+    except InvalidAvatar as err:
+        raise HTTPException(status_code=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE, detail=str(err))
+    except AvatarUploadError as err:
+        print(err)
+        raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail="Avatar upload failed")
+    if stored is None:
+        return user
+    src_url, avatar_hash = stored
+    user = await repository_users.update_avatar(user.email, src_url, db, avatar_hash)
     return user
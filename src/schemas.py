@@ -1,5 +1,5 @@
 from datetime import datetime
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 from pydantic import BaseModel, Field, EmailStr
 
 
@@ -66,6 +66,31 @@ class ContactResponse(ContactBase):
         orm_mode = True
 
 
+class ContactBulkError(BaseModel):
+    index: int
+    errors: List[Dict[str, Any]]
+
+
+class ContactBulkResponse(BaseModel):
+    ids: List[int]
+    errors: List[ContactBulkError] = []
+
+
+class ContactImportResponse(BaseModel):
+    id: str
+    filename: str
+    status: str
+    processed: int
+    imported: int
+    failed: int
+    errors: List[ContactBulkError] = []
+    created_at: datetime
+    finished_at: Optional[datetime] = None
+
+    class Config:
+        orm_mode = True
+
+
 class UserModel(BaseModel):
     username: str = Field(min_length=5, max_length=16)
     email: str
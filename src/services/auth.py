@@ -1,14 +1,19 @@
+import uuid
 from typing import Optional
-from redis import Redis
+from redis.asyncio import Redis
 from jose import JWTError, jwt
 from fastapi import HTTPException, status, Depends
 from fastapi.security import OAuth2PasswordBearer
 from passlib.context import CryptContext
 from datetime import datetime, timedelta
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from src.database.db import get_db
+from src.database.db import get_db, pin_primary
 from src.repository import users as repository_users
+from src.database.models import User
+from src.services.cache import token_cache, user_cache, user_versions
+from src.services.executor import BoundedExecutor
+from src.services.revocation import revocation_list
 from src import settings
 
 
@@ -17,13 +22,12 @@ class Auth:
     SECRET_KEY = settings.SECRET_KEY
     ALGORITHM = settings.ALGORITHM
     oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/auth/login")
+    REFRESH_TOKEN_EXPIRE_SECONDS = 7 * 24 * 60 * 60
+    # bcrypt takes ~250 ms per call, it must not run on the event loop
+    password_executor = BoundedExecutor(settings.PASSWORD_HASH_WORKERS, "password-hash")
 
-    r = Redis(
-        host=settings.REDIS_HOST,
-        port=settings.REDIS_PORT,
-        # password=settings.REDIS_PASSWORD,
-        db=0,
-    )
+    # shared async client, set in the lifespan of the application (main.py)
+    r: Optional[Redis] = None
 
     def verify_password(self, plain_password, hashed_password):
         """
@@ -52,6 +56,30 @@ class Auth:
         """
         return self.pwd_context.hash(password)
 
+    async def verify_password_async(self, plain_password: str, hashed_password: str) -> bool:
+        """
+        The verify_password_async function is verify_password run in the password hashing pool,
+        so the event loop keeps serving other requests while bcrypt runs.
+
+        :param self: Represent the instance of the class
+        :param plain_password: str: Pass in the password that is being checked
+        :param hashed_password: str: The hash stored for the user
+        :return: A boolean value
+        :doc-author: AR
+        """
+        return await self.password_executor.run(self.verify_password, plain_password, hashed_password)
+
+    async def get_password_hash_async(self, password: str) -> str:
+        """
+        The get_password_hash_async function is get_password_hash run in the password hashing pool.
+
+        :param self: Represent the instance of the class
+        :param password: str: Pass the password that is to be hashed
+        :return: A string of the hashed password
+        :doc-author: AR
+        """
+        return await self.password_executor.run(self.get_password_hash, password)
+
     # define a function to generate a new access token
     async def create_access_token(self, data: dict, expires_delta: Optional[float] = None):
         """
@@ -72,7 +100,7 @@ class Auth:
             expire = datetime.utcnow() + timedelta(seconds=expires_delta)
         else:
             expire = datetime.utcnow() + timedelta(minutes=150)
-        to_encode.update({"iat": datetime.utcnow(), "exp": expire, "scope": "access_token"})
+        to_encode.update({"iat": datetime.utcnow(), "exp": expire, "scope": "access_token", "jti": uuid.uuid4().hex})
         encoded_access_token = jwt.encode(to_encode, self.SECRET_KEY, algorithm=self.ALGORITHM)
         return encoded_access_token
 
@@ -94,65 +122,153 @@ class Auth:
         if expires_delta:
             expire = datetime.utcnow() + timedelta(seconds=expires_delta)
         else:
-            expire = datetime.utcnow() + timedelta(days=7)
+            expire = datetime.utcnow() + timedelta(seconds=self.REFRESH_TOKEN_EXPIRE_SECONDS)
         to_encode.update({"iat": datetime.utcnow(), "exp": expire, "scope": "refresh_token"})
         encoded_refresh_token = jwt.encode(to_encode, self.SECRET_KEY, algorithm=self.ALGORITHM)
         return encoded_refresh_token
 
-    async def decode_refresh_token(self, refresh_token: str):
+    async def decode_refresh_token(self, refresh_token: str) -> dict:
         """
         The decode_refresh_token function is used to decode the refresh token.
-            The function takes in a refresh_token as an argument and returns the email of the user if successful.
-            If unsuccessful, it raises an HTTPException with status code 401 (Unauthorized) and detail message 'Could not validate credentials'.
+            The function takes in a refresh_token as an argument and returns its payload if successful:
+            the email of the user (sub), the login session (sid) and the id of the token (jti).
+            If unsuccessful, it raises an HTTPException with status code 401 (Unauthorized).
 
         :param self: Represent the instance of a class
         :param refresh_token: str: Pass the refresh token to the function
-        :return: The email of the user
+        :return: The payload of the token
         :doc-author: AR
         """
         try:
             payload = jwt.decode(refresh_token, self.SECRET_KEY, algorithms=[self.ALGORITHM])
-            if payload['scope'] == 'refresh_token':
-                email = payload['sub']
-                return email
-            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='Invalid scope for token')
         except JWTError:
             raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='Could not validate credentials')
+        if payload.get('scope') != 'refresh_token':
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='Invalid scope for token')
+        if not all(payload.get(claim) for claim in ('sub', 'sid', 'jti')):
+            raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail='Invalid refresh token')
+        return payload
 
-    async def get_current_user(self, token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+    def decode_access_token(self, token: str) -> dict:
+        """
+        The decode_access_token function verifies the signature of a token and returns its payload.
+            Payloads of verified tokens are kept in the token cache until the token expires,
+            so a client that reuses its token does not pay for jwt.decode on every request.
+            Checks whose result can change during the lifetime of a token, like revocation,
+            must be done by the caller on the returned payload, they are not cached.
+
+        :param self: Represent the instance of the class
+        :param token: str: The encoded token
+        :return: The payload of the token
+        :doc-author: AR
+        """
+        payload = token_cache.get(token)
+        if payload is None:
+            payload = jwt.decode(token, self.SECRET_KEY, algorithms=[self.ALGORITHM])
+            token_cache.set(token, payload)
+        return payload
+
+    @staticmethod
+    def credentials_exception() -> HTTPException:
+        return HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Could not validate credentials",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+    async def get_access_payload(self, token: str) -> dict:
+        """
+        The get_access_payload function returns the payload of a valid access token.
+            Tokens that cannot be verified, expired tokens, revoked tokens and tokens of another scope
+            are rejected with HTTP 401.
+
+        :param self: Represent the instance of the class
+        :param token: str: The token from the authorization header
+        :return: The payload of the token
+        :doc-author: AR
+        """
+        try:
+            payload = self.decode_access_token(token)
+        except JWTError:
+            raise self.credentials_exception()
+        if payload.get("scope") != "access_token" or payload.get("sub") is None:
+            raise self.credentials_exception()
+        if "jti" in payload and await revocation_list.is_revoked(payload["jti"]):
+            raise self.credentials_exception()
+        return payload
+
+    async def get_current_user(self, token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
         """
         The get_current_user function is a dependency that will be used in the
             protected endpoints. It takes a token as an argument and returns the user
             if it's valid, otherwise raises an HTTPException with status code 401.
+            On a cache miss the user is loaded from the primary and the rest of the request reads from it too.
 
         :param self: Refer to the class itself
         :param token: str: Get the token from the authorization header
-        :param db: Session: Pass the database session to the function
+        :param db: AsyncSession: Pass the database session to the function
+        :return: A user object, from the user cache when possible
+        :doc-author: AR
+        """
+        payload = await self.get_access_payload(token)
+        email = payload["sub"]
+        generation = user_cache.generation
+        user = await user_cache.get(email)
+        if user is None:
+            # the user is cached for USER_CACHE_TTL, it must not come from a lagging replica
+            user = await repository_users.get_user_by_email(email, pin_primary(db))
+            if user is None:
+                raise self.credentials_exception()
+            await user_cache.set(user, generation)
+        return user
+
+    async def get_current_user_from_token(self, token: str = Depends(oauth2_scheme),
+                                          db: AsyncSession = Depends(get_db)) -> User:
+        """
+        The get_current_user_from_token function is a lighter get_current_user for endpoints that only
+            need the identity and the profile of the user (id, username, email, avatar, confirmed).
+            A self-contained token (SELF_CONTAINED_TOKENS) whose version is still the current version of the user
+            is trusted and the user is built from its claims without any SQL. Other tokens, or tokens issued
+            before the profile changed, go through get_current_user.
+            The returned user is detached and has no password or relationships loaded.
+
+        :param self: Refer to the class itself
+        :param token: str: Get the token from the authorization header
+        :param db: AsyncSession: Only used when the claims cannot be trusted
         :return: A user object
         :doc-author: AR
         """
-        credentials_exception = HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Could not validate credentials",
-                headers={"WWW-Authenticate": "Bearer"},
-            )
+        payload = await self.get_access_payload(token)
+        if "uid" in payload:
+            version = await user_versions.get(payload["uid"])
+            if version is not None and version == payload.get("ver"):
+                return User(id=payload["uid"], email=payload["sub"], username=payload["username"],
+                            avatar=payload["avatar"], confirmed=payload["confirmed"],
+                            created_at=payload["created_at"] and datetime.fromisoformat(payload["created_at"]))
+        return await self.get_current_user(token, db)
 
-        try:
-            # Decode JWT
-            payload = jwt.decode(token, self.SECRET_KEY, algorithms=[self.ALGORITHM])
-            if payload['scope'] == 'access_token':
-                email = payload["sub"]
-                if email is None:
-                    raise credentials_exception
-            else:
-                raise credentials_exception
-        except JWTError as e:
-            raise credentials_exception
+    async def access_token_data(self, user: User) -> dict:
+        """
+        The access_token_data function returns the claims of a new access token for the user.
+            With SELF_CONTAINED_TOKENS the token also carries the profile of the user and its current version,
+            see get_current_user_from_token.
 
-        user = await repository_users.get_user_by_email(email, db)
-        if user is None:
-            raise credentials_exception
-        return user
+        :param self: Represent the instance of the class
+        :param user: User: The user the token is issued for
+        :return: A dict to pass to create_access_token
+        :doc-author: AR
+        """
+        data = {"sub": user.email}
+        if settings.SELF_CONTAINED_TOKENS:
+            data.update({
+                "uid": user.id,
+                "username": user.username,
+                "avatar": user.avatar,
+                "confirmed": user.confirmed,
+                "created_at": user.created_at and user.created_at.isoformat(),
+                "ver": await user_versions.get(user.id),
+            })
+        return data
 
     def create_email_token(self, data: dict):
         """
@@ -0,0 +1,241 @@
+import asyncio
+import hashlib
+import io
+import os
+import time
+from typing import BinaryIO, List, Optional, Sequence, Tuple
+
+import httpx
+from cloudinary.utils import api_sign_request, cloudinary_url
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from src import settings
+from src.services.executor import BoundedExecutor
+from src.services.latency import LatencyStats
+
+
+class AvatarUploadError(Exception):
+    pass
+
+
+class AvatarTooLarge(AvatarUploadError):
+    pass
+
+
+class InvalidAvatar(AvatarUploadError):
+    pass
+
+
+class AvatarDimensionsTooLarge(AvatarUploadError):
+    pass
+
+
+# Pillow refuses to open images with more than twice as many pixels, the others are checked by resize_image
+Image.MAX_IMAGE_PIXELS = settings.AVATAR_MAX_PIXELS
+
+
+def file_size(file: BinaryIO) -> int:
+    position = file.tell()
+    size = file.seek(0, os.SEEK_END)
+    file.seek(position)
+    return size
+
+
+def content_hash(file: BinaryIO, sizes: Sequence[Tuple[int, int]]) -> str:
+    """
+    The content_hash function hashes the uploaded file together with the sizes it is resized to,
+    so that a change of AVATAR_SIZES is not mistaken for the same avatar.
+
+    :param file: BinaryIO: The uploaded image
+    :param sizes: Sequence[Tuple[int, int]]: The (width, height) of the stored images
+    :return: The hex digest
+    :doc-author: AR
+    """
+    digest = hashlib.sha256(repr(list(sizes)).encode())
+    file.seek(0)
+    for chunk in iter(lambda: file.read(64 * 1024), b""):
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def resize_image(file: BinaryIO, sizes: Sequence[Tuple[int, int]], max_pixels: Optional[int] = None) -> List[bytes]:
+    """
+    The resize_image function decodes the uploaded image and crops and resizes it to every size (JPEG).
+        The dimensions are read from the header, an image with more than max_pixels pixels is never decoded.
+
+    :param file: BinaryIO: The uploaded image
+    :param sizes: Sequence[Tuple[int, int]]: The (width, height) of the images
+    :param max_pixels: Optional[int]: The largest width * height accepted, Image.MAX_IMAGE_PIXELS when None
+    :return: One encoded image per size
+    :doc-author: AR
+    """
+    max_pixels = max_pixels or Image.MAX_IMAGE_PIXELS
+    try:
+        with Image.open(file) as image:
+            width, height = image.size
+            if width * height > max_pixels:
+                raise AvatarDimensionsTooLarge(f"Avatar is larger than {max_pixels} pixels ({width}x{height})")
+            # JPEGs are decoded at the smallest scale that is still large enough, much faster for photos
+            image.draft("RGB", (max(width for width, _ in sizes), max(height for _, height in sizes)))
+            image = ImageOps.exif_transpose(image).convert("RGB")
+            images = []
+            for size in sizes:
+                buffer = io.BytesIO()
+                ImageOps.fit(image, size, Image.Resampling.LANCZOS).save(buffer, "JPEG", quality=85, optimize=True)
+                images.append(buffer.getvalue())
+            return images
+    except Image.DecompressionBombError as err:
+        raise AvatarDimensionsTooLarge(f"Avatar is larger than {max_pixels} pixels") from err
+    except (UnidentifiedImageError, OSError) as err:
+        raise InvalidAvatar(f"Avatar is not a supported image: {err}") from err
+
+
+class AvatarUploader:
+    """
+    Uploads avatars to Cloudinary with signed requests to its upload API, over a shared async HTTP client.
+
+    The client (and its connection pool of max_connections) is created once, in start(); an upload does not
+    block the event loop and the file is streamed from the spooled upload instead of being read into memory.
+    Files larger than max_size and images of more than max_pixels pixels are rejected before anything is sent.
+    The duration of every upload is recorded.
+
+    Avatars are cropped and resized to every one of sizes locally, in a pool of worker threads, and the
+    small images are uploaded. The first size is the avatar of the user, the others are stored next to it.
+    An upload whose content hash matches the current avatar of the user is not processed nor sent again.
+    """
+
+    def __init__(self, cloud_name: str, api_key: int, api_secret: str, max_size: int, timeout: float,
+                 max_connections: int, sizes: Sequence[Tuple[int, int]], workers: int,
+                 max_pixels: Optional[int] = None, base_url: str = "https://api.cloudinary.com",
+                 client: Optional[httpx.AsyncClient] = None):
+        self.cloud_name = cloud_name
+        self.api_key = api_key
+        self.api_secret = api_secret
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_connections = max_connections
+        self.base_url = base_url
+        self.client = client
+        self.sizes = list(sizes)
+        self.max_pixels = max_pixels
+        self.executor = BoundedExecutor(workers, "avatar")
+        self.stats = LatencyStats()
+        self.uploads = 0
+        self.failures = 0
+        self.bytes_sent = 0
+        self.unchanged = 0
+
+    def start(self) -> None:
+        self.client = httpx.AsyncClient(base_url=self.base_url, timeout=self.timeout,
+                                        limits=httpx.Limits(max_connections=self.max_connections))
+
+    async def close(self) -> None:
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    def signed_params(self, public_id: str) -> dict:
+        params = {"public_id": public_id, "overwrite": "true", "timestamp": str(int(time.time()))}
+        params["signature"] = api_sign_request(params, self.api_secret)
+        params["api_key"] = str(self.api_key)
+        return params
+
+    async def upload(self, file: BinaryIO, filename: str, content_type: str, public_id: str) -> dict:
+        """
+        The upload function uploads an image, replacing the one stored with the same public_id.
+
+        :param self: Represent the instance of the class
+        :param file: BinaryIO: The image, read from its current position
+        :param filename: str: Name of the uploaded file
+        :param content_type: str: Media type of the image
+        :param public_id: str: Where the image is stored
+        :return: The response of the upload API, with the version of the stored image
+        :doc-author: AR
+        """
+        size = file_size(file) - file.tell()
+        if size > self.max_size:
+            raise AvatarTooLarge(f"Avatar is larger than {self.max_size} bytes")
+        if self.client is None:
+            self.start()
+        start = time.perf_counter()
+        try:
+            response = await self.client.post(f"/v1_1/{self.cloud_name}/image/upload",
+                                              data=self.signed_params(public_id),
+                                              files={"file": (filename, file, content_type)})
+            response.raise_for_status()
+            result = response.json()
+        except (httpx.HTTPError, ValueError) as err:
+            self.failures += 1
+            raise AvatarUploadError(str(err)) from err
+        finally:
+            self.stats.observe(time.perf_counter() - start)
+        self.uploads += 1
+        self.bytes_sent += size
+        return result
+
+    def url(self, public_id: str, version: int) -> str:
+        """
+        The url function returns the address of a stored image.
+
+        :param self: Represent the instance of the class
+        :param public_id: str: Where the image is stored
+        :param version: int: The version returned by upload
+        :return: The URL of the image
+        :doc-author: AR
+        """
+        return cloudinary_url(public_id, cloud_name=self.cloud_name, secure=True, version=version)[0]
+
+    async def store(self, file: BinaryIO, public_id: str, current_hash: Optional[str]) -> Optional[Tuple[str, str]]:
+        """
+        The store function resizes an uploaded avatar and uploads the images of all sizes.
+            The images of the other sizes are stored as {public_id}_{width}x{height}.
+
+        :param self: Represent the instance of the class
+        :param file: BinaryIO: The uploaded image
+        :param public_id: str: Where the avatar is stored
+        :param current_hash: Optional[str]: Content hash of the current avatar of the user
+        :return: The URL and the content hash of the new avatar, None when it is the current avatar
+        :doc-author: AR
+        """
+        if file_size(file) > self.max_size:
+            raise AvatarTooLarge(f"Avatar is larger than {self.max_size} bytes")
+        digest = await self.executor.run(content_hash, file, self.sizes)
+        if digest == current_hash:
+            self.unchanged += 1
+            return None
+        images = await self.executor.run(resize_image, file, self.sizes, self.max_pixels)
+        public_ids = [public_id] + [f"{public_id}_{width}x{height}" for width, height in self.sizes[1:]]
+        results = await asyncio.gather(*(self.upload(io.BytesIO(image), "avatar.jpg", "image/jpeg", image_id)
+                                         for image_id, image in zip(public_ids, images)))
+        return self.url(public_id, results[0].get("version")), digest
+
+    def status(self) -> dict:
+        """
+        The status function returns the counters of the uploader and the duration of the uploads.
+
+        :param self: Represent the instance of the class
+        :return: A dict with the uploader status
+        :doc-author: AR
+        """
+        return {
+            "uploads": self.uploads,
+            "failures": self.failures,
+            "bytes_sent": self.bytes_sent,
+            "unchanged": self.unchanged,
+            **self.stats.as_dict("upload_time"),
+        }
+
+
+avatar_uploader = AvatarUploader(
+    cloud_name=settings.CLOUD_NAME,
+    api_key=settings.API_KEY,
+    api_secret=settings.API_SECRET,
+    max_size=settings.AVATAR_MAX_SIZE,
+    timeout=settings.AVATAR_UPLOAD_TIMEOUT,
+    max_connections=settings.AVATAR_UPLOAD_CONNECTIONS,
+    sizes=settings.AVATAR_SIZES,
+    workers=settings.AVATAR_WORKERS,
+    max_pixels=settings.AVATAR_MAX_PIXELS,
+    base_url=settings.CLOUDINARY_API_URL,
+)
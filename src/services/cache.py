@@ -0,0 +1,403 @@
+import asyncio
+import hashlib
+import json
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Callable, Dict, Hashable, Optional, Set
+
+from redis.exceptions import RedisError
+
+from src import settings
+from src.database.models import User
+
+
+class TTLCache:
+    """
+    In-process LRU cache whose entries expire ttl seconds after they were stored.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, timer: Callable[[], float] = time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timer = timer
+        self.data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        item = self.data.get(key)
+        if item is None:
+            return None
+        expires, value = item
+        if expires <= self.timer():
+            del self.data[key]
+            return None
+        self.data.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        self.data[key] = (self.timer() + (self.ttl if ttl is None else ttl), value)
+        self.data.move_to_end(key)
+        while len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+
+    def delete(self, key: Hashable) -> None:
+        self.data.pop(key, None)
+
+    def clear(self) -> None:
+        self.data.clear()
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+
+# columns needed to serve authenticated requests, the password hash and the refresh token are never cached
+USER_CACHE_COLUMNS = ("id", "username", "email", "created_at", "avatar", "avatar_hash", "confirmed")
+
+
+class UserCache:
+    """
+    Cache of the users loaded by Auth.get_current_user, keyed by email (the sub of the access token).
+
+    Entries live in a TTL LRU of the process and, when a redis client is set, in Redis as well so that
+    all workers share them. Every hit returns a new detached User, requests never share an ORM instance.
+    The repository functions that change a user invalidate its entry; changes made outside of the
+    application are picked up when the entry expires.
+
+    Invalidations are published on CHANNEL through the broadcast client and every process drops the entry
+    from its LRU (see listen). While a broadcast client is set the LRU is only used when the process is
+    subscribed, an invalidation missed during a lost connection can not leave a stale user behind.
+    """
+
+    CHANNEL = "user_cache_invalidations"
+
+    def __init__(self, maxsize: int, ttl: float, redis=None, broadcast=None):
+        self.local = TTLCache(maxsize, ttl)
+        self.ttl = ttl
+        self.redis = redis
+        self.broadcast = broadcast
+        self.subscribed = False
+        # bumped on every invalidation, a user loaded before an invalidation is not stored
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(email: str) -> str:
+        return f"user:{email}"
+
+    async def get(self, email: str) -> Optional[User]:
+        """
+        The get function returns the cached user with the given email, or None on a miss.
+
+        :param self: Represent the instance of the class
+        :param email: str: Email of the user
+        :return: A detached User without password or None
+        :doc-author: AR
+        """
+        generation = self.generation
+        values = self.local.get(email) if self.trusts_local() else None
+        if values is None and self.redis is not None:
+            try:
+                raw = await self.redis.get(self.key(email))
+            except RedisError:
+                raw = None
+            if raw is not None:
+                values = json.loads(raw)
+                values["created_at"] = values["created_at"] and datetime.fromisoformat(values["created_at"])
+                if generation == self.generation:
+                    self.local.set(email, values)
+        if values is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return User(**values)
+
+    def trusts_local(self) -> bool:
+        """
+        The trusts_local function tells whether the LRU of the process may be read: always without
+            a broadcast client, only while the process is subscribed to the invalidations otherwise.
+
+        :param self: Represent the instance of the class
+        :return: True when the LRU receives every invalidation
+        :doc-author: AR
+        """
+        return self.broadcast is None or self.subscribed
+
+    async def set(self, user: User, generation: Optional[int] = None) -> None:
+        """
+        The set function stores the columns of the user listed in USER_CACHE_COLUMNS.
+            Pass the generation read before the user was loaded: when an invalidation arrived in between
+            the user may be older than the change and is not stored.
+
+        :param self: Represent the instance of the class
+        :param user: User: The user loaded from the database
+        :param generation: Optional[int]: The generation read before loading the user
+        :return: Nothing
+        :doc-author: AR
+        """
+        if generation is not None and generation != self.generation:
+            return
+        values = {column: getattr(user, column) for column in USER_CACHE_COLUMNS}
+        self.local.set(user.email, values)
+        if self.redis is not None:
+            created_at = values["created_at"]
+            raw = json.dumps({**values, "created_at": created_at and created_at.isoformat()})
+            try:
+                await self.redis.set(self.key(user.email), raw, ex=int(self.ttl))
+            except RedisError:
+                pass
+
+    def drop(self, email: str) -> None:
+        self.generation += 1
+        self.local.delete(email)
+
+    async def invalidate(self, email: str) -> None:
+        """
+        The invalidate function drops the cached user in every process,
+            the next request loads it from the database.
+
+        :param self: Represent the instance of the class
+        :param email: str: Email of the user that changed
+        :return: Nothing
+        :doc-author: AR
+        """
+        self.drop(email)
+        if self.redis is not None:
+            try:
+                await self.redis.delete(self.key(email))
+            except RedisError:
+                pass
+        if self.broadcast is not None:
+            try:
+                await self.broadcast.publish(self.CHANNEL, email)
+            except RedisError as err:
+                print(err)
+
+    async def listen(self) -> None:
+        """
+        The listen function drops the users invalidated by the other processes from the LRU, it runs
+            as a background task for the lifetime of the application (see main.py).
+            The LRU is cleared on every (re)subscription, invalidations published while the process
+            was not subscribed are lost.
+
+        :param self: Represent the instance of the class
+        :return: Nothing, runs until cancelled
+        :doc-author: AR
+        """
+        while True:
+            try:
+                async with self.broadcast.pubsub(ignore_subscribe_messages=True) as pubsub:
+                    await pubsub.subscribe(self.CHANNEL)
+                    self.generation += 1
+                    self.local.clear()
+                    self.subscribed = True
+                    while True:
+                        message = await pubsub.get_message(timeout=1.0)
+                        if message is not None:
+                            self.drop(message["data"])
+            except (RedisError, OSError) as err:
+                print(err)
+            finally:
+                self.subscribed = False
+            await asyncio.sleep(1)
+
+
+class TokenCache:
+    """
+    Payloads of access tokens whose signature was already verified, keyed by the sha256 of the token.
+
+    An entry expires together with its token (the exp claim), so an expired token is never served
+    from the cache. Revoked tokens must be removed with discard.
+    """
+
+    def __init__(self, maxsize: int):
+        self.local = TTLCache(maxsize, ttl=0)
+
+    @staticmethod
+    def digest(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token: str) -> Optional[dict]:
+        return self.local.get(self.digest(token))
+
+    def set(self, token: str, payload: dict) -> None:
+        ttl = payload.get("exp", 0) - time.time()
+        if ttl > 0:
+            self.local.set(self.digest(token), payload, ttl=ttl)
+
+    def discard(self, token: str) -> None:
+        self.local.delete(self.digest(token))
+
+
+class UserVersions:
+    """
+    Per-user counter that is bumped on every change of the profile (avatar, confirmation).
+
+    Self-contained access tokens carry the version they were issued with, a token whose version
+    differs from the current one holds stale claims. The counters live in Redis; every process
+    keeps the values it read for ttl seconds, so a change is seen everywhere within ttl.
+    Without Redis the counters are kept by the process, which is only correct with a single worker.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, redis=None):
+        self.local = TTLCache(maxsize, ttl)
+        self.counters: Dict[int, int] = {}
+        self.redis = redis
+
+    @staticmethod
+    def key(user_id: int) -> str:
+        return f"user_version:{user_id}"
+
+    async def get(self, user_id: int) -> Optional[int]:
+        """
+        The get function returns the current version of the user.
+
+        :param self: Represent the instance of the class
+        :param user_id: int: Id of the user
+        :return: The version, or None when it cannot be read (Redis is down)
+        :doc-author: AR
+        """
+        if self.redis is None:
+            return self.counters.get(user_id, 0)
+        version = self.local.get(user_id)
+        if version is None:
+            try:
+                version = int(await self.redis.get(self.key(user_id)) or 0)
+            except RedisError:
+                return None
+            self.local.set(user_id, version)
+        return version
+
+    async def bump(self, user_id: int) -> None:
+        """
+        The bump function increments the version of the user, the claims of the tokens issued before are stale.
+
+        :param self: Represent the instance of the class
+        :param user_id: int: Id of the user that changed
+        :return: Nothing
+        :doc-author: AR
+        """
+        self.counters[user_id] = self.counters.get(user_id, 0) + 1
+        self.local.delete(user_id)
+        if self.redis is not None:
+            try:
+                await self.redis.incr(self.key(user_id))
+            except RedisError:
+                pass
+
+
+class CollectionVersions:
+    """
+    Version of every collection (notes, contacts, tags) of a user, changed by the repository functions
+    that change the collection. The ETags of the list and detail endpoints and the keys of the response
+    cache are derived from it.
+
+    A version is a random token kept in Redis for ttl seconds; a collection without one gets a new token,
+    so a version that expired never comes back. Every process keeps the tokens it read for local_ttl
+    seconds, the process that made a change sees the new version at once. A change that cannot be
+    written to Redis is retried by the process on its next call, until then it reports no version for
+    that collection; the other processes see the change at the latest when the old token expires, which
+    is why ttl is kept short (seconds, not hours) and reads do not extend it.
+    Without Redis the versions are kept by the process.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, local_ttl: float, redis=None):
+        self.local = TTLCache(maxsize, local_ttl)
+        self.ttl = ttl
+        self.redis = redis
+        self.versions: Dict[tuple, str] = {}
+        # collections whose change is not in Redis yet
+        self.failed: Set[tuple] = set()
+
+    @staticmethod
+    def key(resource: str, user_id: int) -> str:
+        return f"collection_version:{resource}:{user_id}"
+
+    @staticmethod
+    def new_version() -> str:
+        return uuid.uuid4().hex[:16]
+
+    async def retry(self) -> None:
+        """
+        The retry function writes the changes that failed to Redis, it stops at the first error.
+
+        :param self: Represent the instance of the class
+        :return: Nothing
+        :doc-author: AR
+        """
+        for resource, user_id in list(self.failed):
+            try:
+                await self.redis.set(self.key(resource, user_id), self.new_version(), ex=int(self.ttl))
+            except RedisError:
+                return
+            self.failed.discard((resource, user_id))
+
+    async def get(self, resource: str, user_id: int) -> Optional[str]:
+        """
+        The get function returns the current version of a collection of the user.
+
+        :param self: Represent the instance of the class
+        :param resource: str: Name of the collection
+        :param user_id: int: Id of the owner
+        :return: The version, or None when it is not known (Redis is down or a change is not in Redis yet)
+        :doc-author: AR
+        """
+        if self.redis is None:
+            return self.versions.setdefault((resource, user_id), self.new_version())
+        if self.failed:
+            await self.retry()
+            if (resource, user_id) in self.failed:
+                return None
+        version = self.local.get((resource, user_id))
+        if version is None:
+            new_version = self.new_version()
+            try:
+                # one round trip: the current version, or the new one when there is none
+                version = await self.redis.set(self.key(resource, user_id), new_version, ex=int(self.ttl),
+                                               nx=True, get=True) or new_version
+            except RedisError:
+                return None
+            self.local.set((resource, user_id), version)
+        return version
+
+    async def bump(self, resource: str, user_id: int) -> None:
+        """
+        The bump function gives a collection of the user a new version after it changed.
+
+        :param self: Represent the instance of the class
+        :param resource: str: Name of the collection
+        :param user_id: int: Id of the owner
+        :return: Nothing
+        :doc-author: AR
+        """
+        self.versions[(resource, user_id)] = self.new_version()
+        self.local.delete((resource, user_id))
+        if self.redis is not None:
+            self.failed.add((resource, user_id))
+            await self.retry()
+
+    async def etag(self, resource: str, user_id: int, representation: str = "") -> Optional[str]:
+        """
+        The etag function returns the weak entity tag of a representation (page or item) of a collection
+            of the user at its current version.
+
+        :param self: Represent the instance of the class
+        :param resource: str: Name of the collection
+        :param user_id: int: Id of the owner
+        :param representation: str: Path and query parameters of the response
+        :return: The tag, or None when the version is unknown
+        :doc-author: AR
+        """
+        version = await self.get(resource, user_id)
+        if version is None:
+            return None
+        digest = hashlib.blake2b(representation.encode(), digest_size=8).hexdigest()
+        return f'W/"{resource}-{user_id}-{version}-{digest}"'
+
+
+user_cache = UserCache(settings.USER_CACHE_SIZE, settings.USER_CACHE_TTL)
+user_versions = UserVersions(settings.USER_CACHE_SIZE, settings.USER_VERSION_CACHE_TTL)
+token_cache = TokenCache(settings.TOKEN_CACHE_SIZE)
+collection_versions = CollectionVersions(settings.USER_CACHE_SIZE, settings.COLLECTION_VERSION_TTL,
+                                         settings.COLLECTION_VERSION_CACHE_TTL)
@@ -0,0 +1,284 @@
+import csv
+import io
+import json
+import os
+import uuid
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from typing import BinaryIO, Callable, Iterator, List, Optional, Tuple
+
+from pydantic import ValidationError
+from redis.exceptions import RedisError
+
+from src import settings
+from src.database.models import User
+from src.repository import contacts as repository_contacts
+from src.schemas import ContactCreate
+from src.services.cache import TTLCache
+from src.services.executor import BoundedExecutor
+
+# Only the first errors are kept, a broken file must not fill the memory with error reports
+MAX_REPORTED_ERRORS = 100
+
+
+@dataclass
+class ImportJob:
+    id: str
+    user_id: int
+    filename: str
+    status: str = "pending"
+    processed: int = 0
+    imported: int = 0
+    failed: int = 0
+    errors: List[dict] = field(default_factory=list)
+    created_at: datetime = field(default_factory=datetime.utcnow)
+    finished_at: Optional[datetime] = None
+
+    def dump(self) -> str:
+        return json.dumps(asdict(self), default=datetime.isoformat)
+
+    @classmethod
+    def load(cls, raw: str) -> "ImportJob":
+        values = json.loads(raw)
+        values["created_at"] = datetime.fromisoformat(values["created_at"])
+        values["finished_at"] = values["finished_at"] and datetime.fromisoformat(values["finished_at"])
+        return cls(**values)
+
+
+class ImportJobs:
+    """
+    Registry of contact imports, used by the job status endpoint.
+
+    A job is stored in Redis for ttl seconds after its last update, so every worker can report the
+    progress of an import started by another one. Without Redis, or while it fails, jobs are kept
+    in a TTL LRU of the process (at most maxsize jobs).
+    """
+
+    def __init__(self, maxsize: int, ttl: float, redis=None):
+        self.local = TTLCache(maxsize, ttl)
+        self.ttl = ttl
+        self.redis = redis
+
+    @staticmethod
+    def key(job_id: str) -> str:
+        return f"contact_import:{job_id}"
+
+    async def create(self, user: User, filename: str) -> ImportJob:
+        """
+        The create function registers a new pending import of the user.
+
+        :param self: Represent the instance of the class
+        :param user: User: Owner of the import
+        :param filename: str: Name of the uploaded file
+        :return: The new job
+        :doc-author: AR
+        """
+        job = ImportJob(id=uuid.uuid4().hex, user_id=user.id, filename=filename)
+        await self.save(job)
+        return job
+
+    async def save(self, job: ImportJob) -> None:
+        """
+        The save function stores the current state of the job and restarts its ttl.
+
+        :param self: Represent the instance of the class
+        :param job: ImportJob: The job to store
+        :return: Nothing
+        :doc-author: AR
+        """
+        self.local.set(job.id, job)
+        if self.redis is not None:
+            try:
+                await self.redis.set(self.key(job.id), job.dump(), ex=int(self.ttl))
+            except RedisError as err:
+                print(err)
+
+    async def get(self, job_id: str, user: User) -> Optional[ImportJob]:
+        """
+        The get function returns an import of the user, started by any worker.
+
+        :param self: Represent the instance of the class
+        :param job_id: str: Id of the job
+        :param user: User: The user that asks for the job
+        :return: The job, or None when it does not exist, expired or belongs to another user
+        :doc-author: AR
+        """
+        job = None
+        if self.redis is not None:
+            try:
+                raw = await self.redis.get(self.key(job_id))
+            except RedisError as err:
+                print(err)
+                raw = None
+            if raw is not None:
+                job = ImportJob.load(raw)
+        if job is None:
+            job = self.local.get(job_id)
+        if job is None or job.user_id != user.id:
+            return None
+        return job
+
+
+import_jobs = ImportJobs(settings.CONTACTS_IMPORT_JOBS_SIZE, settings.CONTACTS_IMPORT_JOB_TTL)
+# parsing and validation of the uploaded files, off the event loop
+import_executor = BoundedExecutor(settings.CONTACTS_IMPORT_WORKERS, "contacts-import")
+
+
+def iter_csv_rows(file: BinaryIO) -> Iterator[dict]:
+    """
+    The iter_csv_rows function reads contacts from a CSV file line by line.
+        The first line must contain the column names, they match the fields of ContactCreate.
+
+    :param file: BinaryIO: The uploaded file
+    :return: An iterator of dicts, one per contact
+    :doc-author: AR
+    """
+    text = io.TextIOWrapper(file, encoding="utf-8-sig", newline="")
+    for row in csv.DictReader(text):
+        yield {key.strip().lower(): value for key, value in row.items() if key and value not in (None, "")}
+
+
+def _unfold(text: io.TextIOBase) -> Iterator[str]:
+    # vCard lines longer than 75 characters continue on the next line that starts with a space or a tab
+    current = None
+    for line in text:
+        line = line.rstrip("\r\n")
+        if line[:1] in (" ", "\t") and current is not None:
+            current += line[1:]
+            continue
+        if current is not None:
+            yield current
+        current = line
+    if current is not None:
+        yield current
+
+
+def _parse_bday(value: str) -> str:
+    value = value.replace("-", "")
+    return f"{value[0:4]}-{value[4:6]}-{value[6:8]}" if len(value) >= 8 else value
+
+
+def iter_vcard_rows(file: BinaryIO) -> Iterator[dict]:
+    """
+    The iter_vcard_rows function reads contacts from a vCard (.vcf) file one card at a time.
+        N/FN, EMAIL, TEL, BDAY and NOTE are mapped to the fields of ContactCreate,
+        only the first EMAIL and TEL of a card are used.
+
+    :param file: BinaryIO: The uploaded file
+    :return: An iterator of dicts, one per card
+    :doc-author: AR
+    """
+    text = io.TextIOWrapper(file, encoding="utf-8-sig")
+    card = None
+    for line in _unfold(text):
+        name, _, value = line.partition(":")
+        name = name.split(";")[0].split(".")[-1].upper()
+        if name == "BEGIN" and value.upper() == "VCARD":
+            card = {}
+        elif name == "END" and card is not None:
+            yield card
+            card = None
+        elif card is None or not value:
+            continue
+        elif name == "N":
+            parts = value.split(";")
+            card["last_name"] = parts[0]
+            if len(parts) > 1:
+                card["first_name"] = parts[1]
+        elif name == "FN" and "first_name" not in card:
+            card["first_name"], _, last_name = value.partition(" ")
+            card.setdefault("last_name", last_name)
+        elif name == "EMAIL":
+            card.setdefault("email", value)
+        elif name == "TEL":
+            card.setdefault("phone_number", value)
+        elif name == "BDAY":
+            card["birthday"] = _parse_bday(value)
+        elif name == "NOTE":
+            card["additional_data"] = value
+
+
+PARSERS = {
+    "csv": iter_csv_rows,
+    "vcard": iter_vcard_rows,
+}
+
+
+def detect_format(filename: str) -> Optional[str]:
+    """
+    The detect_format function picks the parser for an uploaded file by its extension.
+
+    :param filename: str: Name of the uploaded file
+    :return: csv, vcard or None when the file type is not supported
+    :doc-author: AR
+    """
+    extension = os.path.splitext(filename or "")[1].lower()
+    if extension == ".csv":
+        return "csv"
+    if extension in (".vcf", ".vcard"):
+        return "vcard"
+    return None
+
+
+def read_chunk(rows: Iterator[dict], job: ImportJob, size: int) -> Tuple[List[ContactCreate], bool]:
+    """
+    The read_chunk function parses and validates the next rows of a file until size of them are valid.
+        It is blocking and runs in import_executor; the rows that fail validation are counted in the job.
+
+    :param rows: Iterator[dict]: The rows returned by one of PARSERS
+    :param job: ImportJob: The job that tracks the progress
+    :param size: int: Number of valid contacts to return
+    :return: The valid contacts, and True when the file has no more rows
+    :doc-author: AR
+    """
+    chunk = []
+    for row in rows:
+        job.processed += 1
+        try:
+            chunk.append(ContactCreate.model_validate(row))
+        except ValidationError as err:
+            job.failed += 1
+            if len(job.errors) < MAX_REPORTED_ERRORS:
+                job.errors.append({"index": job.processed,
+                                   "errors": err.errors(include_url=False, include_context=False)})
+        if len(chunk) >= size:
+            return chunk, False
+    return chunk, True
+
+
+async def run_import(job: ImportJob, path: str, fmt: str, user: User, session_factory: Callable,
+                     chunk_size: int) -> None:
+    """
+    The run_import function imports the contacts of an uploaded file in the background.
+        The file is parsed incrementally in import_executor and every chunk_size valid rows are inserted
+        and committed in their own transaction, so a large file never holds a single huge transaction
+        nor blocks the event loop. The job is saved after every chunk; the file is removed when the import ends.
+
+    :param job: ImportJob: The job that tracks the progress
+    :param path: str: Path of the temporary copy of the uploaded file
+    :param fmt: str: csv or vcard
+    :param user: User: Owner of the imported contacts
+    :param session_factory: Callable: Opens a database session
+    :param chunk_size: int: Number of contacts inserted per transaction
+    :return: Nothing
+    :doc-author: AR
+    """
+    job.status = "running"
+    await import_jobs.save(job)
+    try:
+        async with session_factory() as db:
+            with open(path, "rb") as file:
+                rows = PARSERS[fmt](file)
+                exhausted = False
+                while not exhausted:
+                    chunk, exhausted = await import_executor.run(read_chunk, rows, job, chunk_size)
+                    job.imported += len(await repository_contacts.create_contacts(chunk, user, db))
+                    await import_jobs.save(job)
+        job.status = "done"
+    except Exception as err:
+        job.status = "failed"
+        job.errors.append({"index": job.processed, "errors": [{"msg": str(err)}]})
+    finally:
+        job.finished_at = datetime.utcnow()
+        await import_jobs.save(job)
+        os.remove(path)
@@ -0,0 +1,95 @@
+from typing import Optional
+from urllib.parse import urlencode
+
+from fastapi import Depends, Request, Response, status
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src.database.db import get_db, pin_primary, reads_from_primary
+from src.services.cache import collection_versions
+
+# tag of a response read from a replica: it never matches, the client sends it back with its next
+# request, which is read from the primary and gets a real tag
+UNVERIFIED_ETAG = 'W/"unverified"'
+
+
+async def get_conditional_db(request: Request, db: AsyncSession = Depends(get_db)) -> AsyncSession:
+    """
+    The get_conditional_db function is the session dependency of the endpoints that answer conditional GETs.
+        Reads go to a replica, except for requests with If-None-Match: their answer is compared with the
+        current version, so they read from the primary.
+
+    :param request: Request: Get the If-None-Match header
+    :param db: AsyncSession: The session of the request
+    :return: The session, pinned to the primary for conditional requests
+    :doc-author: AR
+    """
+    if request.headers.get("if-none-match"):
+        pin_primary(db)
+    return db
+
+
+def etag_matches(etag: str, if_none_match: Optional[str]) -> bool:
+    """
+    The etag_matches function compares an entity tag with the If-None-Match header (weak comparison).
+
+    :param etag: str: The current tag
+    :param if_none_match: Optional[str]: The header sent by the client
+    :return: True when the client already has the current representation
+    :doc-author: AR
+    """
+    if not if_none_match:
+        return False
+    opaque = etag.removeprefix("W/")
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return any(tag == "*" or tag.removeprefix("W/") == opaque for tag in tags)
+
+
+def representation(request: Request) -> str:
+    """
+    The representation function identifies what a GET returns: its path and its normalized query parameters.
+
+    :param request: Request: The request
+    :return: The path and the sorted query string
+    :doc-author: AR
+    """
+    return f"{request.url.path}?{urlencode(sorted(request.query_params.multi_items()))}"
+
+
+async def current_etag(request: Request, resource: str, user_id: int, db: AsyncSession) -> Optional[str]:
+    """
+    The current_etag function returns the tag of the response a GET of a collection (or one of its items)
+        of the user is about to send. It is called before the database is queried, so a change made meanwhile
+        is never hidden behind an old tag. The tag depends on the collection version and on the representation
+        (path and query parameters), a tag is never accepted for another page or item.
+        A session that may read from a replica gets UNVERIFIED_ETAG: its result can be older than the version.
+
+    :param request: Request: Get the path and the query parameters
+    :param resource: str: Name of the collection
+    :param user_id: int: Id of the owner
+    :param db: AsyncSession: The session the endpoint reads with
+    :return: The tag, or None when the version is unknown
+    :doc-author: AR
+    """
+    if not reads_from_primary(db):
+        return UNVERIFIED_ETAG
+    return await collection_versions.etag(resource, user_id, representation(request))
+
+
+def not_modified(request: Request, response: Response, etag: Optional[str]) -> Optional[Response]:
+    """
+    The not_modified function answers a conditional GET: when the tag of the client is current the endpoint
+        returns the 304 response, otherwise the tag is set on the response. Detail endpoints call it after
+        the item was found, a missing item is a 404 whatever the tag.
+
+    :param request: Request: Get the If-None-Match header
+    :param response: Response: Set the ETag header
+    :param etag: Optional[str]: The tag returned by current_etag
+    :return: The 304 response, or None when the endpoint has to answer
+    :doc-author: AR
+    """
+    if etag is None:
+        return None
+    if etag != UNVERIFIED_ETAG and etag_matches(etag, request.headers.get("if-none-match")):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    return None
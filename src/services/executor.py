@@ -0,0 +1,64 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+from src.services.latency import LatencyStats
+
+
+class BoundedExecutor:
+    """
+    Thread pool for blocking, CPU-heavy calls (bcrypt) made from async code.
+
+    At most max_workers calls run at the same time, the others wait in the queue of the pool.
+    The time every call waited for a worker is recorded in a LatencyStats histogram.
+    """
+
+    def __init__(self, max_workers: int, name: str):
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self.stats = LatencyStats()
+        # calls submitted and not finished yet, running or waiting for a worker
+        self.in_flight = 0
+
+    async def run(self, fn: Callable, *args: Any) -> Any:
+        """
+        The run function calls fn(*args) in the pool without blocking the event loop.
+
+        :param self: Represent the instance of the class
+        :param fn: Callable: The blocking function
+        :param args: Any: Positional arguments of fn
+        :return: The result of fn
+        :doc-author: AR
+        """
+        submitted = time.perf_counter()
+        started = None
+
+        def call():
+            nonlocal started
+            started = time.perf_counter()
+            return fn(*args)
+
+        loop = asyncio.get_running_loop()
+        self.in_flight += 1
+        future = loop.run_in_executor(self.executor, call)
+        try:
+            return await future
+        finally:
+            self.in_flight -= 1
+            if started is not None:
+                self.stats.observe(started - submitted)
+
+    def status(self) -> dict:
+        """
+        The status function returns the configuration and the queue time statistics of the pool.
+
+        :param self: Represent the instance of the class
+        :return: A dict with the pool status
+        :doc-author: AR
+        """
+        return {
+            "max_workers": self.max_workers,
+            "in_flight": self.in_flight,
+            **self.stats.as_dict("queue_time", count="calls"),
+        }
@@ -0,0 +1,49 @@
+import csv
+import io
+import json
+from typing import Any, AsyncIterator, Type
+
+from pydantic import BaseModel
+
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv",
+}
+
+
+def _csv_value(value: Any) -> Any:
+    # nested values (the tags of a note) do not fit into a CSV cell, they are written as JSON
+    if isinstance(value, (list, dict)):
+        return json.dumps(value)
+    return value
+
+
+async def serialize_rows(rows: AsyncIterator[Any], schema: Type[BaseModel], fmt: str) -> AsyncIterator[str]:
+    """
+    The serialize_rows function converts ORM rows to NDJSON lines or CSV lines one row at a time,
+    so an export never holds more than a single row in memory.
+
+    :param rows: AsyncIterator[Any]: The rows to export, for example from repository_contacts.stream_contacts
+    :param schema: Type[BaseModel]: Response model used to serialize a row
+    :param fmt: str: ndjson or csv
+    :return: An async iterator of text chunks for a StreamingResponse
+    :doc-author: AR
+    """
+    if fmt == "ndjson":
+        async for row in rows:
+            yield schema.model_validate(row, from_attributes=True).model_dump_json() + "\n"
+        return
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    fields = list(schema.model_fields)
+    writer.writerow(fields)
+    async for row in rows:
+        data = schema.model_validate(row, from_attributes=True).model_dump(mode="json")
+        writer.writerow([_csv_value(data[field]) for field in fields])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    # the header is still in the buffer when there are no rows
+    if buffer.tell():
+        yield buffer.getvalue()
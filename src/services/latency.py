@@ -0,0 +1,61 @@
+from bisect import bisect_left
+from typing import Dict, List, Optional
+
+# Upper bounds (in milliseconds) of the latency histogram buckets
+LATENCY_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 5000)
+
+
+class LatencyStats:
+    """
+    Count, total, maximum and histogram of the durations of an operation
+    (a pool checkout, an SMTP batch, an upload...).
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets: List[int] = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+
+    def observe(self, seconds: float) -> None:
+        """
+        The observe function records a single operation that took the given time.
+
+        :param self: Represent the instance of the class
+        :param seconds: float: Duration of the operation
+        :return: Nothing
+        :doc-author: AR
+        """
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.buckets[bisect_left(LATENCY_BUCKETS_MS, seconds * 1000)] += 1
+
+    def histogram(self) -> Dict[str, int]:
+        """
+        The histogram function returns the histogram keyed by the bucket upper bound.
+
+        :param self: Represent the instance of the class
+        :return: A dict like {"le_1ms": 10, ..., "le_inf": 0}
+        :doc-author: AR
+        """
+        labels = [f"le_{bound}ms" for bound in LATENCY_BUCKETS_MS] + ["le_inf"]
+        return dict(zip(labels, self.buckets))
+
+    def as_dict(self, prefix: str, count: Optional[str] = None) -> dict:
+        """
+        The as_dict function serializes the statistics for a status endpoint or a log line.
+
+        :param self: Represent the instance of the class
+        :param prefix: str: Prefix of the keys, e.g. wait_time gives wait_time_avg_ms
+        :param count: Optional[str]: Key of the number of operations, left out when None
+        :return: A dict with the count, the average and maximum in milliseconds and the histogram
+        :doc-author: AR
+        """
+        status = {count: self.count} if count else {}
+        status.update({
+            f"{prefix}_avg_ms": self.total * 1000 / self.count if self.count else 0.0,
+            f"{prefix}_max_ms": self.max * 1000,
+            f"{prefix}_histogram": self.histogram(),
+        })
+        return status
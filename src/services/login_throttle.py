@@ -0,0 +1,170 @@
+import time
+
+from redis.exceptions import RedisError
+
+from src import settings
+from src.services.cache import TTLCache
+
+
+# Takes an attempt for every key (the account and the client IP) when none of them is throttled, in one
+# atomic step: an attempt is counted as a failure before the password is checked, so concurrent attempts
+# see each other. Returns the seconds to wait, 0 when the attempt was taken.
+ACQUIRE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local base_delay = tonumber(ARGV[2])
+local max_delay = tonumber(ARGV[3])
+local wait = 0
+for i, key in ipairs(KEYS) do
+    local free_attempts = tonumber(ARGV[4 + i])
+    local state = redis.call('HMGET', key, 'failures', 'last')
+    local failures = tonumber(state[1]) or 0
+    local last = tonumber(state[2]) or 0
+    if failures >= free_attempts then
+        wait = math.max(wait, last + math.min(base_delay * 2 ^ (failures - free_attempts), max_delay) - now)
+    end
+end
+if wait > 0 then
+    return tostring(wait)
+end
+for _, key in ipairs(KEYS) do
+    redis.call('HINCRBY', key, 'failures', 1)
+    redis.call('HSET', key, 'last', tostring(now))
+    redis.call('EXPIRE', key, ARGV[4])
+end
+return '0'
+"""
+
+# Gives back an attempt that turned out not to be a failure
+RELEASE_SCRIPT = """
+for _, key in ipairs(KEYS) do
+    if redis.call('HINCRBY', key, 'failures', -1) <= 0 then
+        redis.call('DEL', key)
+    end
+end
+"""
+
+
+class LoginThrottle:
+    """
+    Counts failed logins per account and per client IP and makes the client wait before the next attempt.
+
+    The first free_attempts failures of a key are not delayed, then every failure doubles the wait
+    (base_delay, 2 * base_delay, ...) up to max_delay. A key is forgotten window seconds after its last
+    failure, a successful login resets the counter of the account (not the one of the IP).
+    An attempt is taken with a single atomic Redis call before the database lookup and the bcrypt
+    verification, and counts as a failure until the login succeeds: a burst of concurrent attempts
+    cannot get past the limit by reading the same state. Without Redis (or when it fails) the counters
+    of the process are used.
+    """
+
+    def __init__(self, account_free_attempts: int, ip_free_attempts: int, base_delay: float, max_delay: float,
+                 window: int, redis=None):
+        self.account_free_attempts = account_free_attempts
+        self.ip_free_attempts = ip_free_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.window = window
+        self.redis = redis
+        self.local = TTLCache(maxsize=100000, ttl=window)
+
+    @staticmethod
+    def account_key(email: str) -> str:
+        return f"login_failures:account:{email.lower()}"
+
+    @staticmethod
+    def ip_key(ip: str) -> str:
+        return f"login_failures:ip:{ip}"
+
+    def delay(self, failures: int, free_attempts: int) -> float:
+        if failures < free_attempts:
+            return 0.0
+        return min(self.base_delay * 2 ** (failures - free_attempts), self.max_delay)
+
+    def _acquire_local(self, keys: dict, now: float) -> float:
+        # no await in between, so the check and the update are atomic within the process
+        states = {key: self.local.get(key) or (0, 0.0) for key in keys}
+        wait = max(last + self.delay(failures, keys[key]) - now for key, (failures, last) in states.items())
+        if wait > 0:
+            return wait
+        for key, (failures, _) in states.items():
+            self.local.set(key, (failures + 1, now))
+        return 0.0
+
+    async def acquire(self, email: str, ip: str) -> float:
+        """
+        The acquire function takes a login attempt for the account and the client, it is called before
+            the password is checked. The attempt counts as a failure until success or release is called.
+
+        :param self: Represent the instance of the class
+        :param email: str: The account the client logs in to
+        :param ip: str: The address of the client
+        :return: Seconds to wait, 0 when the attempt is allowed
+        :doc-author: AR
+        """
+        keys = {self.account_key(email): self.account_free_attempts, self.ip_key(ip): self.ip_free_attempts}
+        now = time.time()
+        if self.redis is not None:
+            script = self.redis.register_script(ACQUIRE_SCRIPT)
+            try:
+                wait = await script(keys=list(keys), args=[now, self.base_delay, self.max_delay, self.window,
+                                                           *keys.values()])
+                return max(float(wait), 0.0)
+            except RedisError:
+                pass
+        return self._acquire_local(keys, now)
+
+    async def release(self, email: str, ip: str) -> None:
+        """
+        The release function gives back an attempt that was not a failure (the password was not checked).
+
+        :param self: Represent the instance of the class
+        :param email: str: The account the client tried to log in to
+        :param ip: str: The address of the client
+        :return: Nothing
+        :doc-author: AR
+        """
+        await self._release(self.account_key(email), self.ip_key(ip))
+
+    async def _release(self, *keys: str) -> None:
+        if self.redis is not None:
+            script = self.redis.register_script(RELEASE_SCRIPT)
+            try:
+                await script(keys=list(keys))
+                return
+            except RedisError:
+                pass
+        for key in keys:
+            failures, last = self.local.get(key) or (0, 0.0)
+            if failures > 1:
+                self.local.set(key, (failures - 1, last))
+            else:
+                self.local.delete(key)
+
+    async def success(self, email: str, ip: str) -> None:
+        """
+        The success function resets the failures of the account after a successful login
+            and gives back the attempt of the client.
+
+        :param self: Represent the instance of the class
+        :param email: str: The account the client logged in to
+        :param ip: str: The address of the client
+        :return: Nothing
+        :doc-author: AR
+        """
+        key = self.account_key(email)
+        self.local.delete(key)
+        if self.redis is not None:
+            try:
+                await self.redis.delete(key)
+            except RedisError:
+                pass
+        await self._release(self.ip_key(ip))
+
+
+login_throttle = LoginThrottle(
+    account_free_attempts=settings.LOGIN_ACCOUNT_FREE_ATTEMPTS,
+    ip_free_attempts=settings.LOGIN_IP_FREE_ATTEMPTS,
+    base_delay=settings.LOGIN_BASE_DELAY,
+    max_delay=settings.LOGIN_MAX_DELAY,
+    window=settings.LOGIN_FAILURE_WINDOW,
+)
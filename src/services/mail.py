@@ -1,46 +1,181 @@
-
+import asyncio
+import time
+from dataclasses import dataclass, field
+from email.message import EmailMessage
+from email.utils import formataddr
 from pathlib import Path
-from fastapi_mail import FastMail, MessageSchema, ConnectionConfig, MessageType
-from fastapi_mail.errors import ConnectionErrors
-from pydantic import EmailStr
+from typing import List, Optional
+
+import aiosmtplib
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+
 from src import settings
 from src.services.auth import auth_service
+from src.services.latency import LatencyStats
 
+TEMPLATE_FOLDER = Path(__file__).parent / 'templates'
 
-conf = ConnectionConfig(
-    MAIL_USERNAME=settings.MAIL_USERNAME,
-    MAIL_PASSWORD=settings.MAIL_PASSWORD,
-    MAIL_FROM=settings.MAIL_FROM,
-    MAIL_PORT=settings.MAIL_PORT,
-    MAIL_SERVER=settings.MAIL_SERVER,
-    MAIL_FROM_NAME="Example email",
-    MAIL_STARTTLS=False,
-    MAIL_SSL_TLS=True,
-    USE_CREDENTIALS=True,
-    VALIDATE_CERTS=True,
-    TEMPLATE_FOLDER=Path(__file__).parent / 'templates',
-)
+
+@dataclass
+class BatchReport:
+    size: int
+    seconds: float
+    # one entry per message of the batch, None when the message was accepted by the server
+    errors: List[Optional[str]] = field(default_factory=list)
+
+    @property
+    def failed(self) -> int:
+        return sum(error is not None for error in self.errors)
 
 
-async def send_email(email: EmailStr, username: str, host: str):
+class MailSender:
     """
-    The send_email function sends an email to the user with a link to confirm their email address.
-    :param email: EmailStr: Validate the email address,
-    :param username: str: Pass the username to the email template
-    :param host: str: Pass the host name to the template
-    :return: A coroutine, so we need to use await or yield from
-    :doc-author: AR
+    Sends emails over a pool of persistent SMTP connections.
+
+    At most pool_size connections are open; a connection is reused for the next batch instead of
+    doing a new TCP and TLS handshake per message, and reopened when the server closed it.
+    The latency of every batch is recorded, the mail worker logs status periodically (see worker.py).
     """
-    try:
+
+    def __init__(self, hostname: str, port: int, username: Optional[str] = None, password: Optional[str] = None,
+                 use_tls: bool = False, start_tls: Optional[bool] = None, validate_certs: bool = True,
+                 timeout: float = 30, pool_size: int = 4, batch_size: int = 50):
+        self.smtp_options = dict(hostname=hostname, port=port, username=username, password=password,
+                                 use_tls=use_tls, start_tls=start_tls, validate_certs=validate_certs, timeout=timeout)
+        self.pool_size = pool_size
+        self.batch_size = batch_size
+        self.available = asyncio.Semaphore(pool_size)
+        self.idle: List[aiosmtplib.SMTP] = []
+        # compiled once, not for every message
+        self.template = Environment(loader=FileSystemLoader(TEMPLATE_FOLDER), autoescape=select_autoescape()) \
+            .get_template("email_template.html")
+        self.stats = LatencyStats()
+        self.sent = 0
+        self.failed = 0
+        self.connects = 0
+
+    def build_confirmation_email(self, email: str, username: str, host: str) -> EmailMessage:
+        """
+        The build_confirmation_email function renders the email with the link that confirms the email address.
+
+        :param self: Represent the instance of the class
+        :param email: str: The address of the user
+        :param username: str: Pass the username to the email template
+        :param host: str: Pass the host name to the template
+        :return: The message
+        :doc-author: AR
+        """
         token_verification = auth_service.create_email_token({"sub": email})
-        message = MessageSchema(
-            subject="Confirm your email ",
-            recipients=[email],
-            template_body={"host": host, "username": username, "token": token_verification},
-            subtype=MessageType.html
-        )
-        fm = FastMail(conf)
-        await fm.send_message(message, template_name="email_template.html")
-    except ConnectionErrors as err:
-        print(err)
+        message = EmailMessage()
+        message["From"] = formataddr((settings.MAIL_FROM_NAME, settings.MAIL_FROM))
+        message["To"] = email
+        message["Subject"] = "Confirm your email "
+        message.set_content(self.template.render(host=host, username=username, token=token_verification),
+                            subtype="html")
+        return message
+
+    async def _connect(self) -> aiosmtplib.SMTP:
+        smtp = aiosmtplib.SMTP(**self.smtp_options)
+        await smtp.connect()
+        self.connects += 1
+        return smtp
+
+    async def _send(self, smtp: aiosmtplib.SMTP, message: EmailMessage) -> aiosmtplib.SMTP:
+        try:
+            await smtp.send_message(message)
+        except aiosmtplib.SMTPServerDisconnected:
+            # the server closed the idle connection, send again over a new one
+            smtp.close()
+            smtp = await self._connect()
+            await smtp.send_message(message)
+        return smtp
+
+    async def send_batch(self, messages: List[EmailMessage]) -> BatchReport:
+        """
+        The send_batch function sends the messages one after the other over one pooled connection.
+            A message refused by the server does not stop the batch; when the connection fails
+            the remaining messages fail as well.
+
+        :param self: Represent the instance of the class
+        :param messages: List[EmailMessage]: The messages to send
+        :return: The latency and the error of every message
+        :doc-author: AR
+        """
+        start = time.perf_counter()
+        report = BatchReport(size=len(messages), seconds=0.0)
+        async with self.available:
+            smtp = self.idle.pop() if self.idle else None
+            try:
+                if smtp is None:
+                    smtp = await self._connect()
+                for message in messages:
+                    try:
+                        smtp = await self._send(smtp, message)
+                        report.errors.append(None)
+                    except (aiosmtplib.SMTPResponseException, aiosmtplib.SMTPRecipientsRefused) as err:
+                        report.errors.append(str(err))
+            except (aiosmtplib.SMTPException, OSError) as err:
+                report.errors.extend([str(err)] * (len(messages) - len(report.errors)))
+                if smtp is not None:
+                    smtp.close()
+                    smtp = None
+            if smtp is not None:
+                self.idle.append(smtp)
+        report.seconds = time.perf_counter() - start
+        self.stats.observe(report.seconds)
+        self.sent += report.size - report.failed
+        self.failed += report.failed
+        return report
+
+    async def send(self, messages: List[EmailMessage]) -> List[BatchReport]:
+        """
+        The send function splits the messages into batches of batch_size and sends the batches
+        in parallel, over at most pool_size connections.
+
+        :param self: Represent the instance of the class
+        :param messages: List[EmailMessage]: The messages to send
+        :return: A report for every batch
+        :doc-author: AR
+        """
+        batches = [messages[i:i + self.batch_size] for i in range(0, len(messages), self.batch_size)]
+        return list(await asyncio.gather(*(self.send_batch(batch) for batch in batches)))
+
+    async def close(self) -> None:
+        while self.idle:
+            smtp = self.idle.pop()
+            try:
+                await smtp.quit()
+            except aiosmtplib.SMTPException:
+                smtp.close()
+
+    def status(self) -> dict:
+        """
+        The status function returns the counters of the sender and the latency of the batches.
+
+        :param self: Represent the instance of the class
+        :return: A dict with the sender status
+        :doc-author: AR
+        """
+        return {
+            "pool_size": self.pool_size,
+            "idle_connections": len(self.idle),
+            "connects": self.connects,
+            "sent": self.sent,
+            "failed": self.failed,
+            **self.stats.as_dict("batch_latency", count="batches"),
+        }
+
+
+mail_sender = MailSender(
+    hostname=settings.MAIL_SERVER,
+    port=settings.MAIL_PORT,
+    username=settings.MAIL_USERNAME,
+    password=settings.MAIL_PASSWORD,
+    use_tls=settings.MAIL_SSL_TLS,
+    start_tls=settings.MAIL_STARTTLS,
+    validate_certs=settings.MAIL_VALIDATE_CERTS,
+    timeout=settings.MAIL_TIMEOUT,
+    pool_size=settings.MAIL_POOL_SIZE,
+    batch_size=settings.MAIL_BATCH_SIZE,
+)
 
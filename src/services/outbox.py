@@ -0,0 +1,98 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from src import settings
+from src.repository import outbox as repository_outbox
+from src.services.mail import MailSender
+
+
+class OutboxWorker:
+    """
+    Drains the email outbox (src.repository.outbox), runs in the mail worker process (worker.py).
+
+    Every round claims up to batch_size due emails and sends them with the mail sender, so at most
+    its pool_size SMTP connections are used at the same time. A failed email is retried after
+    base_delay, 2 * base_delay, ... (up to max_delay) and dead-lettered after max_attempts attempts.
+    """
+
+    def __init__(self, session_factory, sender: MailSender, batch_size: int, max_attempts: int, base_delay: float,
+                 max_delay: float, poll_interval: float, lease: float):
+        self.session_factory = session_factory
+        self.sender = sender
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self.lease = lease
+
+    def retry_delay(self, attempts: int) -> float:
+        return min(self.base_delay * 2 ** (attempts - 1), self.max_delay)
+
+    async def run_once(self) -> int:
+        """
+        The run_once function sends one batch of due emails and records the outcome of every email.
+
+        :param self: Represent the instance of the class
+        :return: The number of emails claimed
+        :doc-author: AR
+        """
+        async with self.session_factory() as db:
+            emails = await repository_outbox.claim_emails(self.batch_size, self.lease, self.max_attempts, db)
+            if not emails:
+                return 0
+            messages = [self.sender.build_confirmation_email(email.email, email.username, email.host)
+                        for email in emails]
+            errors = [error for report in await self.sender.send(messages) for error in report.errors]
+            await repository_outbox.mark_sent([email.id for email, error in zip(emails, errors) if error is None], db)
+            for email, error in zip(emails, errors):
+                if error is None:
+                    continue
+                if email.attempts >= self.max_attempts:
+                    print(f"email {email.id} to {email.email} dead-lettered: {error}")
+                    await repository_outbox.mark_dead(email.id, error, db)
+                else:
+                    retry_at = datetime.utcnow() + timedelta(seconds=self.retry_delay(email.attempts))
+                    await repository_outbox.mark_failed(email.id, error, retry_at, db)
+            return len(emails)
+
+    async def run(self) -> None:
+        """
+        The run function drains the outbox until it is cancelled. A full batch is followed by the
+            next one right away, otherwise the outbox is polled every poll_interval seconds.
+
+        :param self: Represent the instance of the class
+        :return: Nothing, runs until cancelled
+        :doc-author: AR
+        """
+        while True:
+            try:
+                claimed = await self.run_once()
+            except (SQLAlchemyError, OSError) as err:
+                print(err)
+                claimed = 0
+            if claimed < self.batch_size:
+                await asyncio.sleep(self.poll_interval)
+
+
+def create_outbox_worker(session_factory, sender: MailSender) -> OutboxWorker:
+    """
+    The create_outbox_worker function creates the outbox worker configured from the OUTBOX_* settings.
+
+    :param session_factory: Create the database sessions
+    :param sender: MailSender: Sends the emails
+    :return: An OutboxWorker
+    :doc-author: AR
+    """
+    return OutboxWorker(
+        session_factory,
+        sender,
+        batch_size=settings.OUTBOX_BATCH_SIZE,
+        max_attempts=settings.OUTBOX_MAX_ATTEMPTS,
+        base_delay=settings.OUTBOX_RETRY_BASE_DELAY,
+        max_delay=settings.OUTBOX_RETRY_MAX_DELAY,
+        poll_interval=settings.OUTBOX_POLL_INTERVAL,
+        lease=settings.OUTBOX_LEASE,
+    )
@@ -0,0 +1,59 @@
+import base64
+import binascii
+import json
+from typing import Any, List, Sequence, Tuple, Type
+
+from fastapi import HTTPException, Response, status
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    """
+    The encode_cursor function builds an opaque pagination cursor from the sort key of the last row
+    of a page (for example its (name, id) pair). The next page starts right after these values.
+
+    :param values: Sequence[Any]: Values of the columns the list is sorted by, the id comes last
+    :return: A url-safe string
+    :doc-author: AR
+    """
+    raw = json.dumps(list(values), separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, types: Sequence[Type]) -> Tuple[Any, ...]:
+    """
+    The decode_cursor function turns a cursor created by encode_cursor back into the sort key values.
+    A cursor that was not produced by encode_cursor for the same sort key is rejected with HTTP 400.
+
+    :param cursor: str: The cursor sent by the client
+    :param types: Sequence[Type]: Expected type of every value of the sort key
+    :return: A tuple with the sort key values
+    :doc-author: AR
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if not isinstance(values, list) or len(values) != len(types):
+            raise ValueError(cursor)
+        if not all(type(value) is type_ for value, type_ in zip(values, types)):
+            raise ValueError(cursor)
+    except (binascii.Error, ValueError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    return tuple(values)
+
+
+def set_next_cursor(response: Response, items: List[Any], limit: int, keys: Sequence[str]) -> None:
+    """
+    The set_next_cursor function adds the cursor of the next page to the response headers.
+    The header is only set when the page is full, so its absence means the client reached the end.
+
+    :param response: Response: The response of the list endpoint
+    :param items: List[Any]: Rows of the current page
+    :param limit: int: The requested page size
+    :param keys: Sequence[str]: Names of the attributes the list is sorted by
+    :return: Nothing
+    :doc-author: AR
+    """
+    if items and len(items) == limit:
+        last = items[-1]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor([getattr(last, key) for key in keys])
@@ -0,0 +1,185 @@
+import asyncio
+import math
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, Optional
+
+from fastapi import HTTPException, Request, status
+from redis.exceptions import RedisError
+
+from src import settings
+from src.services.cache import TTLCache
+
+# Global token bucket of a key: refills it up to capacity, takes the tokens consumed by a process since its
+# last sync and returns what is left (negative when the processes together went over the limit).
+# The time of the Redis server is used so that the clocks of the processes do not matter.
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local consumed = tonumber(ARGV[3])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate) - consumed
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+return tostring(tokens)
+"""
+
+
+@dataclass
+class Bucket:
+    capacity: int
+    rate: float
+    tokens: float
+    updated: float
+    # tokens consumed by this process and not yet reported to Redis
+    pending: int = 0
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+class TokenBuckets:
+    """
+    Token buckets of the rate limits, kept in the memory of the process and reconciled with Redis in batches.
+
+    A request only takes a token from the local bucket, there is no network round trip. Every sync_interval
+    seconds the tokens consumed by the process are reported to Redis for all keys in one pipeline, and
+    the local buckets are set to the global number of tokens left. A process never takes more than
+    local_share of the capacity of a bucket without reporting it: the next request of that key syncs first.
+    So all processes together go over a limit by at most local_share of it per process.
+    Without Redis (or when it fails) every process applies the limits on its own.
+    """
+
+    def __init__(self, sync_interval: float, local_share: float, maxsize: int = 100000, redis=None,
+                 timer: Callable[[], float] = time.monotonic):
+        self.sync_interval = sync_interval
+        self.local_share = local_share
+        self.redis = redis
+        self.timer = timer
+        self.buckets = TTLCache(maxsize=maxsize, ttl=0, timer=timer)
+        self.pending: Dict[str, Bucket] = {}
+        self.syncs = 0
+
+    @staticmethod
+    def key(name: str) -> str:
+        return f"rate_limit:{name}"
+
+    def local_batch(self, bucket: Bucket) -> int:
+        return max(1, int(bucket.capacity * self.local_share))
+
+    async def acquire(self, name: str, capacity: int, rate: float) -> float:
+        """
+        The acquire function takes a token from the bucket of name.
+
+        :param self: Represent the instance of the class
+        :param name: str: Identifies the bucket (route and client)
+        :param capacity: int: Maximum number of tokens, the allowed burst
+        :param rate: float: Tokens added per second
+        :return: 0 when a token was taken, otherwise the seconds until the next token
+        :doc-author: AR
+        """
+        now = self.timer()
+        bucket = self.buckets.get(name)
+        if bucket is None:
+            bucket = Bucket(capacity=capacity, rate=rate, tokens=capacity, updated=now)
+        else:
+            bucket.refill(now)
+        if self.redis is not None and bucket.pending >= self.local_batch(bucket):
+            await self.sync([name])
+            bucket.refill(self.timer())
+        # an unused bucket is full again after capacity / rate seconds, then it can be dropped
+        self.buckets.set(name, bucket, ttl=capacity / rate)
+        if bucket.tokens < 1:
+            return (1 - bucket.tokens) / rate
+        bucket.tokens -= 1
+        if self.redis is not None:
+            bucket.pending += 1
+            self.pending[name] = bucket
+        return 0.0
+
+    async def sync(self, names: Optional[Iterable[str]] = None) -> None:
+        """
+        The sync function reports the tokens consumed since the last sync to Redis, in one round trip,
+            and updates the local buckets with the tokens left globally.
+
+        :param self: Represent the instance of the class
+        :param names: Optional[Iterable[str]]: The buckets to sync, all buckets with consumed tokens by default
+        :return: Nothing
+        :doc-author: AR
+        """
+        names = list(self.pending) if names is None else [name for name in names if name in self.pending]
+        if not names or self.redis is None:
+            return
+        batch = []
+        for name in names:
+            bucket = self.pending.pop(name)
+            batch.append((name, bucket, bucket.pending))
+            bucket.pending = 0
+        script = self.redis.register_script(TOKEN_BUCKET_SCRIPT)
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for name, bucket, consumed in batch:
+                    await script(keys=[self.key(name)],
+                                 args=[bucket.capacity, bucket.rate, consumed, math.ceil(bucket.capacity / bucket.rate)],
+                                 client=pipe)
+                results = await pipe.execute()
+        except RedisError:
+            # the consumed tokens are dropped, the local buckets keep limiting this process
+            return
+        self.syncs += 1
+        now = self.timer()
+        for (name, bucket, _), tokens in zip(batch, results):
+            # tokens taken while the sync was running are still pending
+            bucket.tokens = float(tokens) - bucket.pending
+            bucket.updated = now
+
+    async def run(self) -> None:
+        """
+        The run function syncs the buckets every sync_interval seconds, it runs as a background task
+            for the lifetime of the application (see main.py).
+
+        :param self: Represent the instance of the class
+        :return: Nothing, runs until cancelled
+        :doc-author: AR
+        """
+        while True:
+            await asyncio.sleep(self.sync_interval)
+            await self.sync()
+
+
+rate_limits = TokenBuckets(
+    sync_interval=settings.RATE_LIMIT_SYNC_INTERVAL,
+    local_share=settings.RATE_LIMIT_LOCAL_SHARE,
+)
+
+
+def client_address(request: Request) -> str:
+    forwarded = request.headers.get("X-Forwarded-For")
+    if forwarded:
+        return forwarded.split(",")[0].strip()
+    return request.client.host if request.client else "unknown"
+
+
+class RateLimit:
+    """
+    Dependency that allows times requests per seconds seconds for every client address and route,
+    answers HTTP 429 with Retry-After otherwise.
+    """
+
+    def __init__(self, times: int, seconds: float):
+        self.times = times
+        self.seconds = seconds
+
+    async def __call__(self, request: Request):
+        route = request.scope.get("route")
+        path = route.path if route is not None else request.url.path
+        retry_after = await rate_limits.acquire(f"{request.method}:{path}:{client_address(request)}",
+                                                self.times, self.times / self.seconds)
+        if retry_after:
+            raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail="Too Many Requests",
+                                headers={"Retry-After": str(math.ceil(retry_after))})
@@ -0,0 +1,68 @@
+import time
+
+from redis.asyncio import BlockingConnectionPool
+
+from src import settings
+from src.database.pool import PoolStats
+
+
+class InstrumentedConnectionPool(BlockingConnectionPool):
+    """
+    Redis connection pool with a fixed number of connections that measures how long every command
+    waited for a free connection. When all connections are busy a command waits up to timeout seconds
+    instead of opening a new connection.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    async def get_connection(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            connection = await super().get_connection(*args, **kwargs)
+        except Exception:
+            self.stats.timeouts += 1
+            raise
+        self.stats.observe(time.perf_counter() - start)
+        return connection
+
+
+def create_redis_pool() -> InstrumentedConnectionPool:
+    """
+    The create_redis_pool function creates the connection pool shared by the rate limiter,
+    authentication and the caches, configured from the REDIS_* settings.
+
+    :return: An InstrumentedConnectionPool
+    :doc-author: AR
+    """
+    return InstrumentedConnectionPool(
+        host=settings.REDIS_HOST,
+        port=settings.REDIS_PORT,
+        db=settings.REDIS_DB,
+        password=settings.REDIS_PASSWORD,
+        max_connections=settings.REDIS_POOL_SIZE,
+        timeout=settings.REDIS_POOL_TIMEOUT,
+        socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+        socket_connect_timeout=settings.REDIS_SOCKET_TIMEOUT,
+        encoding="utf-8",
+        decode_responses=True,
+    )
+
+
+def get_redis_pool_status(pool: InstrumentedConnectionPool) -> dict:
+    """
+    The get_redis_pool_status function collects the usage and the counters of the Redis connection pool.
+
+    :param pool: InstrumentedConnectionPool: The pool created by create_redis_pool
+    :return: A dict with the pool size, the connections in use and the wait statistics
+    :doc-author: AR
+    """
+    return {
+        "max_connections": pool.max_connections,
+        "connections": len(pool._available_connections) + len(pool._in_use_connections),
+        "in_use": len(pool._in_use_connections),
+        "timeout": pool.timeout,
+        "timeouts": pool.stats.timeouts,
+        **pool.stats.as_dict("wait_time", count="checkouts"),
+    }
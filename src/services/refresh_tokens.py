@@ -0,0 +1,142 @@
+from datetime import datetime, timedelta
+from typing import Optional, Union
+
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src import settings
+from src.repository import refresh_tokens as repository_refresh_tokens
+
+
+class RefreshTokenStoreUnavailable(Exception):
+    pass
+
+
+class RedisRefreshTokenStore:
+    """
+    Login sessions kept in Redis: the current jti of every session under refresh:{user_id}:{sid}
+    with the lifetime of the refresh token as TTL, and the set of session ids of the user for logout-all.
+
+    When Redis fails, sessions are created in the fallback store (the refresh_tokens table) and sessions
+    that Redis does not know are rotated there. A session that can be found in neither store while Redis
+    fails, or a logout that can not reach Redis, raises RefreshTokenStoreUnavailable (HTTP 503).
+    """
+
+    # compare-and-set of the current jti; any other jti means the token was reused, the session is ended.
+    # -1: no such session in Redis, it may live in the fallback store
+    ROTATE_SCRIPT = """local current = redis.call('GET', KEYS[1])
+if not current then
+    return -1
+end
+if current == ARGV[1] then
+    redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+    redis.call('EXPIRE', KEYS[2], ARGV[3])
+    return 1
+end
+redis.call('DEL', KEYS[1])
+redis.call('SREM', KEYS[2], ARGV[4])
+return 0"""
+
+    def __init__(self, redis: Redis, fallback: Optional["SqlRefreshTokenStore"] = None):
+        self.redis = redis
+        self.fallback = fallback
+
+    @staticmethod
+    def key(user_id: int, session_id: str) -> str:
+        return f"refresh:{user_id}:{session_id}"
+
+    @staticmethod
+    def sessions_key(user_id: int) -> str:
+        return f"refresh_sessions:{user_id}"
+
+    async def create(self, user_id: int, session_id: str, jti: str, ttl: int) -> None:
+        try:
+            async with self.redis.pipeline(transaction=True) as pipe:
+                pipe.set(self.key(user_id, session_id), jti, ex=ttl)
+                pipe.sadd(self.sessions_key(user_id), session_id)
+                pipe.expire(self.sessions_key(user_id), ttl)
+                await pipe.execute()
+        except RedisError as err:
+            if self.fallback is None:
+                raise RefreshTokenStoreUnavailable(str(err))
+            print(err)
+            await self.fallback.create(user_id, session_id, jti, ttl)
+
+    async def rotate(self, user_id: int, session_id: str, jti: str, new_jti: str, ttl: int) -> bool:
+        try:
+            result = int(await self.redis.eval(self.ROTATE_SCRIPT, 2, self.key(user_id, session_id),
+                                               self.sessions_key(user_id), jti, new_jti, ttl, session_id))
+        except RedisError as err:
+            print(err)
+            # the session may live in Redis, it can neither be rotated nor rejected
+            if self.fallback is None or not await self.fallback.rotate(user_id, session_id, jti, new_jti, ttl):
+                raise RefreshTokenStoreUnavailable(str(err))
+            return True
+        if result == -1 and self.fallback is not None:
+            return await self.fallback.rotate(user_id, session_id, jti, new_jti, ttl)
+        return result == 1
+
+    async def revoke(self, user_id: int, session_id: str) -> None:
+        if self.fallback is not None:
+            await self.fallback.revoke(user_id, session_id)
+        try:
+            async with self.redis.pipeline(transaction=True) as pipe:
+                pipe.delete(self.key(user_id, session_id))
+                pipe.srem(self.sessions_key(user_id), session_id)
+                await pipe.execute()
+        except RedisError as err:
+            raise RefreshTokenStoreUnavailable(str(err))
+
+    async def revoke_all(self, user_id: int) -> None:
+        if self.fallback is not None:
+            await self.fallback.revoke_all(user_id)
+        try:
+            session_ids = await self.redis.smembers(self.sessions_key(user_id))
+            keys = [self.key(user_id, session_id) for session_id in session_ids]
+            await self.redis.delete(self.sessions_key(user_id), *keys)
+        except RedisError as err:
+            raise RefreshTokenStoreUnavailable(str(err))
+
+
+class SqlRefreshTokenStore:
+    """
+    Login sessions kept in the refresh_tokens table, used when Redis is not available.
+    """
+
+    def __init__(self, db: AsyncSession):
+        self.db = db
+
+    @staticmethod
+    def expires_at(ttl: int) -> datetime:
+        return datetime.utcnow() + timedelta(seconds=ttl)
+
+    async def create(self, user_id: int, session_id: str, jti: str, ttl: int) -> None:
+        await repository_refresh_tokens.create_refresh_token(user_id, session_id, jti, self.expires_at(ttl), self.db)
+
+    async def rotate(self, user_id: int, session_id: str, jti: str, new_jti: str, ttl: int) -> bool:
+        return await repository_refresh_tokens.rotate_refresh_token(user_id, session_id, jti, new_jti,
+                                                                    self.expires_at(ttl), self.db)
+
+    async def revoke(self, user_id: int, session_id: str) -> None:
+        await repository_refresh_tokens.remove_refresh_token(user_id, session_id, self.db)
+
+    async def revoke_all(self, user_id: int) -> None:
+        await repository_refresh_tokens.remove_user_refresh_tokens(user_id, self.db)
+
+
+def get_refresh_token_store(redis: Optional[Redis], db: AsyncSession) \
+        -> Union[RedisRefreshTokenStore, SqlRefreshTokenStore]:
+    """
+    The get_refresh_token_store function picks where login sessions are kept:
+    Redis unless REFRESH_TOKEN_STORE is sql or the application has no Redis client.
+    The Redis store falls back to the refresh_tokens table while Redis fails.
+
+    :param redis: Optional[Redis]: The shared Redis client (auth_service.r)
+    :param db: AsyncSession: The session of the request
+    :return: A refresh token store
+    :doc-author: AR
+    """
+    if redis is not None and settings.REFRESH_TOKEN_STORE == "redis":
+        return RedisRefreshTokenStore(redis, SqlRefreshTokenStore(db))
+    return SqlRefreshTokenStore(db)
@@ -0,0 +1,137 @@
+import json
+from typing import Any, List, Optional, Type
+from urllib.parse import urlencode
+
+from fastapi import Depends, Request, Response
+from pydantic import BaseModel
+from redis.exceptions import RedisError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from src import settings
+from src.database.db import pin_primary, reads_from_primary
+from src.services.cache import collection_versions
+from src.services.etags import get_conditional_db
+
+
+class ResponseCache:
+    """
+    Pages of the list endpoints (notes, contacts, tags) serialized to JSON and stored in Redis,
+    keyed by resource, user, collection version and query parameters.
+
+    The repository functions that change a collection bump its version (see CollectionVersions), so a
+    change invalidates every cached page of the collection of the user at once: the keys of the old
+    version are no longer read and expire after ttl seconds. Pages are only cached when a redis client
+    is set (RESPONSE_CACHE_ENABLED); when Redis fails the endpoints query the database as before.
+    Only pages read from the primary are cached, and none while the version of the collection is unknown
+    (a change that could not be written to Redis yet), so a cached page is never older than its version.
+    """
+
+    def __init__(self, ttl: float, redis=None):
+        self.ttl = ttl
+        self.redis = redis
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    async def key(self, resource: str, user_id: int, request: Request, db: AsyncSession) -> Optional[str]:
+        """
+        The key function returns the key of the page requested, it is read before the database is queried
+            so that a page is never stored under a version newer than its content.
+
+        :param self: Represent the instance of the class
+        :param resource: str: Name of the collection
+        :param user_id: int: Id of the owner
+        :param request: Request: Get the pagination parameters
+        :param db: AsyncSession: The session the endpoint reads with
+        :return: The key, or None when the page is not cached
+        :doc-author: AR
+        """
+        if self.redis is None or not reads_from_primary(db):
+            return None
+        version = await collection_versions.get(resource, user_id)
+        if version is None:
+            return None
+        params = urlencode(sorted(request.query_params.multi_items()))
+        return f"response:{resource}:{user_id}:{version}:{params}"
+
+    async def get(self, key: Optional[str]) -> Optional[Response]:
+        """
+        The get function returns the cached page as a response, with the headers it was sent with.
+
+        :param self: Represent the instance of the class
+        :param key: Optional[str]: The key returned by key
+        :return: The response, or None on a miss
+        :doc-author: AR
+        """
+        if key is None:
+            return None
+        try:
+            raw = await self.redis.get(key)
+        except RedisError:
+            self.errors += 1
+            raw = None
+        if raw is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        page = json.loads(raw)
+        return Response(content=page["body"], media_type="application/json", headers=page["headers"])
+
+    async def set(self, key: Optional[str], response: Response, rows: List[Any],
+                  schema: Type[BaseModel]) -> Any:
+        """
+        The set function serializes a page with its response model and stores it with the headers set
+            by the endpoint (X-Next-Cursor, ETag).
+
+        :param self: Represent the instance of the class
+        :param key: Optional[str]: The key returned by key
+        :param response: Response: The response of the endpoint, with its headers
+        :param rows: List[Any]: The ORM rows of the page
+        :param schema: Type[BaseModel]: Response model of a row
+        :return: The response to send, the rows themselves when the page is not cached
+        :doc-author: AR
+        """
+        if key is None:
+            return rows
+        body = "[" + ",".join(schema.model_validate(row, from_attributes=True).model_dump_json()
+                              for row in rows) + "]"
+        headers = dict(response.headers)
+        try:
+            await self.redis.set(key, json.dumps({"body": body, "headers": headers}), ex=int(self.ttl))
+        except RedisError:
+            self.errors += 1
+        return Response(content=body, media_type="application/json", headers=headers)
+
+    def status(self) -> dict:
+        """
+        The status function returns the counters of the cache.
+
+        :param self: Represent the instance of the class
+        :return: A dict with the hits, misses, errors and the hit rate
+        :doc-author: AR
+        """
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.redis is not None,
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+
+response_cache = ResponseCache(settings.RESPONSE_CACHE_TTL)
+
+
+async def get_cacheable_db(db: AsyncSession = Depends(get_conditional_db)) -> AsyncSession:
+    """
+    The get_cacheable_db function is the session dependency of the list endpoints: like get_conditional_db,
+        and pinned to the primary while the response cache is enabled, only pages read from the primary are cached.
+
+    :param db: AsyncSession: The session of the request
+    :return: The session
+    :doc-author: AR
+    """
+    if response_cache.redis is not None:
+        pin_primary(db)
+    return db
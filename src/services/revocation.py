@@ -0,0 +1,154 @@
+import asyncio
+import hashlib
+import math
+import time
+
+from redis.exceptions import RedisError
+
+from src import settings
+from src.services.cache import TTLCache
+
+
+class BloomFilter:
+    """
+    Set membership with false positives but no false negatives, capacity items fit with the given error rate.
+    """
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1, h2 = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little")
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, item: str) -> None:
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class RevocationUnavailable(Exception):
+    pass
+
+
+class RevocationList:
+    """
+    Revoked access tokens, by jti.
+
+    Redis holds revoked:{jti} keys that expire together with the token. Every process mirrors them into
+    a Bloom filter: revocations are published on CHANNEL and the filter is rebuilt from Redis when the
+    subscription starts and every rebuild_interval seconds, which also drops the expired tokens.
+    A jti that is not in the filter is not revoked, no network round trip is needed; only possible
+    matches are confirmed with Redis. Without Redis the revoked tokens are kept by the process.
+    """
+
+    CHANNEL = "revoked_tokens"
+
+    def __init__(self, capacity: int, error_rate: float, rebuild_interval: float, redis=None):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.rebuild_interval = rebuild_interval
+        self.redis = redis
+        self.bloom = BloomFilter(capacity, error_rate)
+        self.local = TTLCache(maxsize=capacity, ttl=0)
+
+    @staticmethod
+    def key(jti: str) -> str:
+        return f"revoked:{jti}"
+
+    async def revoke(self, jti: str, exp: float) -> None:
+        """
+        The revoke function revokes the token with the given jti until it expires.
+
+        :param self: Represent the instance of the class
+        :param jti: str: The jti claim of the token
+        :param exp: float: The exp claim of the token (unix time)
+        :return: Nothing, raises RevocationUnavailable when the token is only revoked in this process (Redis failed)
+        :doc-author: AR
+        """
+        ttl = math.ceil(exp - time.time())
+        if ttl <= 0:
+            return
+        self.bloom.add(jti)
+        self.local.set(jti, True, ttl=ttl)
+        if self.redis is not None:
+            try:
+                await self.redis.set(self.key(jti), 1, ex=ttl)
+                await self.redis.publish(self.CHANNEL, jti)
+            except RedisError as err:
+                raise RevocationUnavailable(str(err))
+
+    async def is_revoked(self, jti: str) -> bool:
+        """
+        The is_revoked function checks if the token with the given jti was revoked.
+            When Redis cannot confirm a possible match the token is treated as revoked.
+
+        :param self: Represent the instance of the class
+        :param jti: str: The jti claim of the token
+        :return: True when the token must be rejected
+        :doc-author: AR
+        """
+        if jti not in self.bloom:
+            return False
+        if self.local.get(jti) is not None:
+            return True
+        if self.redis is None:
+            return False
+        try:
+            return bool(await self.redis.exists(self.key(jti)))
+        except RedisError:
+            return True
+
+    async def rebuild(self) -> None:
+        """
+        The rebuild function replaces the Bloom filter with one built from the tokens revoked in Redis.
+
+        :param self: Represent the instance of the class
+        :return: Nothing
+        :doc-author: AR
+        """
+        bloom = BloomFilter(self.capacity, self.error_rate)
+        prefix = len(self.key(""))
+        async for key in self.redis.scan_iter(match=self.key("*"), count=1000):
+            bloom.add(key[prefix:])
+        self.bloom = bloom
+
+    async def listen(self) -> None:
+        """
+        The listen function keeps the Bloom filter of the process in sync with Redis, it runs
+            as a background task for the lifetime of the application (see main.py).
+            After a lost connection the filter is rebuilt, so no revocation is missed.
+
+        :param self: Represent the instance of the class
+        :return: Nothing, runs until cancelled
+        :doc-author: AR
+        """
+        while True:
+            try:
+                async with self.redis.pubsub(ignore_subscribe_messages=True) as pubsub:
+                    # subscribe first: revocations published during the rebuild wait in the subscription
+                    await pubsub.subscribe(self.CHANNEL)
+                    await self.rebuild()
+                    rebuilt = time.monotonic()
+                    while True:
+                        message = await pubsub.get_message(timeout=1.0)
+                        if message is not None:
+                            self.bloom.add(message["data"])
+                        if time.monotonic() - rebuilt >= self.rebuild_interval:
+                            await self.rebuild()
+                            rebuilt = time.monotonic()
+            except (RedisError, OSError) as err:
+                print(err)
+                await asyncio.sleep(1)
+
+
+revocation_list = RevocationList(
+    capacity=settings.REVOCATION_FILTER_CAPACITY,
+    error_rate=settings.REVOCATION_FILTER_ERROR_RATE,
+    rebuild_interval=settings.REVOCATION_REBUILD_INTERVAL,
+)
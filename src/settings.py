@@ -6,25 +6,108 @@ load_dotenv()
 
 APP_HOST = os.getenv("APP_HOST")
 APP_PORT = int(os.getenv("APP_PORT"))
+# the /api/internal endpoints (pool, cache and worker statistics) answer only requests with this token
+# in the X-Internal-Token header, they are disabled when it is not set
+INTERNAL_API_TOKEN = os.getenv("INTERNAL_API_TOKEN")
 
 
 MAIL_USERNAME = os.getenv("MAIL_USERNAME")
 MAIL_PASSWORD = os.getenv("MAIL_PASSWORD")
 MAIL_FROM = os.getenv("MAIL_FROM")
-MAIL_PORT = os.getenv("MAIL_PORT")
+MAIL_PORT = int(os.getenv("MAIL_PORT"))
 MAIL_SERVER = os.getenv("MAIL_SERVER")
+MAIL_FROM_NAME = os.getenv("MAIL_FROM_NAME", "Example email")
+MAIL_SSL_TLS = os.getenv("MAIL_SSL_TLS", "true").lower() in ("1", "true", "yes")
+MAIL_STARTTLS = os.getenv("MAIL_STARTTLS", "false").lower() in ("1", "true", "yes")
+MAIL_VALIDATE_CERTS = os.getenv("MAIL_VALIDATE_CERTS", "true").lower() in ("1", "true", "yes")
+MAIL_TIMEOUT = float(os.getenv("MAIL_TIMEOUT", 30))
+# persistent SMTP connections, and how many confirmation emails are sent over one connection
+MAIL_POOL_SIZE = int(os.getenv("MAIL_POOL_SIZE", 4))
+MAIL_BATCH_SIZE = int(os.getenv("MAIL_BATCH_SIZE", 50))
+# seconds between two status lines of the mail worker (batch latency, failures)
+MAIL_STATUS_INTERVAL = float(os.getenv("MAIL_STATUS_INTERVAL", 60))
+# the email outbox drained by worker.py
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", 200))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", 8))
+OUTBOX_RETRY_BASE_DELAY = float(os.getenv("OUTBOX_RETRY_BASE_DELAY", 30))
+OUTBOX_RETRY_MAX_DELAY = float(os.getenv("OUTBOX_RETRY_MAX_DELAY", 3600))
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", 1))
+OUTBOX_LEASE = float(os.getenv("OUTBOX_LEASE", 300))
 
 
 DATABASE_URL = os.getenv("DATABASE_URL")
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL")
+DATABASE_REPLICA_URLS = [url for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url]
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+
+CONTACTS_BULK_MAX_SIZE = int(os.getenv("CONTACTS_BULK_MAX_SIZE", 1000))
+CONTACTS_IMPORT_CHUNK_SIZE = int(os.getenv("CONTACTS_IMPORT_CHUNK_SIZE", 500))
+# threads that parse the imported files, and how long the status of an import is kept
+CONTACTS_IMPORT_WORKERS = int(os.getenv("CONTACTS_IMPORT_WORKERS", 2))
+CONTACTS_IMPORT_JOB_TTL = float(os.getenv("CONTACTS_IMPORT_JOB_TTL", 86400))
+CONTACTS_IMPORT_JOBS_SIZE = int(os.getenv("CONTACTS_IMPORT_JOBS_SIZE", 1000))
 
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = os.getenv("ALGORITHM")
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", min(4, os.cpu_count() or 1)))
+# failed logins before the back-off starts, per account and per client IP
+LOGIN_ACCOUNT_FREE_ATTEMPTS = int(os.getenv("LOGIN_ACCOUNT_FREE_ATTEMPTS", 5))
+LOGIN_IP_FREE_ATTEMPTS = int(os.getenv("LOGIN_IP_FREE_ATTEMPTS", 20))
+LOGIN_BASE_DELAY = float(os.getenv("LOGIN_BASE_DELAY", 1))
+LOGIN_MAX_DELAY = float(os.getenv("LOGIN_MAX_DELAY", 900))
+LOGIN_FAILURE_WINDOW = int(os.getenv("LOGIN_FAILURE_WINDOW", 3600))
 
 
-REDIS_HOST = 'localhost'
+REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
 REDIS_PORT = int(os.getenv("REDIS_PORT"))
+REDIS_DB = int(os.getenv("REDIS_DB", 0))
+REDIS_PASSWORD = os.getenv("REDIS_PASSWORD")
+REDIS_POOL_SIZE = int(os.getenv("REDIS_POOL_SIZE", 50))
+REDIS_POOL_TIMEOUT = float(os.getenv("REDIS_POOL_TIMEOUT", 5))
+REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", 2))
+
+# rate limits are applied in process and reconciled with Redis every RATE_LIMIT_SYNC_INTERVAL seconds,
+# a process spends at most RATE_LIMIT_LOCAL_SHARE of a limit before it syncs
+RATE_LIMIT_SYNC_INTERVAL = float(os.getenv("RATE_LIMIT_SYNC_INTERVAL", 1))
+RATE_LIMIT_LOCAL_SHARE = float(os.getenv("RATE_LIMIT_LOCAL_SHARE", 0.1))
+
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", 10000))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", 60))
+USER_CACHE_REDIS = os.getenv("USER_CACHE_REDIS", "false").lower() in ("1", "true", "yes")
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", 10000))
+# access tokens carry the profile of the user, identity-only endpoints do not load it from the database
+SELF_CONTAINED_TOKENS = os.getenv("SELF_CONTAINED_TOKENS", "false").lower() in ("1", "true", "yes")
+USER_VERSION_CACHE_TTL = float(os.getenv("USER_VERSION_CACHE_TTL", 5))
+# versions of the notes, contacts and tags of a user (ETags), changes made by other workers are seen after this
+COLLECTION_VERSION_CACHE_TTL = float(os.getenv("COLLECTION_VERSION_CACHE_TTL", 1))
+# a change that could not be written to Redis is seen by the other workers at the latest after this,
+# every collection also gets a new version (and new ETags) this often
+COLLECTION_VERSION_TTL = float(os.getenv("COLLECTION_VERSION_TTL", 30))
+# pages of the notes, contacts and tags lists cached in Redis, dropped when the collection changes
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", 300))
+# Bloom filter that mirrors the revoked access tokens in every process
+REVOCATION_FILTER_CAPACITY = int(os.getenv("REVOCATION_FILTER_CAPACITY", 100000))
+REVOCATION_FILTER_ERROR_RATE = float(os.getenv("REVOCATION_FILTER_ERROR_RATE", 0.001))
+REVOCATION_REBUILD_INTERVAL = float(os.getenv("REVOCATION_REBUILD_INTERVAL", 600))
+# where login sessions (refresh tokens) are kept: redis, or sql (the refresh_tokens table)
+REFRESH_TOKEN_STORE = os.getenv("REFRESH_TOKEN_STORE", "redis")
 
 
 CLOUD_NAME = os.getenv("CLOUD_NAME")
 API_KEY = int(os.getenv("API_KEY"))
 API_SECRET = os.getenv("API_SECRET")
+CLOUDINARY_API_URL = os.getenv("CLOUDINARY_API_URL", "https://api.cloudinary.com")
+AVATAR_MAX_SIZE = int(os.getenv("AVATAR_MAX_SIZE", 5 * 1024 * 1024))
+AVATAR_UPLOAD_TIMEOUT = float(os.getenv("AVATAR_UPLOAD_TIMEOUT", 30))
+AVATAR_UPLOAD_CONNECTIONS = int(os.getenv("AVATAR_UPLOAD_CONNECTIONS", 10))
+# avatars are resized locally to every size (WIDTHxHEIGHT), the first one is the avatar of the user
+AVATAR_SIZES = [tuple(int(side) for side in size.split("x"))
+                for size in os.getenv("AVATAR_SIZES", "250x250").split(",") if size]
+AVATAR_WORKERS = int(os.getenv("AVATAR_WORKERS", min(4, os.cpu_count() or 1)))
+# width * height of the largest image that is decoded, a small file can expand to gigabytes of pixels
+AVATAR_MAX_PIXELS = int(os.getenv("AVATAR_MAX_PIXELS", 40_000_000))
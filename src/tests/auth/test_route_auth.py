@@ -1,11 +1,14 @@
-from unittest.mock import MagicMock
+from unittest.mock import AsyncMock, MagicMock, patch
 
-from src.database.models import User
+from redis.exceptions import ConnectionError
 
+from src.database.models import OutboxEmail, User
+from src.services.auth import auth_service
+from src.services.login_throttle import LoginThrottle
+from src.services.revocation import revocation_list
 
-def test_create_user(client, user, monkeypatch):
-    mock_send_email = MagicMock()
-    monkeypatch.setattr("src.routes.auth.send_email", mock_send_email)
+
+def test_create_user(client, session, user):
     response = client.post(
         "/api/auth/signup",
         json=user,
@@ -14,6 +17,16 @@ def test_create_user(client, user, monkeypatch):
     data = response.json()
     assert data["user"]["email"] == user.get("email")
     assert "id" in data["user"]
+    # the confirmation email waits in the outbox for the mail worker
+    outbox_email = session.query(OutboxEmail).filter(OutboxEmail.email == user.get("email")).one()
+    assert outbox_email.status == "pending"
+    assert outbox_email.host == "http://testserver/"
+
+
+def test_request_email(client, session, user):
+    response = client.post("/api/auth/request_email", json={"email": user.get("email")})
+    assert response.status_code == 200, response.text
+    assert session.query(OutboxEmail).filter(OutboxEmail.email == user.get("email")).count() == 2
 
 
 def test_repeat_create_user(client, user):
@@ -67,3 +80,120 @@ def test_login_wrong_email(client, user):
     assert response.status_code == 401, response.text
     data = response.json()
     assert data["detail"] == "Invalid email"
+
+
+def login(client, user):
+    response = client.post(
+        "/api/auth/login",
+        data={"username": user.get('email'), "password": user.get('password')},
+    )
+    assert response.status_code == 200, response.text
+    return response.json()
+
+
+def refresh(client, refresh_token):
+    return client.get("/api/auth/refresh_token", headers={"Authorization": f"Bearer {refresh_token}"})
+
+
+def test_refresh_token_rotation(client, user):
+    tokens = login(client, user)
+    response = refresh(client, tokens["refresh_token"])
+    assert response.status_code == 200, response.text
+    rotated = response.json()
+    assert rotated["refresh_token"] != tokens["refresh_token"]
+
+    response = refresh(client, rotated["refresh_token"])
+    assert response.status_code == 200, response.text
+
+
+def test_refresh_token_reuse(client, user):
+    tokens = login(client, user)
+    rotated = refresh(client, tokens["refresh_token"]).json()
+
+    # the old token was already used: the whole session ends, including the rotated token
+    response = refresh(client, tokens["refresh_token"])
+    assert response.status_code == 401, response.text
+    assert response.json()["detail"] == "Invalid refresh token"
+    response = refresh(client, rotated["refresh_token"])
+    assert response.status_code == 401, response.text
+
+
+def test_refresh_token_wrong_scope(client, user):
+    tokens = login(client, user)
+    response = refresh(client, tokens["access_token"])
+    assert response.status_code == 401, response.text
+    assert response.json()["detail"] == "Invalid scope for token"
+
+
+def test_logout_all(client, user):
+    first, second = login(client, user), login(client, user)
+    # sessions are independent
+    assert refresh(client, first["refresh_token"]).status_code == 200
+
+    response = client.post("/api/auth/logout_all", headers={"Authorization": f"Bearer {second['access_token']}"})
+    assert response.status_code == 204, response.text
+    assert refresh(client, second["refresh_token"]).status_code == 401
+
+
+def test_sessions_redis_down(client, user, monkeypatch):
+    redis = AsyncMock()
+    redis.pipeline = MagicMock(side_effect=ConnectionError())
+    redis.eval.side_effect = ConnectionError()
+    redis.smembers.side_effect = ConnectionError()
+    monkeypatch.setattr(auth_service, "r", redis)
+    # the session is stored in the database and rotated there
+    tokens = login(client, user)
+    response = refresh(client, tokens["refresh_token"])
+    assert response.status_code == 200, response.text
+
+    # a session the database does not know may live in Redis, it can not be checked
+    response = refresh(client, tokens["refresh_token"])
+    assert response.status_code == 503, response.text
+    assert response.headers["Retry-After"] == "1"
+
+    response = client.post("/api/auth/logout_all", headers={"Authorization": f"Bearer {tokens['access_token']}"})
+    assert response.status_code == 503, response.text
+
+
+def test_login_throttled(client, user, monkeypatch):
+    throttle = LoginThrottle(account_free_attempts=1, ip_free_attempts=100, base_delay=30, max_delay=60, window=60)
+    monkeypatch.setattr("src.routes.auth.login_throttle", throttle)
+    response = client.post("/api/auth/login", data={"username": user.get('email'), "password": 'password'})
+    assert response.status_code == 401, response.text
+
+    with patch("src.services.auth.auth_service.verify_password") as verify_mock:
+        response = client.post("/api/auth/login",
+                               data={"username": user.get('email'), "password": user.get('password')})
+        verify_mock.assert_not_called()
+    assert response.status_code == 429, response.text
+    assert response.headers["Retry-After"] == "30"
+
+
+def test_logout(client, user):
+    tokens = login(client, user)
+    headers = {"Authorization": f"Bearer {tokens['access_token']}"}
+    assert client.get("/api/users/me/", headers=headers).status_code == 200
+
+    response = client.post("/api/auth/logout", headers=headers)
+    assert response.status_code == 204, response.text
+    assert client.get("/api/users/me/", headers=headers).status_code == 401
+    assert refresh(client, tokens["refresh_token"]).status_code == 401
+    # other sessions are not affected
+    assert client.get("/api/users/me/", headers={"Authorization": f"Bearer {login(client, user)['access_token']}"})\
+        .status_code == 200
+
+
+def test_logout_redis_down(client, user, monkeypatch):
+    tokens = login(client, user)
+    headers = {"Authorization": f"Bearer {tokens['access_token']}"}
+    redis = AsyncMock()
+    redis.set.side_effect = ConnectionError()
+    monkeypatch.setattr(revocation_list, "redis", redis)
+
+    # the other workers were not told, the client is asked to retry
+    response = client.post("/api/auth/logout", headers=headers)
+    assert response.status_code == 503, response.text
+    assert response.headers["Retry-After"] == "1"
+    # revoked in this process and the session is ended anyway
+    assert client.get("/api/users/me/", headers=headers).status_code == 401
+    assert refresh(client, tokens["refresh_token"]).status_code == 401
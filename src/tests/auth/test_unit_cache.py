@@ -0,0 +1,310 @@
+import asyncio
+import time
+import unittest
+from datetime import datetime
+from unittest.mock import AsyncMock, patch
+
+from jose import jwt
+from redis.exceptions import ConnectionError
+
+from src.database.models import User
+from src.services.auth import auth_service
+from src.services.cache import CollectionVersions, TTLCache, TokenCache, UserCache, UserVersions, token_cache
+from src.services.etags import etag_matches
+
+
+class FakeTimer:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestTTLCache(unittest.TestCase):
+    def setUp(self) -> None:
+        self.timer = FakeTimer()
+        self.cache = TTLCache(maxsize=2, ttl=10, timer=self.timer)
+
+    def test_expires(self):
+        self.cache.set("a", 1)
+        self.timer.now = 9.9
+        self.assertEqual(self.cache.get("a"), 1)
+        self.timer.now = 10
+        self.assertIsNone(self.cache.get("a"))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_evicts_least_recently_used(self):
+        self.cache.set("a", 1)
+        self.cache.set("b", 2)
+        self.cache.get("a")
+        self.cache.set("c", 3)
+        self.assertIsNone(self.cache.get("b"))
+        self.assertEqual(self.cache.get("a"), 1)
+        self.assertEqual(self.cache.get("c"), 3)
+
+    def test_delete(self):
+        self.cache.set("a", 1)
+        self.cache.delete("a")
+        self.cache.delete("missing")
+        self.assertIsNone(self.cache.get("a"))
+
+
+class TestUserCache(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.user = User(id=1, username="deadpool", email="deadpool@example.com", password="hash",
+                         created_at=datetime(2023, 1, 1), avatar=None, confirmed=True)
+
+    async def test_local(self):
+        cache = UserCache(maxsize=10, ttl=60)
+        self.assertIsNone(await cache.get(self.user.email))
+        await cache.set(self.user)
+        user = await cache.get(self.user.email)
+        self.assertIsNot(user, self.user)
+        self.assertEqual((user.id, user.username, user.confirmed), (1, "deadpool", True))
+        self.assertIsNone(user.password)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+        await cache.invalidate(self.user.email)
+        self.assertIsNone(await cache.get(self.user.email))
+
+    async def test_redis(self):
+        store = {}
+        redis = AsyncMock()
+        redis.get.side_effect = lambda key: store.get(key)
+        redis.set.side_effect = lambda key, value, ex: store.__setitem__(key, value)
+        redis.delete.side_effect = lambda key: store.pop(key, None)
+        await UserCache(maxsize=10, ttl=60, redis=redis).set(self.user)
+
+        # another worker finds the user in Redis
+        cache = UserCache(maxsize=10, ttl=60, redis=redis)
+        user = await cache.get(self.user.email)
+        self.assertEqual((user.id, user.created_at), (1, datetime(2023, 1, 1)))
+
+        await cache.invalidate(self.user.email)
+        self.assertEqual(store, {})
+
+    async def test_redis_down(self):
+        redis = AsyncMock()
+        redis.get.side_effect = ConnectionError()
+        redis.set.side_effect = ConnectionError()
+        cache = UserCache(maxsize=10, ttl=60, redis=redis)
+        self.assertIsNone(await cache.get(self.user.email))
+        await cache.set(self.user)
+        self.assertEqual((await cache.get(self.user.email)).id, 1)
+
+    async def test_broadcast(self):
+        bus = FakeBroadcast()
+        worker1 = UserCache(maxsize=10, ttl=60, broadcast=bus)
+        worker2 = UserCache(maxsize=10, ttl=60, broadcast=bus)
+        # not subscribed yet, the LRU may miss invalidations
+        await worker2.set(self.user)
+        self.assertIsNone(await worker2.get(self.user.email))
+
+        listeners = [asyncio.create_task(worker1.listen()), asyncio.create_task(worker2.listen())]
+        while not (worker1.subscribed and worker2.subscribed):
+            await asyncio.sleep(0)
+        await worker2.set(self.user)
+        self.assertEqual((await worker2.get(self.user.email)).id, 1)
+
+        await worker1.invalidate(self.user.email)
+        await asyncio.sleep(0.01)
+        self.assertIsNone(await worker2.get(self.user.email))
+
+        # a user loaded before the invalidation arrived is not stored
+        generation = worker2.generation
+        await worker1.invalidate(self.user.email)
+        await asyncio.sleep(0.01)
+        await worker2.set(self.user, generation)
+        self.assertIsNone(await worker2.get(self.user.email))
+
+        for listener in listeners:
+            listener.cancel()
+        await asyncio.gather(*listeners, return_exceptions=True)
+        self.assertFalse(worker2.subscribed)
+
+
+class FakeBroadcast:
+    def __init__(self):
+        self.queues = []
+
+    async def publish(self, channel, message):
+        for queue in self.queues:
+            queue.put_nowait({"channel": channel, "data": message})
+        return len(self.queues)
+
+    def pubsub(self, **kwargs):
+        return FakePubSub(self)
+
+
+class FakePubSub:
+    def __init__(self, bus):
+        self.bus = bus
+        self.queue = asyncio.Queue()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self.bus.queues.remove(self.queue)
+
+    async def subscribe(self, channel):
+        self.bus.queues.append(self.queue)
+
+    async def get_message(self, timeout):
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class TestTokenCache(unittest.IsolatedAsyncioTestCase):
+
+    def test_expires_with_token(self):
+        cache = TokenCache(maxsize=10)
+        cache.set("valid", {"sub": "a", "exp": time.time() + 60})
+        cache.set("expired", {"sub": "b", "exp": time.time() - 1})
+        self.assertEqual(cache.get("valid")["sub"], "a")
+        self.assertIsNone(cache.get("expired"))
+        cache.discard("valid")
+        self.assertIsNone(cache.get("valid"))
+
+    def test_keyed_by_digest(self):
+        cache = TokenCache(maxsize=10)
+        cache.set("token", {"exp": time.time() + 60})
+        self.assertEqual(list(cache.local.data), [TokenCache.digest("token")])
+
+    async def test_decode_access_token_verifies_once(self):
+        token = await auth_service.create_access_token(data={"sub": "deadpool@example.com"})
+        token_cache.discard(token)
+        with patch("src.services.auth.jwt.decode", wraps=jwt.decode) as decode_mock:
+            first = auth_service.decode_access_token(token)
+            second = auth_service.decode_access_token(token)
+        self.assertEqual(first, second)
+        self.assertEqual(first["sub"], "deadpool@example.com")
+        decode_mock.assert_called_once()
+
+
+class TestUserVersions(unittest.IsolatedAsyncioTestCase):
+
+    async def test_local(self):
+        versions = UserVersions(maxsize=10, ttl=5)
+        self.assertEqual(await versions.get(1), 0)
+        await versions.bump(1)
+        self.assertEqual(await versions.get(1), 1)
+        self.assertEqual(await versions.get(2), 0)
+
+    async def test_redis(self):
+        store = {}
+        redis = AsyncMock()
+        redis.get.side_effect = lambda key: store.get(key)
+        redis.incr.side_effect = lambda key: store.__setitem__(key, str(int(store.get(key, 0)) + 1))
+        versions, other = UserVersions(maxsize=10, ttl=5, redis=redis), UserVersions(maxsize=10, ttl=5, redis=redis)
+        self.assertEqual(await other.get(1), 0)
+        await versions.bump(1)
+        self.assertEqual(await versions.get(1), 1)
+        # the other process still uses the value it read until it expires
+        self.assertEqual(await other.get(1), 0)
+        other.local.clear()
+        self.assertEqual(await other.get(1), 1)
+
+    async def test_redis_down(self):
+        redis = AsyncMock()
+        redis.get.side_effect = ConnectionError()
+        self.assertIsNone(await UserVersions(maxsize=10, ttl=5, redis=redis).get(1))
+
+
+class FakeVersionsRedis:
+    # SET with NX and GET like Redis 7, fails while down is set
+
+    def __init__(self):
+        self.store = {}
+        self.expires = {}
+        self.down = False
+
+    async def set(self, key, value, ex=None, nx=False, get=False):
+        if self.down:
+            raise ConnectionError()
+        old = self.store.get(key)
+        if not (nx and old is not None):
+            self.store[key] = value
+            self.expires[key] = ex
+        return old if get else True
+
+
+class TestCollectionVersions(unittest.IsolatedAsyncioTestCase):
+
+    def versions(self, redis=None):
+        return CollectionVersions(maxsize=10, ttl=30, local_ttl=1, redis=redis)
+
+    async def test_local(self):
+        versions = self.versions()
+        etag = await versions.etag("notes", 1)
+        self.assertEqual(await versions.etag("notes", 1), etag)
+        await versions.bump("notes", 1)
+        self.assertNotEqual(await versions.etag("notes", 1), etag)
+        # a tag of another process never matches
+        self.assertNotEqual(await self.versions().etag("tags", 1), await versions.etag("tags", 1))
+
+    async def test_redis(self):
+        redis = FakeVersionsRedis()
+        versions, other = self.versions(redis), self.versions(redis)
+        etag = await versions.etag("notes", 1)
+        self.assertEqual(await other.etag("notes", 1), etag)
+        await versions.bump("notes", 1)
+        self.assertNotEqual(await versions.etag("notes", 1), etag)
+        # the other process still uses the version it read until it expires
+        self.assertEqual(await other.etag("notes", 1), etag)
+        other.local.clear()
+        self.assertEqual(await other.etag("notes", 1), await versions.etag("notes", 1))
+
+    async def test_redis_down(self):
+        redis = FakeVersionsRedis()
+        redis.down = True
+        self.assertIsNone(await self.versions(redis).etag("notes", 1))
+
+    async def test_failed_bump(self):
+        redis = FakeVersionsRedis()
+        versions, other = self.versions(redis), self.versions(redis)
+        etag = await versions.etag("notes", 1)
+        redis.down = True
+        await versions.bump("notes", 1)
+        # no tag is given out before the change is in Redis, it is retried on the next call
+        self.assertIsNone(await versions.etag("notes", 1))
+        redis.down = False
+        self.assertNotEqual(await versions.etag("notes", 1), etag)
+        self.assertFalse(versions.failed)
+        other.local.clear()
+        self.assertEqual(await other.etag("notes", 1), await versions.etag("notes", 1))
+
+    async def test_failed_bump_expires(self):
+        redis = FakeVersionsRedis()
+        versions, other = self.versions(redis), self.versions(redis)
+        etag = await other.etag("notes", 1)
+        redis.down = True
+        await versions.bump("notes", 1)
+        redis.down = False
+        # the change never reached Redis, the other process serves the old version until the key expires
+        key = versions.key("notes", 1)
+        self.assertEqual(redis.expires[key], 30)
+        del redis.store[key]
+        other.local.clear()
+        self.assertNotEqual(await other.etag("notes", 1), etag)
+
+    async def test_etag_of_representation(self):
+        versions = self.versions()
+        etag = await versions.etag("notes", 1, "/api/notes?")
+        self.assertEqual(await versions.etag("notes", 1, "/api/notes?"), etag)
+        self.assertNotEqual(await versions.etag("notes", 1, "/api/notes/1?"), etag)
+
+    def test_etag_matches(self):
+        etag = 'W/"notes-1-3"'
+        self.assertTrue(etag_matches(etag, 'W/"notes-1-3"'))
+        self.assertTrue(etag_matches(etag, '"other", "notes-1-3"'))
+        self.assertTrue(etag_matches(etag, "*"))
+        self.assertFalse(etag_matches(etag, 'W/"notes-1-2"'))
+        self.assertFalse(etag_matches(etag, None))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+import asyncio
+import threading
+import time
+import unittest
+
+from src.services.auth import auth_service
+from src.services.executor import BoundedExecutor
+
+
+class TestBoundedExecutor(unittest.IsolatedAsyncioTestCase):
+
+    async def test_concurrency_cap_and_queue_time(self):
+        executor = BoundedExecutor(max_workers=1, name="test")
+        threads = set()
+
+        def work():
+            threads.add(threading.current_thread().name)
+            time.sleep(0.05)
+            return threading.current_thread() is threading.main_thread()
+
+        results = await asyncio.gather(executor.run(work), executor.run(work))
+        self.assertEqual(results, [False, False])
+        self.assertEqual(len(threads), 1)
+
+        status = executor.status()
+        self.assertEqual((status["max_workers"], status["in_flight"], status["calls"]), (1, 0, 2))
+        # the second call waited for the first one
+        self.assertGreaterEqual(status["queue_time_max_ms"], 40)
+        self.assertEqual(sum(status["queue_time_histogram"].values()), 2)
+
+    async def test_loop_not_blocked(self):
+        executor = BoundedExecutor(max_workers=1, name="test")
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.005)
+
+        task = asyncio.create_task(ticker())
+        await executor.run(time.sleep, 0.1)
+        task.cancel()
+        self.assertGreater(ticks, 5)
+
+    async def test_exception_is_raised(self):
+        executor = BoundedExecutor(max_workers=1, name="test")
+        with self.assertRaises(ZeroDivisionError):
+            await executor.run(lambda: 1 / 0)
+        self.assertEqual(executor.status()["in_flight"], 0)
+
+    async def test_password_hash_async(self):
+        hashed = await auth_service.get_password_hash_async("secret")
+        self.assertTrue(await auth_service.verify_password_async("secret", hashed))
+        self.assertFalse(await auth_service.verify_password_async("wrong", hashed))
+
+
+if __name__ == "__main__":
+    unittest.main()
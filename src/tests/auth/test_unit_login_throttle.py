@@ -0,0 +1,57 @@
+import asyncio
+import unittest
+from unittest.mock import patch
+
+from src.services.login_throttle import LoginThrottle
+
+
+class TestLoginThrottle(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.throttle = LoginThrottle(account_free_attempts=2, ip_free_attempts=4, base_delay=1, max_delay=8,
+                                      window=3600)
+        self.now = 1000.0
+        patcher = patch("src.services.login_throttle.time.time", lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def attempt(self, email="deadpool@example.com", ip="10.0.0.1"):
+        # a client that waits as long as it is told to
+        wait = await self.throttle.acquire(email, ip)
+        if wait:
+            self.now += wait
+            self.assertEqual(await self.throttle.acquire(email, ip), 0)
+        return wait
+
+    async def test_exponential_backoff(self):
+        delays = [await self.attempt(ip=f"10.0.0.{number}") for number in range(7)]
+        self.assertEqual(delays, [0, 0, 1, 2, 4, 8, 8])
+
+    async def test_per_ip(self):
+        for number in range(4):
+            await self.throttle.acquire(f"user{number}@example.com", "10.0.0.1")
+        self.assertEqual(await self.throttle.acquire("other@example.com", "10.0.0.1"), 1)
+        self.assertEqual(await self.throttle.acquire("other@example.com", "10.0.0.2"), 0)
+
+    async def test_concurrent_attempts(self):
+        # all attempts of a burst are taken before any password is checked
+        waits = await asyncio.gather(*[self.throttle.acquire("deadpool@example.com", "10.0.0.1")
+                                       for _ in range(10)])
+        self.assertEqual(waits.count(0), 2)
+
+    async def test_success_resets_account(self):
+        for _ in range(3):
+            await self.attempt()
+        self.assertGreater(await self.throttle.acquire("deadpool@example.com", "10.0.0.2"), 0)
+        await self.throttle.success("Deadpool@example.com", "10.0.0.1")
+        self.assertEqual(await self.throttle.acquire("deadpool@example.com", "10.0.0.2"), 0)
+
+    async def test_release(self):
+        for _ in range(2):
+            await self.throttle.acquire("deadpool@example.com", "10.0.0.1")
+        await self.throttle.release("deadpool@example.com", "10.0.0.1")
+        self.assertEqual(await self.throttle.acquire("deadpool@example.com", "10.0.0.1"), 0)
+        self.assertGreater(await self.throttle.acquire("deadpool@example.com", "10.0.0.1"), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,128 @@
+import asyncio
+import socket
+import unittest
+from unittest.mock import patch
+from email.message import EmailMessage
+
+from aiosmtpd.controller import Controller
+
+from src.services.mail import MailSender
+from worker import log_status
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class CollectingHandler:
+    """Stand-in for the SMTP server: accepts every message and remembers the connection it came over."""
+
+    def __init__(self):
+        self.messages = []
+        self.sessions = set()
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address.startswith("refused"):
+            return "550 mailbox unavailable"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append(envelope.content.decode())
+        self.sessions.add(id(session))
+        return "250 OK"
+
+
+def message(to: str) -> EmailMessage:
+    msg = EmailMessage()
+    msg["From"] = "app@example.com"
+    msg["To"] = to
+    msg["Subject"] = "test"
+    msg.set_content("hello")
+    return msg
+
+
+class TestMailSender(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.handler = CollectingHandler()
+        self.port = free_port()
+        self.controller = Controller(self.handler, hostname="127.0.0.1", port=self.port)
+        self.controller.start()
+
+    def tearDown(self):
+        self.controller.stop()
+
+    def sender(self, **kwargs):
+        options = dict(hostname="127.0.0.1", port=self.port, start_tls=False, pool_size=2, batch_size=10)
+        options.update(kwargs)
+        return MailSender(**options)
+
+    async def test_send_batches(self):
+        sender = self.sender()
+        reports = await sender.send([message(f"user{i}@example.com") for i in range(25)])
+        await sender.close()
+
+        self.assertEqual([report.size for report in reports], [10, 10, 5])
+        self.assertTrue(all(report.failed == 0 for report in reports))
+        self.assertEqual(len(self.handler.messages), 25)
+        # three batches over at most two connections
+        self.assertLessEqual(sender.connects, 2)
+        self.assertEqual(sender.status()["sent"], 25)
+        self.assertEqual(sender.status()["batches"], 3)
+        self.assertEqual(sum(sender.status()["batch_latency_histogram"].values()), 3)
+
+    async def test_connection_reused(self):
+        sender = self.sender()
+        for i in range(5):
+            await sender.send_batch([message(f"user{i}@example.com")])
+        await sender.close()
+
+        self.assertEqual(sender.connects, 1)
+        self.assertEqual(len(self.handler.sessions), 1)
+
+    async def test_refused_recipient_does_not_stop_batch(self):
+        sender = self.sender()
+        report = await sender.send_batch([message("a@example.com"), message("refused@example.com"),
+                                          message("b@example.com")])
+        await sender.close()
+
+        self.assertEqual(report.failed, 1)
+        self.assertIsNone(report.errors[0])
+        self.assertIsNotNone(report.errors[1])
+        self.assertEqual(len(self.handler.messages), 2)
+
+    async def test_confirmation_email(self):
+        sender = self.sender()
+        msg = sender.build_confirmation_email("user@example.com", "user", "http://testserver/")
+        report = await sender.send_batch([msg])
+        await sender.close()
+
+        self.assertEqual(report.failed, 0)
+
+        self.assertEqual(msg["To"], "user@example.com")
+        self.assertIn("http://testserver/api/auth/confirmed_email/", msg.get_content())
+        self.assertEqual(len(self.handler.messages), 1)
+
+
+class TestMailSenderUnavailable(unittest.IsolatedAsyncioTestCase):
+
+    async def test_server_unreachable(self):
+        sender = MailSender(hostname="127.0.0.1", port=free_port(), start_tls=False, timeout=1)
+        report = await sender.send_batch([message("user@example.com")])
+        self.assertIsNotNone(report.errors[0])
+        self.assertEqual(sender.status()["failed"], 1)
+        self.assertEqual(sender.status()["idle_connections"], 0)
+
+    async def test_log_status(self):
+        sender = MailSender(hostname="127.0.0.1", port=free_port(), start_tls=False, timeout=1)
+        await sender.send_batch([message("user@example.com")])
+        with patch("builtins.print") as print_mock:
+            task = asyncio.create_task(log_status(sender, 0.01))
+            await asyncio.sleep(0.05)
+            task.cancel()
+        line = print_mock.call_args.args[0]
+        self.assertIn('"failed": 1', line)
+        self.assertIn('"batch_latency_max_ms"', line)
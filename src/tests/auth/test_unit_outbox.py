@@ -0,0 +1,125 @@
+import unittest
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from src.database.models import Base, OutboxEmail
+from src.repository import outbox as repository_outbox
+from src.services.mail import BatchReport
+from src.services.outbox import OutboxWorker
+
+
+class FakeSender:
+    # refuses the addresses in refused, accepts the others
+
+    def __init__(self, refused=()):
+        self.refused = set(refused)
+        self.sent = []
+
+    def build_confirmation_email(self, email, username, host):
+        message = EmailMessage()
+        message["To"] = email
+        return message
+
+    async def send(self, messages):
+        errors = ["550 refused" if message["To"] in self.refused else None for message in messages]
+        self.sent.extend(message["To"] for message, error in zip(messages, errors) if error is None)
+        return [BatchReport(size=len(messages), seconds=0.0, errors=errors)]
+
+
+class TestOutboxWorker(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+        async with self.engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        self.session_factory = async_sessionmaker(self.engine, expire_on_commit=False)
+
+    async def asyncTearDown(self):
+        await self.engine.dispose()
+
+    def worker(self, sender, **kwargs):
+        options = dict(batch_size=10, max_attempts=2, base_delay=60, max_delay=600, poll_interval=0.01, lease=300)
+        options.update(kwargs)
+        return OutboxWorker(self.session_factory, sender, **options)
+
+    async def add(self, *emails):
+        async with self.session_factory() as db:
+            for email in emails:
+                await repository_outbox.add_confirmation_email(email, "user", "http://testserver/", db)
+
+    async def emails(self):
+        async with self.session_factory() as db:
+            return {email.email: email for email in await db.scalars(select(OutboxEmail))}
+
+    async def make_due(self):
+        async with self.session_factory() as db:
+            await db.execute(update(OutboxEmail).values(next_attempt_at=datetime.utcnow()))
+            await db.commit()
+
+    async def test_sent(self):
+        await self.add("a@example.com", "b@example.com")
+        sender = FakeSender()
+        self.assertEqual(await self.worker(sender).run_once(), 2)
+        self.assertEqual(sender.sent, ["a@example.com", "b@example.com"])
+        emails = await self.emails()
+        self.assertTrue(all(email.status == "sent" and email.sent_at for email in emails.values()))
+        # nothing left to do
+        self.assertEqual(await self.worker(sender).run_once(), 0)
+
+    async def test_batch_size(self):
+        await self.add(*[f"user{i}@example.com" for i in range(5)])
+        sender = FakeSender()
+        self.assertEqual(await self.worker(sender, batch_size=3).run_once(), 3)
+        self.assertEqual(await self.worker(sender, batch_size=3).run_once(), 2)
+        self.assertEqual(len(sender.sent), 5)
+
+    async def test_retry_then_dead_letter(self):
+        await self.add("refused@example.com", "ok@example.com")
+        worker = self.worker(FakeSender(refused={"refused@example.com"}))
+        await worker.run_once()
+        refused = (await self.emails())["refused@example.com"]
+        self.assertEqual((refused.status, refused.attempts, refused.last_error), ("pending", 1, "550 refused"))
+        self.assertGreater(refused.next_attempt_at, datetime.utcnow() + timedelta(seconds=50))
+        # backing off: not due yet
+        self.assertEqual(await worker.run_once(), 0)
+
+        await self.make_due()
+        await worker.run_once()
+        emails = await self.emails()
+        self.assertEqual((emails["refused@example.com"].status, emails["refused@example.com"].attempts), ("dead", 2))
+        self.assertEqual(emails["ok@example.com"].status, "sent")
+        await self.make_due()
+        self.assertEqual(await worker.run_once(), 0)
+        async with self.session_factory() as db:
+            self.assertEqual(await repository_outbox.count_emails(db), {"dead": 1, "sent": 1})
+
+    async def test_lease_expired(self):
+        await self.add("a@example.com")
+        async with self.session_factory() as db:
+            self.assertEqual(len(await repository_outbox.claim_emails(10, 300, 2, db)), 1)
+            # claimed by a worker that did not finish: not handed out again until the lease ends
+            self.assertEqual(await repository_outbox.claim_emails(10, 300, 2, db), [])
+        await self.make_due()
+        sender = FakeSender()
+        self.assertEqual(await self.worker(sender).run_once(), 1)
+        self.assertEqual((await self.emails())["a@example.com"].attempts, 2)
+
+    async def test_lease_expired_last_attempt(self):
+        await self.add("a@example.com")
+        for _ in range(2):
+            async with self.session_factory() as db:
+                self.assertEqual(len(await repository_outbox.claim_emails(10, 300, 2, db)), 1)
+            await self.make_due()
+        # both attempts were claimed and never finished: not handed out a third time
+        self.assertEqual(await self.worker(FakeSender()).run_once(), 0)
+        email = (await self.emails())["a@example.com"]
+        self.assertEqual((email.status, email.attempts), ("dead", 2))
+        self.assertEqual(email.last_error, repository_outbox.LEASE_EXPIRED)
+
+    def test_retry_delay(self):
+        worker = self.worker(FakeSender())
+        self.assertEqual([worker.retry_delay(attempts) for attempts in (1, 2, 3, 5)], [60, 120, 240, 600])
@@ -0,0 +1,124 @@
+import unittest
+
+from redis.exceptions import ConnectionError
+
+from src.services.rate_limit import TokenBuckets
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeRedis:
+    """Runs TOKEN_BUCKET_SCRIPT in Python, shared by several TokenBuckets like one Redis server."""
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.data = {}
+        self.round_trips = 0
+        self.fail = False
+
+    def register_script(self, script):
+        return self.run_script
+
+    async def run_script(self, keys, args, client):
+        client.calls.append((keys[0], args))
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    def token_bucket(self, key, capacity, rate, consumed, ttl):
+        tokens, ts = self.data.get(key, (capacity, self.clock()))
+        tokens = min(capacity, tokens + max(0, self.clock() - ts) * rate) - consumed
+        self.data[key] = (tokens, self.clock())
+        return str(tokens)
+
+
+class FakePipeline:
+
+    def __init__(self, redis):
+        self.redis = redis
+        self.calls = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+    async def execute(self):
+        if self.redis.fail:
+            raise ConnectionError("down")
+        self.redis.round_trips += 1
+        return [self.redis.token_bucket(key, *args) for key, args in self.calls]
+
+
+class TestTokenBuckets(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+
+    def buckets(self, redis=None):
+        return TokenBuckets(sync_interval=1, local_share=0.1, redis=redis, timer=self.clock)
+
+    async def allowed(self, buckets, n, capacity=100, rate=100 / 60):
+        return sum([await buckets.acquire("key", capacity, rate) == 0 for _ in range(n)])
+
+    async def test_local_limit(self):
+        buckets = self.buckets()
+        self.assertEqual(await self.allowed(buckets, 10, capacity=10, rate=10 / 60), 10)
+        retry_after = await buckets.acquire("key", 10, 10 / 60)
+        self.assertAlmostEqual(retry_after, 6)
+        # refilled at the rate of the limit
+        self.clock.now += 12
+        self.assertEqual(await self.allowed(buckets, 5, capacity=10, rate=10 / 60), 2)
+
+    async def test_keys_are_separate(self):
+        buckets = self.buckets()
+        await self.allowed(buckets, 10, capacity=10)
+        self.assertEqual(await buckets.acquire("other", 10, 10 / 60), 0)
+
+    async def test_batched_sync(self):
+        redis = FakeRedis(self.clock)
+        buckets = self.buckets(redis)
+        # 10% of the capacity is used locally before the first round trip
+        self.assertEqual(await self.allowed(buckets, 10), 10)
+        self.assertEqual(redis.round_trips, 0)
+        self.assertEqual(await self.allowed(buckets, 10), 10)
+        self.assertEqual(redis.round_trips, 1)
+        await buckets.sync()
+        self.assertEqual(redis.round_trips, 2)
+        self.assertEqual(float(redis.data["rate_limit:key"][0]), 80)
+
+    async def test_overshoot_is_bounded(self):
+        redis = FakeRedis(self.clock)
+        workers = [self.buckets(redis) for _ in range(4)]
+        allowed = 0
+        # the workers take turns without any periodic sync, every one sees the others only when it syncs
+        for _ in range(100):
+            for worker in workers:
+                allowed += await self.allowed(worker, 1)
+        # limit 100, every worker may spend 10 tokens it did not report yet
+        self.assertGreaterEqual(allowed, 100)
+        self.assertLessEqual(allowed, 100 + 4 * 10)
+
+    async def test_sync_shares_consumption(self):
+        redis = FakeRedis(self.clock)
+        first, second = self.buckets(redis), self.buckets(redis)
+        await self.allowed(first, 100)
+        await first.sync()
+        # second learns on its first sync that the bucket is empty
+        self.assertEqual(await self.allowed(second, 20), 10)
+
+    async def test_redis_down(self):
+        redis = FakeRedis(self.clock)
+        redis.fail = True
+        buckets = self.buckets(redis)
+        # limited by the local bucket alone
+        self.assertEqual(await self.allowed(buckets, 120), 100)
+        self.assertEqual(buckets.syncs, 0)
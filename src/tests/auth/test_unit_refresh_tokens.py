@@ -0,0 +1,82 @@
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from redis.exceptions import ConnectionError
+
+from src.services.refresh_tokens import (RedisRefreshTokenStore, RefreshTokenStoreUnavailable, SqlRefreshTokenStore,
+                                         get_refresh_token_store)
+
+
+class TestRedisRefreshTokenStore(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.redis = AsyncMock()
+        self.store = RedisRefreshTokenStore(self.redis)
+
+    async def test_rotate(self):
+        self.redis.eval.return_value = 1
+        self.assertTrue(await self.store.rotate(1, "sid", "old", "new", 60))
+        args = self.redis.eval.call_args.args
+        self.assertEqual(args[1:], (2, "refresh:1:sid", "refresh_sessions:1", "old", "new", 60, "sid"))
+
+    async def test_rotate_reused(self):
+        self.redis.eval.return_value = 0
+        self.assertFalse(await self.store.rotate(1, "sid", "old", "new", 60))
+
+    async def test_revoke_all(self):
+        self.redis.smembers.return_value = {"a"}
+        await self.store.revoke_all(1)
+        self.redis.delete.assert_awaited_once_with("refresh_sessions:1", "refresh:1:a")
+
+
+class TestRedisRefreshTokenStoreFallback(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.redis = AsyncMock()
+        self.fallback = AsyncMock()
+        self.store = RedisRefreshTokenStore(self.redis, self.fallback)
+
+    async def test_create_redis_down(self):
+        self.redis.pipeline = MagicMock(side_effect=ConnectionError())
+        await self.store.create(1, "sid", "jti", 60)
+        self.fallback.create.assert_awaited_once_with(1, "sid", "jti", 60)
+
+    async def test_rotate_unknown_session(self):
+        self.redis.eval.return_value = -1
+        self.fallback.rotate.return_value = True
+        self.assertTrue(await self.store.rotate(1, "sid", "old", "new", 60))
+        self.fallback.rotate.assert_awaited_once_with(1, "sid", "old", "new", 60)
+
+    async def test_rotate_reused(self):
+        self.redis.eval.return_value = 0
+        self.assertFalse(await self.store.rotate(1, "sid", "old", "new", 60))
+        self.fallback.rotate.assert_not_awaited()
+
+    async def test_rotate_redis_down(self):
+        self.redis.eval.side_effect = ConnectionError()
+        self.fallback.rotate.return_value = True
+        self.assertTrue(await self.store.rotate(1, "sid", "old", "new", 60))
+        self.fallback.rotate.return_value = False
+        with self.assertRaises(RefreshTokenStoreUnavailable):
+            await self.store.rotate(1, "sid", "old", "new", 60)
+
+    async def test_revoke_redis_down(self):
+        self.redis.pipeline = MagicMock(side_effect=ConnectionError())
+        with self.assertRaises(RefreshTokenStoreUnavailable):
+            await self.store.revoke(1, "sid")
+        self.fallback.revoke.assert_awaited_once_with(1, "sid")
+
+
+class TestGetRefreshTokenStore(unittest.TestCase):
+
+    def test_redis(self):
+        self.assertIsInstance(get_refresh_token_store(MagicMock(), MagicMock()), RedisRefreshTokenStore)
+
+    def test_sql_without_redis(self):
+        self.assertIsInstance(get_refresh_token_store(None, MagicMock()), SqlRefreshTokenStore)
+
+    def test_sql_configured(self):
+        with patch("src.settings.REFRESH_TOKEN_STORE", "sql"):
+            self.assertIsInstance(get_refresh_token_store(MagicMock(), MagicMock()), SqlRefreshTokenStore)
+
+
+if __name__ == "__main__":
+    unittest.main()
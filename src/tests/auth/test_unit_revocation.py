@@ -0,0 +1,91 @@
+import time
+import unittest
+import uuid
+from unittest.mock import AsyncMock
+
+from redis.exceptions import ConnectionError
+
+from src.services.revocation import BloomFilter, RevocationList, RevocationUnavailable
+
+
+class TestBloomFilter(unittest.TestCase):
+
+    def test_no_false_negatives(self):
+        bloom = BloomFilter(capacity=1000, error_rate=0.01)
+        items = [uuid.uuid4().hex for _ in range(1000)]
+        for item in items:
+            bloom.add(item)
+        self.assertTrue(all(item in bloom for item in items))
+
+    def test_false_positive_rate(self):
+        bloom = BloomFilter(capacity=1000, error_rate=0.01)
+        for _ in range(1000):
+            bloom.add(uuid.uuid4().hex)
+        false_positives = sum(uuid.uuid4().hex in bloom for _ in range(10000))
+        self.assertLess(false_positives, 300)
+
+
+class TestRevocationList(unittest.IsolatedAsyncioTestCase):
+
+    def revocation_list(self, redis=None):
+        return RevocationList(capacity=1000, error_rate=0.001, rebuild_interval=600, redis=redis)
+
+    async def test_local(self):
+        revocations = self.revocation_list()
+        await revocations.revoke("revoked", time.time() + 60)
+        await revocations.revoke("expired", time.time() - 1)
+        self.assertTrue(await revocations.is_revoked("revoked"))
+        self.assertFalse(await revocations.is_revoked("expired"))
+        self.assertFalse(await revocations.is_revoked("other"))
+
+    async def test_redis(self):
+        redis = AsyncMock()
+        revocations = self.revocation_list(redis)
+        await revocations.revoke("revoked", time.time() + 60)
+        redis.set.assert_awaited_once()
+        self.assertEqual(redis.set.call_args.args[:2], ("revoked:revoked", 1))
+        redis.publish.assert_awaited_once_with(RevocationList.CHANNEL, "revoked")
+
+        # not in the filter: no round trip
+        self.assertFalse(await revocations.is_revoked("other"))
+        redis.exists.assert_not_awaited()
+
+    async def test_redis_down(self):
+        redis = AsyncMock()
+        redis.set.side_effect = ConnectionError()
+        revocations = self.revocation_list(redis)
+        with self.assertRaises(RevocationUnavailable):
+            await revocations.revoke("revoked", time.time() + 60)
+        # still revoked in this process
+        self.assertTrue(await revocations.is_revoked("revoked"))
+        redis.exists.assert_not_awaited()
+
+    async def test_redis_confirms_match(self):
+        redis = AsyncMock()
+        revocations = self.revocation_list(redis)
+        # revoked by another process, the filter got it from pub/sub
+        revocations.bloom.add("revoked")
+        redis.exists.return_value = 1
+        self.assertTrue(await revocations.is_revoked("revoked"))
+        redis.exists.return_value = 0
+        self.assertFalse(await revocations.is_revoked("revoked"))
+        redis.exists.side_effect = ConnectionError()
+        self.assertTrue(await revocations.is_revoked("revoked"))
+
+    async def test_rebuild(self):
+        async def scan_iter(match, count):
+            for key in ("revoked:a", "revoked:b"):
+                yield key
+
+        redis = AsyncMock()
+        redis.scan_iter = scan_iter
+        revocations = self.revocation_list(redis)
+        revocations.bloom.add("expired")
+        await revocations.rebuild()
+        self.assertIn("a", revocations.bloom)
+        self.assertIn("b", revocations.bloom)
+        self.assertNotIn("expired", revocations.bloom)
+
+
+if __name__ == "__main__":
+    unittest.main()
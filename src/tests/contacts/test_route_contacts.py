@@ -1,4 +1,6 @@
-from unittest.mock import MagicMock, AsyncMock, patch
+import csv
+import io
+from unittest.mock import patch
 
 import pytest
 
@@ -7,9 +9,7 @@ from src.services.auth import auth_service
 
 
 @pytest.fixture()
-def token(client, user, session, monkeypatch):
-    mock_send_email = MagicMock()
-    monkeypatch.setattr("src.routes.auth.send_email", mock_send_email)
+def token(client, user, session):
     client.post("/api/auth/signup", json=user)
     current_user: User = session.query(User).filter(User.email == user.get('email')).first()
     current_user.confirmed = True
@@ -22,12 +22,9 @@ def token(client, user, session, monkeypatch):
     return data["access_token"]
 
 
-def test_create_contact(client, token, monkeypatch):
+def test_create_contact(client, token):
     with patch.object(auth_service, 'r') as redis_mock:
         redis_mock.get.return_value = None
-        monkeypatch.setattr("fastapi_limiter.FastAPILimiter.redis", AsyncMock())
-        monkeypatch.setattr("fastapi_limiter.FastAPILimiter.identifier", AsyncMock())
-        monkeypatch.setattr("fastapi_limiter.FastAPILimiter.http_callback", AsyncMock())
         response = client.post(
             "/api/contacts/",
             json={"first_name": "John", "last_name": "Doe", "email": "john.doe@example.com", "phone_number": "+14155552671",
@@ -41,12 +38,9 @@ def test_create_contact(client, token, monkeypatch):
         assert data["email"] == "john.doe@example.com"
 
 
-def test_read_contacts(client, token, monkeypatch):
+def test_read_contacts(client, token):
     with patch.object(auth_service, 'r') as redis_mock:
         redis_mock.get.return_value = None
-        monkeypatch.setattr("fastapi_limiter.FastAPILimiter.redis", AsyncMock())
-        monkeypatch.setattr("fastapi_limiter.FastAPILimiter.identifier", AsyncMock())
-        monkeypatch.setattr("fastapi_limiter.FastAPILimiter.http_callback", AsyncMock())
         response = client.get(
             "/api/contacts/",
             headers={"Authorization": f"Bearer {token}"}
@@ -64,6 +58,28 @@ def test_read_contact(client, token):
     assert response.status_code == 200, response.text
 
 
+def test_read_contacts_not_modified(client, token, queries):
+    headers = {"Authorization": f"Bearer {token}"}
+    etag = client.get("/api/contacts/", params={"skip": 0, "limit": 10}, headers=headers).headers["ETag"]
+    queries.clear()
+    # the order of the query parameters does not matter
+    response = client.get("/api/contacts/?limit=10&skip=0", headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 304, response.text
+    assert not [statement for statement in queries if "FROM contacts" in statement], queries
+    client.delete("/api/contacts/999", headers=headers)
+    assert client.get("/api/contacts/?limit=10&skip=0", headers={**headers, "If-None-Match": etag}).status_code == 304
+
+    # the tag of the list is not accepted for another URL
+    assert client.get("/api/contacts/", headers={**headers, "If-None-Match": etag}).status_code == 200
+    response = client.get("/api/contacts/1", headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 200, response.text
+    item_etag = response.headers["ETag"]
+    assert client.get("/api/contacts/1", headers={**headers, "If-None-Match": item_etag}).status_code == 304
+    # a missing contact is not found whatever the tag
+    assert client.get("/api/contacts/999", headers={**headers, "If-None-Match": item_etag}).status_code == 404
+    assert client.get("/api/contacts/999", headers={**headers, "If-None-Match": "*"}).status_code == 404
+
+
 def test_get_contact_not_found(client, token):
     with patch.object(auth_service, 'r') as r_mock:
         r_mock.get.return_value = None
@@ -118,3 +134,150 @@ def test_remove_contact(client, token):
         headers={"Authorization": f"Bearer {token}"}
     )
     assert response.status_code == 200, response.text
+
+
+def test_read_contacts_cursor(client, token):
+    for name in ("Ann", "Bob", "Carl"):
+        client.post(
+            "/api/contacts/",
+            json={"first_name": name, "last_name": "Doe", "email": f"{name}@example.com", "phone_number": "+14155552671",
+                  "birthday": "1950-01-01"},
+            headers={"Authorization": f"Bearer {token}"}
+        )
+    seen = []
+    params = {"limit": 2}
+    while True:
+        response = client.get("/api/contacts/", params=params, headers={"Authorization": f"Bearer {token}"})
+        assert response.status_code == 200, response.text
+        seen.extend(contact["id"] for contact in response.json())
+        if "X-Next-Cursor" not in response.headers:
+            break
+        params["cursor"] = response.headers["X-Next-Cursor"]
+    assert len(seen) == 3
+    assert seen == sorted(seen)
+
+
+def test_create_contacts_bulk(client, token):
+    contact = {"first_name": "John", "last_name": "Doe", "email": "john.doe@example.com",
+               "phone_number": "+14155552671", "birthday": "1950-01-01"}
+    response = client.post(
+        "/api/contacts/bulk",
+        json=[contact, {**contact, "first_name": "Jane"}, {"first_name": "Nobody"}],
+        headers={"Authorization": f"Bearer {token}"}
+    )
+    assert response.status_code == 201, response.text
+    data = response.json()
+    assert len(data["ids"]) == 2
+    assert data["ids"][0] < data["ids"][1]
+    assert data["errors"][0]["index"] == 2
+    response = client.get(f"/api/contacts/{data['ids'][1]}", headers={"Authorization": f"Bearer {token}"})
+    assert response.json()["first_name"] == "Jane"
+
+
+def test_create_contacts_bulk_too_large(client, token, monkeypatch):
+    monkeypatch.setattr("src.settings.CONTACTS_BULK_MAX_SIZE", 1)
+    response = client.post(
+        "/api/contacts/bulk",
+        json=[{}, {}],
+        headers={"Authorization": f"Bearer {token}"}
+    )
+    assert response.status_code == 413, response.text
+
+
+def test_export_contacts_csv(client, token):
+    response = client.get(
+        "/api/contacts/export",
+        params={"format": "csv"},
+        headers={"Authorization": f"Bearer {token}"}
+    )
+    assert response.status_code == 200, response.text
+    assert response.headers["content-type"].startswith("text/csv")
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert {row["first_name"] for row in rows} >= {"John", "Jane"}
+    assert "id" in rows[0]
+
+
+def test_import_contacts_csv(client, token, monkeypatch):
+    monkeypatch.setattr("src.settings.CONTACTS_IMPORT_CHUNK_SIZE", 2)
+    content = ("first_name,last_name,email,phone_number,birthday\n"
+               "Imported1,Doe,i1@example.com,+14155552671,1990-01-01\n"
+               "Imported2,Doe,i2@example.com,+14155552671,1990-01-01\n"
+               "Imported3,Doe,i3@example.com,+14155552671,not a date\n"
+               "Imported4,Doe,i4@example.com,+14155552671,1990-01-01\n")
+    response = client.post(
+        "/api/contacts/import",
+        files={"file": ("contacts.csv", content, "text/csv")},
+        headers={"Authorization": f"Bearer {token}"}
+    )
+    assert response.status_code == 202, response.text
+    job_id = response.json()["id"]
+
+    # the TestClient returns after the background task finished
+    response = client.get(f"/api/contacts/import/{job_id}", headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200, response.text
+    data = response.json()
+    assert data["status"] == "done"
+    assert (data["processed"], data["imported"], data["failed"]) == (4, 3, 1)
+    assert data["errors"][0]["index"] == 3
+
+
+def test_import_contacts_job_not_created(client, token, monkeypatch, tmp_path):
+    monkeypatch.setattr("tempfile.tempdir", str(tmp_path))
+    with patch("src.routes.contacts.import_jobs.create", side_effect=RuntimeError("boom")):
+        with pytest.raises(RuntimeError):
+            client.post(
+                "/api/contacts/import",
+                files={"file": ("contacts.csv", "first_name\nJohn\n", "text/csv")},
+                headers={"Authorization": f"Bearer {token}"}
+            )
+    # the copy of the upload is removed
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_import_contacts_unsupported_file(client, token):
+    response = client.post(
+        "/api/contacts/import",
+        files={"file": ("contacts.txt", "hello", "text/plain")},
+        headers={"Authorization": f"Bearer {token}"}
+    )
+    assert response.status_code == 415, response.text
+
+
+def test_read_import_not_found(client, token):
+    response = client.get("/api/contacts/import/unknown", headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 404, response.text
+
+
+def test_search_contacts(client, token):
+    response = client.get(
+        "/api/contacts/search",
+        params={"q": "imported2"},
+        headers={"Authorization": f"Bearer {token}"}
+    )
+    assert response.status_code == 200, response.text
+    assert [contact["email"] for contact in response.json()] == ["i2@example.com"]
+
+    # shorter than a trigram
+    response = client.get(
+        "/api/contacts/search",
+        params={"q": "i4"},
+        headers={"Authorization": f"Bearer {token}"}
+    )
+    assert response.status_code == 200, response.text
+    assert [contact["email"] for contact in response.json()] == ["i4@example.com"]
+
+
+def test_search_contacts_updated(client, token):
+    response = client.get("/api/contacts/search", params={"q": "Imported1"},
+                          headers={"Authorization": f"Bearer {token}"})
+    contact = response.json()[0]
+    contact["first_name"] = "Renamed"
+    response = client.put(f"/api/contacts/{contact['id']}", json=contact, headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200, response.text
+
+    response = client.get("/api/contacts/search", params={"q": "Imported1"},
+                          headers={"Authorization": f"Bearer {token}"})
+    assert response.json() == []
+    response = client.get("/api/contacts/search", params={"q": "renamed"},
+                          headers={"Authorization": f"Bearer {token}"})
+    assert [item["id"] for item in response.json()] == [contact["id"]]
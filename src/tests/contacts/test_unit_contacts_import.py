@@ -0,0 +1,99 @@
+import io
+import unittest
+from unittest.mock import AsyncMock
+
+from redis.exceptions import ConnectionError
+
+from src.database.models import User
+from src.services.contacts_import import (ImportJob, ImportJobs, detect_format, iter_csv_rows, iter_vcard_rows,
+                                          read_chunk)
+
+VCARD = (
+    "BEGIN:VCARD\r\n"
+    "VERSION:3.0\r\n"
+    "N:Petriv;Ivan;;;\r\n"
+    "FN:Ivan Petriv\r\n"
+    "item1.EMAIL;TYPE=INTERNET:ivan@example.com\r\n"
+    "EMAIL:second@example.com\r\n"
+    "TEL;TYPE=CELL:+380123456789\r\n"
+    "BDAY:19900101\r\n"
+    "NOTE:A long note that is\r\n"
+    "  folded\r\n"
+    "END:VCARD\r\n"
+    "BEGIN:VCARD\r\n"
+    "FN:Petro Ivaniv\r\n"
+    "END:VCARD\r\n"
+)
+
+
+class TestContactsImport(unittest.TestCase):
+    def test_iter_vcard_rows(self):
+        rows = list(iter_vcard_rows(io.BytesIO(VCARD.encode())))
+        self.assertEqual(rows[0], {"last_name": "Petriv", "first_name": "Ivan", "email": "ivan@example.com",
+                                   "phone_number": "+380123456789", "birthday": "1990-01-01",
+                                   "additional_data": "A long note that is folded"})
+        self.assertEqual(rows[1], {"first_name": "Petro", "last_name": "Ivaniv"})
+
+    def test_iter_csv_rows(self):
+        content = "\ufeffFirst_Name,last_name,additional_data\nIvan,Petriv,\n"
+        rows = list(iter_csv_rows(io.BytesIO(content.encode())))
+        self.assertEqual(rows, [{"first_name": "Ivan", "last_name": "Petriv"}])
+
+    def test_detect_format(self):
+        self.assertEqual(detect_format("contacts.CSV"), "csv")
+        self.assertEqual(detect_format("contacts.vcf"), "vcard")
+        self.assertIsNone(detect_format("contacts.xlsx"))
+        self.assertIsNone(detect_format(None))
+
+    def test_read_chunk(self):
+        content = ("first_name,last_name,email,phone_number,birthday\n"
+                   "Ivan,Petriv,i1@example.com,+14155552671,1990-01-01\n"
+                   "Petro,Ivaniv,i2@example.com,+14155552671,not a date\n"
+                   "Olena,Petriv,i3@example.com,+14155552671,1990-01-01\n")
+        rows = iter_csv_rows(io.BytesIO(content.encode()))
+        job = ImportJob(id="1", user_id=1, filename="contacts.csv")
+        chunk, exhausted = read_chunk(rows, job, 1)
+        self.assertEqual(([contact.first_name for contact in chunk], exhausted), (["Ivan"], False))
+        chunk, exhausted = read_chunk(rows, job, 1)
+        self.assertEqual([contact.first_name for contact in chunk], ["Olena"])
+        self.assertEqual((job.processed, job.failed, job.errors[0]["index"]), (3, 1, 2))
+        self.assertEqual(read_chunk(rows, job, 1), ([], True))
+
+
+class TestImportJobs(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.user = User(id=1, email="deadpool@example.com")
+        self.other = User(id=2, email="wolverine@example.com")
+
+    async def test_local(self):
+        jobs = ImportJobs(maxsize=10, ttl=60)
+        job = await jobs.create(self.user, "contacts.csv")
+        self.assertIs(await jobs.get(job.id, self.user), job)
+        self.assertIsNone(await jobs.get(job.id, self.other))
+        self.assertIsNone(await jobs.get("unknown", self.user))
+
+    async def test_redis(self):
+        store = {}
+        redis = AsyncMock()
+        redis.get.side_effect = lambda key: store.get(key)
+        redis.set.side_effect = lambda key, value, ex: store.__setitem__(key, value)
+        job = await ImportJobs(maxsize=10, ttl=60, redis=redis).create(self.user, "contacts.csv")
+        job.status, job.processed = "done", 4
+        await ImportJobs(maxsize=10, ttl=60, redis=redis).save(job)
+
+        # another worker reports the progress
+        found = await ImportJobs(maxsize=10, ttl=60, redis=redis).get(job.id, self.user)
+        self.assertEqual((found.status, found.processed, found.created_at), ("done", 4, job.created_at))
+        self.assertIsNone(found.finished_at)
+
+    async def test_redis_down(self):
+        redis = AsyncMock()
+        redis.get.side_effect = ConnectionError()
+        redis.set.side_effect = ConnectionError()
+        jobs = ImportJobs(maxsize=10, ttl=60, redis=redis)
+        job = await jobs.create(self.user, "contacts.csv")
+        self.assertIs(await jobs.get(job.id, self.user), job)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,65 +1,100 @@
 import unittest
-from unittest.mock import MagicMock
-from sqlalchemy.orm import Session
+from datetime import datetime
+from unittest.mock import MagicMock, AsyncMock
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.database.models import Contact, User
 from src.schemas import ContactBase, ContactCreate, ContactUpdate, ContactResponse
-from src.repository.contacts import get_contacts, get_contact, create_contact, remove_contact, update_contact
+from src.repository.contacts import get_contacts, get_contact, create_contact, create_contacts, remove_contact, update_contact, \
+    search_contacts
 
 
 class TestContactController(unittest.IsolatedAsyncioTestCase):
     def setUp(self) -> None:
-        self.session = MagicMock(spec=Session)
+        self.session = AsyncMock(spec=AsyncSession)
+        self.session.execute.return_value = MagicMock()
         self.user = User(id=1)
 
     async def test_get_contacts(self):
         contacts = [Contact(), Contact(), Contact()]
-        self.session.query().filter().offset().limit().all.return_value = contacts
+        self.session.execute.return_value.scalars().all.return_value = contacts
         result = await get_contacts(skip=0, limit=10, user=self.user, db=self.session)
         self.assertEqual(result, contacts)
 
     async def test_get_contact_found(self):
         contact = Contact()
-        self.session.query().filter().first.return_value = contact
-        result = await get_contact(id=1, user=self.user, db=self.session)
+        self.session.execute.return_value.scalars().first.return_value = contact
+        result = await get_contact(contact_id=1, user=self.user, db=self.session)
         self.assertEqual(result, contact)
 
     async def test_get_contact_not_found(self):
-        self.session.query().filter().first.return_value = None
-        result = await get_contact(id=1, user=self.user, db=self.session)
+        self.session.execute.return_value.scalars().first.return_value = None
+        result = await get_contact(contact_id=1, user=self.user, db=self.session)
         self.assertIsNone(result)
 
     async def test_create_contact(self):
-        body = ContactCreate(first_name="Ivan", last_name="Petriv", email="test@email.com", phone_number="+380123456789")
-        result = await self.controller.create(body=body, user=self.user, db=self.session)
+        body = ContactCreate(first_name="Ivan", last_name="Petriv", email="test@email.com", phone_number="+380123456789",
+                             birthday=datetime(1990, 1, 1))
+        result = await create_contact(body=body, user=self.user, db=self.session)
         self.assertEqual(result.first_name, body.first_name)
         self.assertEqual(result.last_name, body.last_name)
         self.assertEqual(result.email, body.email)
         self.assertEqual(result.phone_number, body.phone_number)
         self.assertTrue(hasattr(result, "id"))
 
+    async def test_create_contacts(self):
+        bodies = [ContactCreate(first_name=name, last_name="Petriv", email="test@email.com",
+                                phone_number="+380123456789", birthday=datetime(1990, 1, 1)) for name in ("Ivan", "Petro")]
+        self.session.execute.return_value.scalars().all.return_value = [1, 2]
+        result = await create_contacts(bodies=bodies, user=self.user, db=self.session)
+        self.assertEqual(result, [1, 2])
+        rows = self.session.execute.call_args.args[1]
+        self.assertEqual([row["first_name"] for row in rows], ["Ivan", "Petro"])
+        self.assertTrue(all(row["user_id"] == self.user.id for row in rows))
+        self.session.commit.assert_awaited_once()
+
+    async def test_create_contacts_empty(self):
+        result = await create_contacts(bodies=[], user=self.user, db=self.session)
+        self.assertEqual(result, [])
+        self.session.execute.assert_not_awaited()
+
+    async def test_search_contacts_postgres(self):
+        contacts = [Contact()]
+        self.session.bind = MagicMock()
+        self.session.bind.dialect = postgresql.dialect()
+        self.session.execute.return_value.scalars().all.return_value = contacts
+        result = await search_contacts(q="50%", limit=10, user=self.user, db=self.session)
+        self.assertEqual(result, contacts)
+        stmt = self.session.execute.call_args.args[0].compile(dialect=postgresql.dialect())
+        self.assertIn("ILIKE", str(stmt))
+        self.assertIn("word_similarity", str(stmt))
+        self.assertIn("%50\\%%", stmt.params.values())
+
     async def test_remove_contact_found(self):
         contact = Contact()
-        self.session.query().filter().first.return_value = contact
-        result = await remove_contact(id=1, user=self.user, db=self.session)
+        self.session.execute.return_value.scalars().first.return_value = contact
+        result = await remove_contact(contact_id=1, user=self.user, db=self.session)
         self.assertEqual(result, contact)
 
     async def test_remove_not_found(self):
-        self.session.query().filter().first.return_value = None
-        result = await remove_contact(id=1, user=self.user, db=self.session)
+        self.session.execute.return_value.scalars().first.return_value = None
+        result = await remove_contact(contact_id=1, user=self.user, db=self.session)
         self.assertIsNone(result)
 
     async def test_update_found(self):
-        body = ContactUpdate(first_name="Avr", phone="+380999999999")
+        body = ContactUpdate(first_name="Avr", last_name="Poltavka", email="test@email.com",
+                             phone_number="+380999999999", birthday=datetime(1990, 1, 1))
         contact = Contact(first_name="Natalka", last_name="Poltavka")
-        self.session.query().filter().first.return_value = contact
-        result = await update_contact(id=1, body=body, user=self.user, db=self.session)
+        self.session.execute.return_value.scalars().first.return_value = contact
+        result = await update_contact(contact_id=1, body=body, user=self.user, db=self.session)
         self.assertEqual(result, contact)
 
     async def test_update_not_found(self):
-        body = ContactUpdate(first_name="Ivan", phone="+380331231234")
-        self.session.query().filter().first.return_value = None
-        result = await update_contact(id=1, body=body, user=self.user, db=self.session)
+        body = ContactUpdate(first_name="Ivan", last_name="Petriv", email="test@email.com",
+                             phone_number="+380331231234", birthday=datetime(1990, 1, 1))
+        self.session.execute.return_value.scalars().first.return_value = None
+        result = await update_contact(contact_id=1, body=body, user=self.user, db=self.session)
         self.assertIsNone(result)
 
 
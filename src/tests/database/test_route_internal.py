@@ -0,0 +1,32 @@
+import pytest
+
+from src import settings
+
+
+@pytest.fixture()
+def internal_token(monkeypatch):
+    monkeypatch.setattr(settings, "INTERNAL_API_TOKEN", "secret-token")
+    return "secret-token"
+
+
+def test_internal_disabled(client, monkeypatch):
+    monkeypatch.setattr(settings, "INTERNAL_API_TOKEN", None)
+    response = client.get("/api/internal/pool", headers={"X-Internal-Token": "anything"})
+    assert response.status_code == 404, response.text
+
+
+def test_internal_without_token(client, internal_token):
+    for path in ("/api/internal/pool", "/api/internal/executors", "/api/internal/response-cache"):
+        response = client.get(path)
+        assert response.status_code == 401, response.text
+
+
+def test_internal_wrong_token(client, internal_token):
+    response = client.get("/api/internal/pool", headers={"X-Internal-Token": "wrong"})
+    assert response.status_code == 401, response.text
+
+
+def test_internal_with_token(client, internal_token):
+    response = client.get("/api/internal/pool", headers={"X-Internal-Token": internal_token})
+    assert response.status_code == 200, response.text
+    assert "primary" in response.json()
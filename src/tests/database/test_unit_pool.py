@@ -0,0 +1,47 @@
+import unittest
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from src.database.pool import InstrumentedQueuePool, get_pool_status
+
+
+class TestInstrumentedQueuePool(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.engine = create_async_engine("sqlite+aiosqlite:///./test.db", poolclass=InstrumentedQueuePool,
+                                          pool_size=2, max_overflow=1, pool_timeout=5)
+
+    async def asyncTearDown(self):
+        await self.engine.dispose()
+
+    async def test_checkout_is_recorded(self):
+        async with self.engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+            status = get_pool_status(self.engine.pool)
+            self.assertEqual(status["checked_out"], 1)
+        status = get_pool_status(self.engine.pool)
+        self.assertEqual(status["checked_out"], 0)
+        self.assertEqual(status["size"], 2)
+        self.assertEqual(status["checkouts"], 1)
+        self.assertEqual(sum(status["wait_time_histogram"].values()), 1)
+
+    async def test_stats_survive_dispose(self):
+        async with self.engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+        await self.engine.dispose()
+        async with self.engine.connect() as conn:
+            await conn.execute(text("SELECT 1"))
+        self.assertEqual(get_pool_status(self.engine.pool)["checkouts"], 2)
+
+    async def test_overflow(self):
+        conns = [await self.engine.connect() for _ in range(3)]
+        status = get_pool_status(self.engine.pool)
+        self.assertEqual(status["checked_out"], 3)
+        self.assertEqual(status["overflow"], 1)
+        for conn in conns:
+            await conn.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
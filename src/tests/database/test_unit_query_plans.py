@@ -0,0 +1,84 @@
+import re
+import unittest
+from datetime import datetime
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from src.database.models import Base, Contact, Note, Tag, User
+from src.repository import contacts as repository_contacts
+from src.repository import notes as repository_notes
+from src.repository import tags as repository_tags
+from src.repository import users as repository_users
+
+# "SCAN notes" is a full table scan, "SEARCH notes USING INDEX ..." is an index lookup
+FULL_SCAN = re.compile(r"\bSCAN (users|notes|tags|contacts|note_m2m_tag)\b")
+
+
+class TestQueryPlans(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+        async with self.engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        self.session = async_sessionmaker(self.engine, expire_on_commit=False)()
+        self.user = User(username="deadpool", email="deadpool@example.com", password="secret")
+        self.session.add(self.user)
+        await self.session.flush()
+        tag = Tag(name="tag", user_id=self.user.id)
+        self.session.add_all([
+            Note(title="note", description="description", tags=[tag], user_id=self.user.id),
+            Contact(first_name="John", last_name="Doe", email="john@example.com", phone_number="+14155552671",
+                    birthday=datetime(1950, 1, 1), user_id=self.user.id),
+        ])
+        await self.session.commit()
+
+        self.statements = []
+        event.listen(self.engine.sync_engine, "before_cursor_execute", self.record)
+
+    async def asyncTearDown(self):
+        await self.session.close()
+        await self.engine.dispose()
+
+    def record(self, conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE")):
+            self.statements.append((statement, parameters))
+
+    async def assert_no_full_scans(self):
+        self.assertTrue(self.statements)
+        event.remove(self.engine.sync_engine, "before_cursor_execute", self.record)
+        async with self.engine.connect() as conn:
+            for statement, parameters in self.statements:
+                result = await conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters)
+                plan = "\n".join(row[-1] for row in result)
+                self.assertIsNone(FULL_SCAN.search(plan), f"{statement}\n{plan}")
+
+    async def test_notes_queries(self):
+        await repository_notes.get_notes(0, 10, self.user, self.session)
+        await repository_notes.get_notes(0, 10, self.user, self.session, after=1)
+        await repository_notes.get_note(1, self.user, self.session)
+        await repository_notes.get_user_tags([1], self.user, self.session)
+        await self.assert_no_full_scans()
+
+    async def test_tags_queries(self):
+        await repository_tags.get_tags(0, 10, self.user, self.session)
+        await repository_tags.get_tags(0, 10, self.user, self.session, after=("a", 1))
+        await repository_tags.get_tag(1, self.user, self.session)
+        await repository_tags.remove_tag(1, self.user, self.session)
+        await self.assert_no_full_scans()
+
+    async def test_contacts_queries(self):
+        await repository_contacts.get_contacts(0, 10, self.user, self.session)
+        await repository_contacts.get_contacts(0, 10, self.user, self.session, after=1)
+        await repository_contacts.get_contact(1, self.user, self.session)
+        await repository_contacts.search_contacts("john", 10, self.user, self.session)
+        await self.assert_no_full_scans()
+
+    async def test_users_queries(self):
+        await repository_users.get_user_by_email("deadpool@example.com", self.session)
+        await self.assert_no_full_scans()
+
+
+if __name__ == '__main__':
+    unittest.main()
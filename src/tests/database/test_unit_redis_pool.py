@@ -0,0 +1,46 @@
+import unittest
+
+from redis.asyncio import Connection
+from redis.exceptions import ConnectionError
+
+from src.services.redis_pool import InstrumentedConnectionPool, get_redis_pool_status
+
+
+class FakeConnection(Connection):
+    # a connection that never talks to a server
+
+    async def connect(self):
+        pass
+
+    async def can_read(self, timeout=0):
+        return False
+
+    async def disconnect(self, nowait=False, **kwargs):
+        pass
+
+
+class TestInstrumentedConnectionPool(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.pool = InstrumentedConnectionPool(max_connections=1, timeout=0.05, connection_class=FakeConnection)
+
+    async def test_checkout_is_recorded(self):
+        connection = await self.pool.get_connection()
+        status = get_redis_pool_status(self.pool)
+        self.assertEqual((status["connections"], status["in_use"], status["checkouts"]), (1, 1, 1))
+        await self.pool.release(connection)
+        status = get_redis_pool_status(self.pool)
+        self.assertEqual(status["in_use"], 0)
+        self.assertEqual(sum(status["wait_time_histogram"].values()), 1)
+
+    async def test_timeout_is_recorded(self):
+        connection = await self.pool.get_connection()
+        with self.assertRaises(ConnectionError):
+            await self.pool.get_connection()
+        await self.pool.release(connection)
+        status = get_redis_pool_status(self.pool)
+        self.assertEqual((status["max_connections"], status["checkouts"], status["timeouts"]), (1, 1, 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,133 @@
+import tempfile
+import unittest
+from itertools import cycle
+from unittest.mock import MagicMock, patch
+
+from fastapi import Response
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+from src.database.db import RoutingSession, get_primary_db, reads_from_primary
+from src.database.models import Base, Note, Tag, User, note_m2m_tag
+from src.repository import notes as repository_notes
+from src.repository import tags as repository_tags
+from src.repository import users as repository_users
+from src.schemas import NoteUpdate, TagModel
+from src.services.auth import auth_service
+from src.services.cache import user_cache
+from src.services.etags import UNVERIFIED_ETAG, current_etag, get_conditional_db, not_modified
+from src.services.response_cache import get_cacheable_db, response_cache
+
+
+class TestRoutingSession(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.primary = create_async_engine(f"sqlite+aiosqlite:///{self.tmp.name}/primary.db")
+        self.replica = create_async_engine(f"sqlite+aiosqlite:///{self.tmp.name}/replica.db")
+        # the same user exists in both databases under a different username, so reads show where they went
+        for engine, username in ((self.primary, "primary"), (self.replica, "replica")):
+            async with engine.begin() as conn:
+                await conn.run_sync(Base.metadata.create_all)
+            async with async_sessionmaker(engine)() as db:
+                db.add(User(username=username, email="deadpool@example.com", password="secret"))
+                await db.commit()
+        self.SessionLocal = async_sessionmaker(autoflush=False, expire_on_commit=False, bind=self.primary,
+                                               sync_session_class=RoutingSession,
+                                               replicas=cycle([self.replica.sync_engine]))
+
+    async def asyncTearDown(self):
+        await self.primary.dispose()
+        await self.replica.dispose()
+        self.tmp.cleanup()
+
+    async def test_reads_go_to_replica(self):
+        async with self.SessionLocal() as db:
+            user = await repository_users.get_user_by_email("deadpool@example.com", db)
+            self.assertEqual(user.username, "replica")
+
+    async def test_writes_go_to_primary(self):
+        async with self.SessionLocal() as db:
+            user = await repository_users.get_user_by_email("deadpool@example.com", db)
+            await repository_tags.create_tag(TagModel(name="tag"), user, db)
+        async with async_sessionmaker(self.primary)() as db:
+            self.assertEqual(len(await repository_tags.get_tags(0, 10, user, db)), 1)
+        async with async_sessionmaker(self.replica)() as db:
+            self.assertEqual(len(await repository_tags.get_tags(0, 10, user, db)), 0)
+
+    async def test_read_after_write_goes_to_primary(self):
+        async with self.SessionLocal() as db:
+            user = await repository_users.get_user_by_email("deadpool@example.com", db)
+            await repository_tags.create_tag(TagModel(name="tag"), user, db)
+            self.assertEqual(len(await repository_tags.get_tags(0, 10, user, db)), 1)
+
+    async def test_update_reads_from_primary(self):
+        # the replica lags behind: the tag of the note was not replicated yet
+        for engine, tags in ((self.primary, True), (self.replica, False)):
+            async with async_sessionmaker(engine)() as db:
+                tag = Tag(name="tag", user_id=1)
+                db.add(tag)
+                db.add(Note(title="note", description="description", user_id=1, tags=[tag] if tags else []))
+                await db.commit()
+        async with self.SessionLocal() as db:
+            user = await repository_users.get_user_by_email("deadpool@example.com", db)
+            note = await repository_notes.update_note(1, NoteUpdate(title="new", description="description",
+                                                                    done=True, tags=[1]), user, db)
+            self.assertEqual(note.title, "new")
+        async with self.primary.connect() as conn:
+            rows = (await conn.execute(select(note_m2m_tag.c.note_id, note_m2m_tag.c.tag_id))).all()
+        self.assertEqual(rows, [(1, 1)])
+
+    async def test_get_primary_db(self):
+        async with self.SessionLocal() as db:
+            self.assertFalse(reads_from_primary(db))
+            await get_primary_db(db)
+            self.assertTrue(reads_from_primary(db))
+            user = await repository_users.get_user_by_email("deadpool@example.com", db)
+            self.assertEqual(user.username, "primary")
+
+    async def test_unverified_etag_for_replica_reads(self):
+        request = MagicMock(headers={})
+        async with self.SessionLocal() as db:
+            response = Response()
+            etag = await current_etag(request, "notes", 1, db)
+            self.assertEqual(etag, UNVERIFIED_ETAG)
+            # never answered with 304
+            self.assertIsNone(not_modified(MagicMock(headers={"if-none-match": "*"}), response, etag))
+            self.assertEqual(response.headers["ETag"], UNVERIFIED_ETAG)
+            await get_primary_db(db)
+            self.assertNotEqual(await current_etag(request, "notes", 1, db), UNVERIFIED_ETAG)
+
+    async def test_get_conditional_db(self):
+        async with self.SessionLocal() as db:
+            await get_conditional_db(MagicMock(headers={}), db)
+            self.assertFalse(reads_from_primary(db))
+            await get_cacheable_db(db)
+            self.assertFalse(reads_from_primary(db))
+            await get_conditional_db(MagicMock(headers={"if-none-match": UNVERIFIED_ETAG}), db)
+            self.assertTrue(reads_from_primary(db))
+
+    async def test_get_cacheable_db(self):
+        async with self.SessionLocal() as db:
+            with patch.object(response_cache, "redis", MagicMock()):
+                await get_cacheable_db(db)
+            self.assertTrue(reads_from_primary(db))
+
+    async def test_current_user_cached_from_primary(self):
+        token = await auth_service.create_access_token(data={"sub": "deadpool@example.com"})
+        user_cache.local.clear()
+        async with self.SessionLocal() as db:
+            user = await auth_service.get_current_user(token, db)
+        self.assertEqual(user.username, "primary")
+        self.assertEqual((await user_cache.get("deadpool@example.com")).username, "primary")
+        user_cache.local.clear()
+
+    async def test_without_replicas_everything_goes_to_primary(self):
+        SessionLocal = async_sessionmaker(bind=self.primary, sync_session_class=RoutingSession)
+        async with SessionLocal() as db:
+            user = await repository_users.get_user_by_email("deadpool@example.com", db)
+            self.assertEqual(user.username, "primary")
+
+
+if __name__ == '__main__':
+    unittest.main()
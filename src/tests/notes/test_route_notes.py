@@ -1,15 +1,20 @@
-from unittest.mock import MagicMock, patch
+import csv
+import io
+import json
+from unittest.mock import AsyncMock, patch
 
 import pytest
+from redis.exceptions import ConnectionError
 
 from src.database.models import User
 from src.services.auth import auth_service
+from src.services.cache import collection_versions
+from src.services.rate_limit import rate_limits
+from src.services.response_cache import response_cache
 
 
 @pytest.fixture()
-def token(client, user, session, monkeypatch):
-    mock_send_email = MagicMock()
-    monkeypatch.setattr("src.routes.auth.send_email", mock_send_email)
+def token(client, user, session):
     client.post("/api/auth/signup", json=user)
     current_user: User = session.query(User).filter(User.email == user.get('email')).first()
     current_user.confirmed = True
@@ -22,90 +27,289 @@ def token(client, user, session, monkeypatch):
     return data["access_token"]
 
 
-def test_create_note(client, token):
+@pytest.fixture()
+def no_rate_limit(monkeypatch):
+    monkeypatch.setattr(rate_limits, "acquire", AsyncMock(return_value=0.0))
+
+
+@pytest.fixture()
+def redis_cache(monkeypatch):
+    store = {}
+    redis = AsyncMock()
+    redis.get.side_effect = lambda key: store.get(key)
+    redis.set.side_effect = lambda key, value, ex: store.__setitem__(key, value)
+    monkeypatch.setattr(response_cache, "redis", redis)
+    monkeypatch.setattr(response_cache, "hits", 0)
+    monkeypatch.setattr(response_cache, "misses", 0)
+    monkeypatch.setattr(response_cache, "errors", 0)
+    return store
+
+
+@pytest.fixture()
+def tag_ids(client, token):
+    tags = client.get("/api/tags", headers={"Authorization": f"Bearer {token}"}).json()
+    if not tags:
+        for name in ("work", "home"):
+            response = client.post("/api/tags", json={"name": name}, headers={"Authorization": f"Bearer {token}"})
+            tags.append(response.json())
+    return [tag["id"] for tag in tags]
+
+
+def test_create_note(client, token, tag_ids):
     response = client.post(
         "/api/notes",
-        json={"name": "test_tag"},
+        json={"title": "test_note", "description": "test description", "tags": tag_ids},
         headers={"Authorization": f"Bearer {token}"}
     )
     assert response.status_code == 201, response.text
     data = response.json()
-    assert data["name"] == "test_tag"
+    assert data["title"] == "test_note"
+    assert sorted(tag["name"] for tag in data["tags"]) == ["home", "work"]
     assert "id" in data
 
 
-def test_get_tag(client, token):
+def test_get_note(client, token):
     response = client.get(
-        "/api/tags/1",
+        "/api/notes/1",
         headers={"Authorization": f"Bearer {token}"}
     )
     assert response.status_code == 200, response.text
     data = response.json()
-    assert data["name"] == "test_tag"
-    assert "id" in data
+    assert data["title"] == "test_note"
+    assert len(data["tags"]) == 2
 
 
-def test_get_tag_not_found(client, token):
+def test_get_note_not_found(client, token):
     response = client.get(
-        "/api/tags/2",
+        "/api/notes/2",
         headers={"Authorization": f"Bearer {token}"}
     )
     assert response.status_code == 404, response.text
     data = response.json()
-    assert data["detail"] == "Tag not found"
+    assert data["detail"] == "Note not found"
 
 
-def test_get_tags(client, token):
+def test_get_notes(client, token, no_rate_limit):
     response = client.get(
-        "/api/tags",
+        "/api/notes",
         headers={"Authorization": f"Bearer {token}"}
     )
     assert response.status_code == 200, response.text
     data = response.json()
     assert isinstance(data, list)
-    assert data[0]["name"] == "test_tag"
-    assert "id" in data[0]
+    assert data[0]["title"] == "test_note"
+    assert len(data[0]["tags"]) == 2
+
+
+def test_get_notes_query_count(client, token, tag_ids, no_rate_limit, queries):
+    counts = []
+    for page_size in (1, 5, 20):
+        while len(client.get("/api/notes", params={"limit": 100},
+                             headers={"Authorization": f"Bearer {token}"}).json()) < page_size:
+            client.post(
+                "/api/notes",
+                json={"title": "note", "description": "description", "tags": tag_ids},
+                headers={"Authorization": f"Bearer {token}"}
+            )
+        queries.clear()
+        response = client.get(
+            "/api/notes",
+            params={"limit": page_size},
+            headers={"Authorization": f"Bearer {token}"}
+        )
+        assert response.status_code == 200, response.text
+        assert len(response.json()) == page_size
+        counts.append(len(queries))
+    assert counts[0] == counts[1] == counts[2], counts
+
+
+def test_get_notes_cached_user(client, token, no_rate_limit, queries):
+    client.get("/api/notes", headers={"Authorization": f"Bearer {token}"})
+    queries.clear()
+    response = client.get("/api/notes", headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200, response.text
+    assert not [statement for statement in queries if "FROM users" in statement], queries
+
+
+def test_get_notes_not_modified(client, token, tag_ids, no_rate_limit, queries):
+    headers = {"Authorization": f"Bearer {token}"}
+    etag = client.get("/api/notes", headers=headers).headers["ETag"]
+    # the tag identifies one page or item, it is not accepted for another URL
+    response = client.get("/api/notes/1", headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 200, response.text
+    assert response.headers["ETag"] != etag
+    assert client.get("/api/notes", params={"limit": 1}, headers={**headers, "If-None-Match": etag}).status_code == 200
+    queries.clear()
+    response = client.get("/api/notes", headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 304, response.text
+    assert response.headers["ETag"] == etag
+    assert not response.content
+    assert not [statement for statement in queries if "FROM notes" in statement], queries
+    client.post("/api/notes", json={"title": "note", "description": "description", "tags": tag_ids}, headers=headers)
+    response = client.get("/api/notes", headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 200, response.text
+    assert response.headers["ETag"] != etag
+    # the notes embed their tags
+    etag = response.headers["ETag"]
+    client.put(f"/api/tags/{tag_ids[0]}", json={"name": "office"}, headers=headers)
+    assert client.get("/api/notes", headers={**headers, "If-None-Match": etag}).status_code == 200
+
+
+def test_get_notes_response_cache(client, token, tag_ids, no_rate_limit, redis_cache, queries):
+    headers = {"Authorization": f"Bearer {token}"}
+    first = client.get("/api/notes", params={"limit": 1}, headers=headers)
+    assert first.status_code == 200, first.text
+    assert len(redis_cache) == 1
+    queries.clear()
+    second = client.get("/api/notes", params={"limit": 1}, headers=headers)
+    assert second.status_code == 200, second.text
+    assert second.json() == first.json()
+    assert second.headers["X-Next-Cursor"] == first.headers["X-Next-Cursor"]
+    assert second.headers["ETag"] == first.headers["ETag"]
+    assert not [statement for statement in queries if "FROM notes" in statement], queries
+    # pages of other parameters are cached separately
+    assert len(client.get("/api/notes", params={"limit": 2}, headers=headers).json()) == 2
+    assert response_cache.status()["hits"] == 1
+    assert response_cache.status()["misses"] == 2
+
+    client.patch("/api/notes/1", json={"done": True}, headers=headers)
+    response = client.get("/api/notes", params={"limit": 1}, headers=headers)
+    assert response.json()[0]["id"] == 1
+    assert response.headers["ETag"] != first.headers["ETag"]
+    assert response_cache.status()["misses"] == 3
+
+
+def test_get_notes_response_cache_redis_down(client, token, no_rate_limit, redis_cache):
+    response_cache.redis.get.side_effect = ConnectionError()
+    response = client.get("/api/notes", headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200, response.text
+    assert response.json()
+    assert response_cache.status()["errors"] == 1
+
+
+def test_get_notes_response_cache_failed_bump(client, token, no_rate_limit, redis_cache, monkeypatch):
+    versions = {}
+    redis = AsyncMock()
+
+    def set_version(key, value, ex, nx=False, get=False):
+        old = versions.get(key)
+        if not (nx and old is not None):
+            versions[key] = value
+        return old
+
+    redis.set.side_effect = set_version
+    monkeypatch.setattr(collection_versions, "redis", redis)
+    monkeypatch.setattr(collection_versions, "failed", set())
+    collection_versions.local.clear()
+    headers = {"Authorization": f"Bearer {token}"}
+    note = client.post("/api/notes", json={"title": "note", "description": "description", "tags": []},
+                       headers=headers).json()
+    params = {"limit": 100}
+    client.get("/api/notes", params=params, headers=headers)
+    assert len(redis_cache) == 1
 
+    # Redis fails while the note changes: the page cached before must not be served
+    redis.set.side_effect = ConnectionError()
+    client.put(f"/api/notes/{note['id']}", json={"title": "changed", "description": "description", "tags": [],
+                                                 "done": False}, headers=headers)
+    response = client.get("/api/notes", params=params, headers=headers)
+    assert {item["id"]: item for item in response.json()}[note["id"]]["title"] == "changed"
+    assert "ETag" not in response.headers
+    assert len(redis_cache) == 1
 
-def test_update_tag(client, token):
+    redis.set.side_effect = set_version
+    response = client.get("/api/notes", params=params, headers=headers)
+    assert {item["id"]: item for item in response.json()}[note["id"]]["title"] == "changed"
+    assert "ETag" in response.headers
+    assert len(redis_cache) == 2
+    collection_versions.local.clear()
+
+
+def test_update_note(client, token, tag_ids):
     response = client.put(
-        "/api/tags/1",
-        json={"name": "new_test_tag"},
+        "/api/notes/1",
+        json={"title": "new_test_note", "description": "new description", "tags": tag_ids[:1], "done": True},
         headers={"Authorization": f"Bearer {token}"}
     )
     assert response.status_code == 200, response.text
     data = response.json()
-    assert data["name"] == "new_test_tag"
-    assert "id" in data
+    assert data["title"] == "new_test_note"
+    assert len(data["tags"]) == 1
 
 
-def test_update_tag_not_found(client, token):
-    response = client.put(
-        "/api/tags/2",
-        json={"name": "new_test_tag"},
+def test_update_status_note(client, token):
+    response = client.patch(
+        "/api/notes/1",
+        json={"done": False},
         headers={"Authorization": f"Bearer {token}"}
     )
-    assert response.status_code == 404, response.text
+    assert response.status_code == 200, response.text
     data = response.json()
-    assert data["detail"] == "Tag not found"
+    assert data["title"] == "new_test_note"
 
 
-def test_delete_tag(client, token):
+def test_delete_note(client, token):
     response = client.delete(
-        "/api/tags/1",
+        "/api/notes/1",
         headers={"Authorization": f"Bearer {token}"}
     )
     assert response.status_code == 200, response.text
     data = response.json()
-    assert data["name"] == "new_test_tag"
-    assert "id" in data
+    assert data["title"] == "new_test_note"
 
 
-def test_repeat_delete_tag(client, token):
+def test_repeat_delete_note(client, token):
     response = client.delete(
-        "/api/tags/1",
+        "/api/notes/1",
         headers={"Authorization": f"Bearer {token}"}
     )
     assert response.status_code == 404, response.text
     data = response.json()
-    assert data["detail"] == "Tag not found"
+    assert data["detail"] == "Note not found"
+
+
+def test_export_notes_ndjson(client, token, tag_ids):
+    client.post(
+        "/api/notes",
+        json={"title": "exported", "description": "description", "tags": tag_ids},
+        headers={"Authorization": f"Bearer {token}"}
+    )
+    response = client.get(
+        "/api/notes/export",
+        headers={"Authorization": f"Bearer {token}"}
+    )
+    assert response.status_code == 200, response.text
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    notes = [json.loads(line) for line in response.text.splitlines()]
+    assert notes[-1]["title"] == "exported"
+    assert len(notes[-1]["tags"]) == len(tag_ids)
+
+
+def test_export_notes_csv(client, token):
+    response = client.get(
+        "/api/notes/export",
+        params={"format": "csv"},
+        headers={"Authorization": f"Bearer {token}"}
+    )
+    assert response.status_code == 200, response.text
+    rows = list(csv.DictReader(io.StringIO(response.text)))
+    assert rows[-1]["title"] == "exported"
+
+
+def test_export_notes_unknown_format(client, token):
+    response = client.get(
+        "/api/notes/export",
+        params={"format": "xml"},
+        headers={"Authorization": f"Bearer {token}"}
+    )
+    assert response.status_code == 422, response.text
+
+
+def test_get_notes_rate_limited(client, token):
+    rate_limits.buckets.clear()
+    for _ in range(10):
+        response = client.get("/api/notes", headers={"Authorization": f"Bearer {token}"})
+        assert response.status_code == 200, response.text
+    response = client.get("/api/notes", headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 429, response.text
+    assert 1 <= int(response.headers["Retry-After"]) <= 6
@@ -1,4 +1,4 @@
-from unittest.mock import MagicMock, patch
+from unittest.mock import patch
 
 import pytest
 
@@ -7,9 +7,7 @@ from src.services.auth import auth_service
 
 
 @pytest.fixture()
-def token(client, user, session, monkeypatch):
-    mock_send_email = MagicMock()
-    monkeypatch.setattr("src.routes.auth.send_email", mock_send_email)
+def token(client, user, session):
     client.post("/api/auth/signup", json=user)
     current_user: User = session.query(User).filter(User.email == user.get('email')).first()
     current_user.confirmed = True
@@ -125,3 +123,49 @@ def test_repeat_delete_tag(client, token):
         assert response.status_code == 404, response.text
         data = response.json()
         assert data["detail"] == "Tag not found"
+
+
+def test_get_tags_cursor(client, token):
+    for name in ("tag_a", "tag_c", "tag_b"):
+        client.post("/api/tags", json={"name": name}, headers={"Authorization": f"Bearer {token}"})
+    response = client.get(
+        "/api/tags?limit=2",
+        headers={"Authorization": f"Bearer {token}"}
+    )
+    assert response.status_code == 200, response.text
+    assert [tag["name"] for tag in response.json()] == ["tag_a", "tag_b"]
+    cursor = response.headers["X-Next-Cursor"]
+
+    response = client.get(
+        "/api/tags",
+        params={"limit": 2, "cursor": cursor},
+        headers={"Authorization": f"Bearer {token}"}
+    )
+    assert response.status_code == 200, response.text
+    assert [tag["name"] for tag in response.json()] == ["tag_c"]
+    assert "X-Next-Cursor" not in response.headers
+
+
+def test_get_tags_invalid_cursor(client, token):
+    response = client.get(
+        "/api/tags",
+        params={"cursor": "not-a-cursor"},
+        headers={"Authorization": f"Bearer {token}"}
+    )
+    assert response.status_code == 400, response.text
+    data = response.json()
+    assert data["detail"] == "Invalid cursor"
+
+
+def test_get_tags_not_modified(client, token):
+    headers = {"Authorization": f"Bearer {token}"}
+    etag = client.get("/api/tags", headers=headers).headers["ETag"]
+    response = client.get("/api/tags", headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 304, response.text
+    tag_id = client.post("/api/tags", json={"name": "tag_d"}, headers=headers).json()["id"]
+    response = client.get("/api/tags", headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 200, response.text
+    assert response.headers["ETag"] != etag
+    etag = response.headers["ETag"]
+    client.delete(f"/api/tags/{tag_id}", headers=headers)
+    assert client.get("/api/tags", headers={**headers, "If-None-Match": etag}).status_code == 200
@@ -0,0 +1,138 @@
+import asyncio
+import io
+
+import httpx
+import pytest
+from PIL import Image
+
+from src.database.models import User
+from src.services.auth import auth_service
+from src.services.avatars import avatar_uploader
+from src.services.cache import user_cache, user_versions
+
+
+@pytest.fixture()
+def self_contained_token(client, user, session, monkeypatch):
+    monkeypatch.setattr("src.settings.SELF_CONTAINED_TOKENS", True)
+    client.post("/api/auth/signup", json=user)
+    current_user: User = session.query(User).filter(User.email == user.get('email')).first()
+    current_user.confirmed = True
+    session.commit()
+    response = client.post(
+        "/api/auth/login",
+        data={"username": user.get('email'), "password": user.get('password')},
+    )
+    return response.json()["access_token"]
+
+
+def test_token_claims(self_contained_token, user):
+    payload = auth_service.decode_access_token(self_contained_token)
+    assert payload["sub"] == user["email"]
+    assert payload["username"] == user["username"]
+    assert payload["confirmed"] is True
+    assert isinstance(payload["uid"], int)
+    assert isinstance(payload["ver"], int)
+
+
+def test_read_users_me_without_sql(client, self_contained_token, user, queries):
+    user_cache.local.clear()
+    response = client.get("/api/users/me/", headers={"Authorization": f"Bearer {self_contained_token}"})
+    assert response.status_code == 200, response.text
+    assert response.json()["email"] == user["email"]
+    assert queries == []
+
+
+def test_read_users_me_stale_claims(client, self_contained_token, user, queries):
+    payload = auth_service.decode_access_token(self_contained_token)
+    asyncio.run(user_versions.bump(payload["uid"]))
+    user_cache.local.clear()
+    response = client.get("/api/users/me/", headers={"Authorization": f"Bearer {self_contained_token}"})
+    assert response.status_code == 200, response.text
+    assert response.json()["email"] == user["email"]
+    assert [statement for statement in queries if "FROM users" in statement]
+
+
+def test_read_users_me_plain_token(client, user):
+    response = client.post(
+        "/api/auth/login",
+        data={"username": user.get('email'), "password": user.get('password')},
+    )
+    token = response.json()["access_token"]
+    assert "uid" not in auth_service.decode_access_token(token)
+    response = client.get("/api/users/me/", headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200, response.text
+    assert response.json()["username"] == user["username"]
+
+
+@pytest.fixture()
+def image_host(monkeypatch):
+    # stand-in for the upload API of the image host
+    uploads = []
+
+    def handler(request):
+        uploads.append(request)
+        return httpx.Response(200, json={"version": 7, "public_id": "NotesApp/deadpool"})
+
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler), base_url="http://images.test")
+    monkeypatch.setattr(avatar_uploader, "client", client)
+    return uploads
+
+
+def png_bytes(color):
+    file = io.BytesIO()
+    Image.new("RGB", (400, 300), color).save(file, "PNG")
+    return file.getvalue()
+
+
+def test_update_avatar(client, self_contained_token, image_host):
+    response = client.patch("/api/users/avatar", headers={"Authorization": f"Bearer {self_contained_token}"},
+                            files={"file": ("me.png", png_bytes("red"), "image/png")})
+    assert response.status_code == 200, response.text
+    assert response.json()["avatar"].endswith("/v7/NotesApp/deadpool")
+    assert len(image_host) == 1
+    # resized before the upload
+    assert b"image/jpeg" in image_host[0].content
+
+
+def test_update_avatar_unchanged(client, self_contained_token, image_host, session, user):
+    response = client.patch("/api/users/avatar", headers={"Authorization": f"Bearer {self_contained_token}"},
+                            files={"file": ("me.png", png_bytes("red"), "image/png")})
+    assert response.status_code == 200, response.text
+    assert response.json()["avatar"].endswith("/v7/NotesApp/deadpool")
+    assert image_host == []
+    session.expire_all()
+    assert session.query(User).filter(User.email == user["email"]).one().avatar_hash
+
+
+def test_update_avatar_stale_cache(client, self_contained_token, image_host, session, user):
+    # another worker changed the avatar, the cached user still has the hash of the red picture
+    db_user = session.query(User).filter(User.email == user["email"]).one()
+    db_user.avatar_hash = "blue"
+    session.commit()
+    response = client.patch("/api/users/avatar", headers={"Authorization": f"Bearer {self_contained_token}"},
+                            files={"file": ("me.png", png_bytes("red"), "image/png")})
+    assert response.status_code == 200, response.text
+    assert len(image_host) == 1
+
+
+def test_update_avatar_not_an_image(client, self_contained_token, image_host):
+    response = client.patch("/api/users/avatar", headers={"Authorization": f"Bearer {self_contained_token}"},
+                            files={"file": ("me.png", b"png bytes", "image/png")})
+    assert response.status_code == 415, response.text
+    assert image_host == []
+
+
+def test_update_avatar_too_large(client, self_contained_token, image_host, monkeypatch):
+    monkeypatch.setattr(avatar_uploader, "max_size", 4)
+    response = client.patch("/api/users/avatar", headers={"Authorization": f"Bearer {self_contained_token}"},
+                            files={"file": ("me.png", b"png bytes", "image/png")})
+    assert response.status_code == 413, response.text
+    assert image_host == []
+
+
+def test_update_avatar_too_many_pixels(client, self_contained_token, image_host, monkeypatch):
+    monkeypatch.setattr(avatar_uploader, "max_pixels", 100 * 100)
+    response = client.patch("/api/users/avatar", headers={"Authorization": f"Bearer {self_contained_token}"},
+                            files={"file": ("me.png", png_bytes("green"), "image/png")})
+    assert response.status_code == 422, response.text
+    assert image_host == []
@@ -0,0 +1,124 @@
+import io
+import unittest
+
+import httpx
+from cloudinary.utils import api_sign_request
+from PIL import Image
+
+from src.services.avatars import AvatarDimensionsTooLarge, AvatarTooLarge, AvatarUploadError, AvatarUploader, \
+    InvalidAvatar, content_hash, resize_image
+
+
+def image_file(size=(800, 400), color="red", fmt="JPEG") -> io.BytesIO:
+    file = io.BytesIO()
+    Image.new("RGB", size, color).save(file, fmt)
+    file.seek(0)
+    return file
+
+
+def form_fields(request: httpx.Request) -> dict:
+    # the text fields of a multipart body, enough for the signed parameters
+    boundary = request.headers["content-type"].split("boundary=")[1].encode()
+    fields = {}
+    for part in request.content.split(b"--" + boundary):
+        head, _, value = part.partition(b"\r\n\r\n")
+        if b'name="' in head and b"filename=" not in head:
+            name = head.split(b'name="')[1].split(b'"')[0].decode()
+            fields[name] = value.rstrip(b"\r\n").decode()
+    return fields
+
+
+class TestAvatarUploader(unittest.IsolatedAsyncioTestCase):
+
+    def uploader(self, handler, max_size=1024, sizes=((250, 250),)):
+        client = httpx.AsyncClient(transport=httpx.MockTransport(handler), base_url="http://images.test")
+        return AvatarUploader(cloud_name="cloud", api_key=1234, api_secret="secret", max_size=max_size, timeout=5,
+                              max_connections=2, sizes=sizes, workers=1, client=client)
+
+    async def test_upload(self):
+        requests = []
+
+        def handler(request):
+            requests.append(request)
+            return httpx.Response(200, json={"version": 42, "public_id": "NotesApp/bob"})
+
+        uploader = self.uploader(handler)
+        result = await uploader.upload(io.BytesIO(b"image bytes"), "me.png", "image/png", "NotesApp/bob")
+        await uploader.close()
+
+        self.assertEqual(result["version"], 42)
+        request = requests[0]
+        self.assertEqual(request.url.path, "/v1_1/cloud/image/upload")
+        self.assertIn(b"image bytes", request.content)
+        fields = form_fields(request)
+        self.assertEqual(fields["api_key"], "1234")
+        signed = {name: fields[name] for name in ("public_id", "overwrite", "timestamp")}
+        self.assertEqual(fields["signature"], api_sign_request(signed, "secret"))
+        status = uploader.status()
+        self.assertEqual((status["uploads"], status["failures"], status["bytes_sent"]), (1, 0, 11))
+        self.assertEqual(sum(status["upload_time_histogram"].values()), 1)
+
+    async def test_too_large(self):
+        requests = []
+        uploader = self.uploader(lambda request: requests.append(request))
+        with self.assertRaises(AvatarTooLarge):
+            await uploader.upload(io.BytesIO(b"x" * 2048), "me.png", "image/png", "NotesApp/bob")
+        self.assertEqual(requests, [])
+
+    async def test_error_response(self):
+        uploader = self.uploader(lambda request: httpx.Response(401, json={"error": {"message": "bad signature"}}))
+        with self.assertRaises(AvatarUploadError):
+            await uploader.upload(io.BytesIO(b"image"), "me.png", "image/png", "NotesApp/bob")
+        self.assertEqual(uploader.status()["failures"], 1)
+
+    def test_url(self):
+        uploader = self.uploader(lambda request: None)
+        self.assertEqual(uploader.url("NotesApp/bob", version=42),
+                         "https://res.cloudinary.com/cloud/image/upload/v42/NotesApp/bob")
+
+    async def test_store(self):
+        requests = []
+
+        def handler(request):
+            requests.append(request)
+            return httpx.Response(200, json={"version": len(requests)})
+
+        uploader = self.uploader(handler, max_size=1024 * 1024, sizes=((250, 250), (64, 64)))
+        url, digest = await uploader.store(image_file(), "NotesApp/bob", None)
+        self.assertEqual(len(requests), 2)
+        self.assertTrue(url.endswith("/NotesApp/bob"))
+        self.assertEqual({request.content.split(b'name="public_id"\r\n\r\n')[1].split(b"\r\n")[0]
+                          for request in requests}, {b"NotesApp/bob", b"NotesApp/bob_64x64"})
+
+        # the same picture again: nothing is decoded or sent
+        self.assertIsNone(await uploader.store(image_file(), "NotesApp/bob", digest))
+        self.assertEqual(len(requests), 2)
+        self.assertEqual(uploader.status()["unchanged"], 1)
+        self.assertIsNotNone(await uploader.store(image_file(color="blue"), "NotesApp/bob", digest))
+
+    async def test_store_invalid_image(self):
+        uploader = self.uploader(lambda request: httpx.Response(200, json={"version": 1}))
+        with self.assertRaises(InvalidAvatar):
+            await uploader.store(io.BytesIO(b"not an image"), "NotesApp/bob", None)
+
+
+class TestResizeImage(unittest.TestCase):
+
+    def test_sizes(self):
+        images = resize_image(image_file(size=(1200, 600)), [(250, 250), (64, 32)])
+        self.assertEqual([Image.open(io.BytesIO(image)).size for image in images], [(250, 250), (64, 32)])
+
+    def test_smaller_than_size(self):
+        image, = resize_image(image_file(size=(100, 50), fmt="PNG"), [(250, 250)])
+        self.assertEqual(Image.open(io.BytesIO(image)).size, (250, 250))
+
+    def test_too_many_pixels(self):
+        with self.assertRaises(AvatarDimensionsTooLarge):
+            resize_image(image_file(size=(1200, 600)), [(250, 250)], max_pixels=1200 * 600 - 1)
+        self.assertEqual(len(resize_image(image_file(size=(1200, 600)), [(250, 250)], max_pixels=1200 * 600)), 1)
+
+    def test_content_hash(self):
+        file = image_file()
+        self.assertEqual(content_hash(file, [(250, 250)]), content_hash(image_file(), [(250, 250)]))
+        self.assertEqual(file.tell(), 0)
+        self.assertNotEqual(content_hash(file, [(250, 250)]), content_hash(file, [(128, 128)]))
@@ -1,7 +1,7 @@
 import unittest
 from datetime import datetime
-from unittest.mock import MagicMock, patch
-from sqlalchemy.orm import Session
+from unittest.mock import MagicMock, AsyncMock, patch
+from sqlalchemy.ext.asyncio import AsyncSession
 from src.repository.users import get_user_by_email, create_user, confirmed_email, update_avatar
 from src.database.models import User
 from src.schemas import UserModel, UserDb, UserResponse
@@ -9,22 +9,23 @@ from src.schemas import UserModel, UserDb, UserResponse
 
 class TestAuthControllers(unittest.IsolatedAsyncioTestCase):
     def setUp(self) -> None:
-        self.session = MagicMock(spec=Session)
+        self.session = AsyncMock(spec=AsyncSession)
+        self.session.execute.return_value = MagicMock()
 
     async def test_get_user_found(self):
         user = User()
-        self.session.query().filter().first.return_value = user
+        self.session.execute.return_value.scalars().first.return_value = user
         result = await get_user_by_email(email="test@mail.com", db=self.session)
         self.assertEqual(result, user)
 
     async def test_get_user_not_found(self):
-        self.session.query().filter().first.return_value = None
+        self.session.execute.return_value.scalars().first.return_value = None
         result = await get_user_by_email(email="test@mail.com", db=self.session)
         self.assertIsNone(result)
 
     async def test_confirm_email(self):
         user = User()
-        self.session.query().filter().first.return_value = user
+        self.session.execute.return_value.scalars().first.return_value = user
         result = await confirmed_email(email="test@mail.com", db=self.session)
         self.assertIsNone(result)
 
@@ -38,13 +39,17 @@ class TestAuthControllers(unittest.IsolatedAsyncioTestCase):
 
 class TestUserController(unittest.IsolatedAsyncioTestCase):
     def setUp(self) -> None:
-        self.session = MagicMock(spec=Session)
+        self.session = AsyncMock(spec=AsyncSession)
+        self.session.execute.return_value = MagicMock()
 
     async def test_update_avatar(self):
         email = "test@mail.com"
         url = "https://test.url"
-        result = await update_avatar(email=email, url=url, db=self.session)
+        with patch("src.repository.users.user_cache") as cache_mock:
+            cache_mock.invalidate = AsyncMock()
+            result = await update_avatar(email=email, url=url, db=self.session)
         self.assertEqual(result.avatar, url)
+        cache_mock.invalidate.assert_awaited_once_with(email)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,44 @@
+import asyncio
+import json
+import signal
+
+from src import settings
+from src.database.db import SessionLocal
+from src.services.mail import MailSender, mail_sender
+from src.services.outbox import create_outbox_worker
+
+
+async def log_status(sender: MailSender, interval: float) -> None:
+    """
+    The log_status function prints the status of the sender (batch latency, sent and failed emails)
+        every interval seconds, until it is cancelled.
+
+    :param sender: MailSender: The sender of the worker
+    :param interval: float: Seconds between two lines
+    :return: Nothing, runs until cancelled
+    :doc-author: AR
+    """
+    while True:
+        await asyncio.sleep(interval)
+        print(f"mail sender status: {json.dumps(sender.status())}")
+
+
+async def main():
+    # sends the emails queued by the web process (email_outbox table), run as: python worker.py
+    task = asyncio.create_task(create_outbox_worker(SessionLocal, mail_sender).run())
+    status = asyncio.create_task(log_status(mail_sender, settings.MAIL_STATUS_INTERVAL))
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, task.cancel)
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    finally:
+        status.cancel()
+        await mail_sender.close()
+        print(f"mail sender status: {json.dumps(mail_sender.status())}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())